@@ -1,10 +1,17 @@
 import dataclasses
 import functools
 import json
+import typing as ty
 
 from django.db import models
-from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.db.models.query import ModelIterable, QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+
+try:
+    # C encoder, that is several times faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class JsonResponse(HttpResponse):
@@ -36,16 +43,74 @@ def _(data: models.Model = None, **kwargs):
 
 @jsonify.register(QuerySet)  # type: ignore
 def _(data: QuerySet = None, **kwargs):
-    fields = _process_kwargs(data.model._meta, kwargs)
-    # TODO use .values()?
-    items = [_model_to_dict(x, fields) for x in data]
-    return JsonResponse(dict(items=items))
+    return StreamingJsonResponse(_iter_queryset(data, kwargs))
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Response with ``{"items": [...]}``, that is encoded chunk by chunk,
+    so memory usage doesn't depend on the number of items.
+    """
+
+    chunk_size = 2000
+
+    def __init__(self, items: ty.Iterable, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(self._encode(items), **kwargs)
+
+    def _encode(self, items: ty.Iterable) -> ty.Iterator[bytes]:
+        yield b'{"items": ['
+        chunk: ty.List[bytes] = []
+        sep = b""
+        for item in items:
+            chunk.append(dumps(item))
+            if len(chunk) >= self.chunk_size:
+                yield sep + b",".join(chunk)
+                chunk.clear()
+                sep = b","
+        if chunk:
+            yield sep + b",".join(chunk)
+        yield b"]}"
+
+
+def _iter_queryset(data: QuerySet, kwargs: dict) -> ty.Iterator:
+    """
+    Iterates rows of the queryset without caching them.
+    Plain fields are fetched with ``.values()``, model instances
+    are created only when non-field attributes are included.
+    """
+    chunk_size = StreamingJsonResponse.chunk_size
+    if data._iterable_class is not ModelIterable:
+        # .values() or .values_list() queryset
+        yield from data.iterator(chunk_size=chunk_size)
+        return
+    meta = data.model._meta
+    fields = _process_kwargs(meta, kwargs)
+    if fields - {x.name for x in meta.get_fields()}:
+        for obj in data.iterator(chunk_size=chunk_size):
+            yield _model_to_dict(obj, fields)
+        return
+    # relations are skipped, since model instances are not serializable
+    names = [x.name for x in meta.concrete_fields if not x.is_relation]
+    names = [x for x in names if x in fields]
+    for row in data.values(*names).iterator(chunk_size=chunk_size):
+        yield {k: v for k, v in row.items() if isinstance(v, serializable)}
+
+
+_missing = object()
 
 
 def _model_to_dict(mdl, fields):
     return {
         k: v
-        for k, v in ((field, getattr(mdl, field)) for field in fields)
+        # reverse relations are named without _set in the get_fields()
+        for k, v in ((field, getattr(mdl, field, _missing)) for field in fields)
         if isinstance(v, serializable)
     }
 
@@ -67,5 +132,7 @@ class DataclassExtras:
         kwargs = {}
         for field in dataclasses.fields(cls):
             name = field.name
+            if name not in data and field.default is not dataclasses.MISSING:
+                continue
             kwargs[name] = data[name]
         return cls(**kwargs)
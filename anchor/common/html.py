@@ -1,8 +1,16 @@
 """ Formatters from django DB to HTML structures. """
+import base64
+import binascii
+import html as _html
 import itertools
+import json
+import operator
 import typing as ty
+from urllib.parse import urlencode
 
+from django.core.exceptions import ValidationError
 from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connections, models
 from django.shortcuts import reverse
 from django.utils.safestring import mark_safe
 from django.views.generic.base import ContextMixin
@@ -27,18 +35,58 @@ class Flatter:
         self.sep = sep
 
     def __iter__(self):
-        for item in self._items:
-            if isinstance(item, str):
-                yield item
-            elif hasattr(item, "__iter__"):
-                yield from Flatter(obj=item)
+        # explicit stack instead of the nested generators,
+        # so the deep items don't pass through every level
+        stack = [iter(self._items)]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, str):
+                    yield item
+                elif hasattr(item, "__iter__"):
+                    stack.append(iter(item))
+                    break
+                else:
+                    yield str(item)
             else:
-                yield str(item)
+                stack.pop()
 
     def __str__(self):
         return self.sep.join(self)
 
 
+def escape(value) -> str:
+    """ Escapes the value, unless it's marked as safe. """
+    if hasattr(value, "__html__"):
+        return value.__html__()
+    return _html.escape(str(value))
+
+
+def escape_all(values: ty.Iterable) -> ty.List[str]:
+    """
+    Escapes the values with a single pass over the joined string.
+    Values shouldn't be marked as safe.
+    """
+    values = list(map(str, values))
+    joined = "\0".join(values)
+    if joined.count("\0") != len(values) - 1:
+        return [_html.escape(x) for x in values]
+    return _html.escape(joined).split("\0")
+
+
+# fields which values are rendered without the HTML special characters
+PLAIN_FIELDS = (
+    models.IntegerField,
+    models.AutoField,
+    models.FloatField,
+    models.DecimalField,
+    models.BooleanField,
+    models.DateField,
+    models.TimeField,
+    models.DurationField,
+    models.UUIDField,
+)
+
+
 class HtmlBase:
     def __init__(self, parent=None):
         self.parent = parent
@@ -50,6 +98,105 @@ class HtmlBase:
         return mark_safe(str(self.html()))
 
 
+class KeysetPage(list):
+    """ Page of items with cursors of the neighbour pages. """
+
+    def __init__(self, items, prev_cursor: str = None, next_cursor: str = None):
+        super().__init__(items)
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+
+class Keyset:
+    """
+    Keyset (cursor) pagination over the ordered column and primary key:
+    ``WHERE (column, pk) > (last column, last pk) ORDER BY column, pk LIMIT N``.
+    With the index on the column every page costs the same.
+    Cursor is an opaque string with the column value and pk of the boundary item.
+    """
+
+    def __init__(self, objects: models.QuerySet, ordering: str):
+        self.objects = objects
+        self.descending = ordering.startswith("-")
+        name = ordering.lstrip("-")
+        meta = objects.model._meta
+        self.field = meta.pk if name == "pk" else meta.get_field(name)
+        self.unique = self.field.primary_key
+
+    def ordered(self, reverse=False) -> models.QuerySet:
+        prefix = "-" if self.descending != reverse else ""
+        keys = [self.field.name] if self.unique else [self.field.name, "pk"]
+        return self.objects.order_by(*(prefix + x for x in keys))
+
+    def encode(self, obj) -> str:
+        key = [self.field.value_to_string(obj)]
+        if not self.unique:
+            key.append(obj.pk)
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def decode(self, cursor: str) -> ty.Tuple[ty.Any, ty.Any]:
+        """ Returns column value and pk from the cursor. """
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value = self.field.to_python(key[0])
+            pk = None if self.unique else key[1]
+        except (binascii.Error, ValueError, ValidationError, IndexError, TypeError):
+            raise exceptions.NotFound("Invalid cursor") from None
+        return value, pk
+
+    def after(self, cursor: str, reverse=False) -> models.Q:
+        """ Returns condition for the items after (or before) the cursor. """
+        value, pk = self.decode(cursor)
+        op = "lt" if self.descending != reverse else "gt"
+        name = self.field.name
+        if self.unique:
+            return models.Q(**{f"{name}__{op}": value})
+        return models.Q(**{f"{name}__{op}": value}) | models.Q(
+            **{name: value, f"pk__{op}": pk}
+        )
+
+    def page(self, size: int, after: str = None, before: str = None) -> KeysetPage:
+        if before:
+            items = list(
+                self.ordered(reverse=True).filter(self.after(before, True))[: size + 1]
+            )
+            has_prev = len(items) > size
+            items = items[:size][::-1]
+            has_next = True
+        else:
+            query = self.ordered()
+            if after:
+                query = query.filter(self.after(after))
+            items = list(query[: size + 1])
+            has_next = len(items) > size
+            items = items[:size]
+            has_prev = bool(after)
+        return KeysetPage(
+            items,
+            prev_cursor=self.encode(items[0]) if items and has_prev else None,
+            next_cursor=self.encode(items[-1]) if items and has_next else None,
+        )
+
+
+def estimate_count(objects: models.QuerySet, limit=1000) -> ty.Tuple[int, bool]:
+    """
+    Returns number of items and whether it's exact.
+    PostgreSQL estimates it with the query planner,
+    other databases count at most *limit* rows.
+    """
+    connection = connections[objects.db]
+    if connection.vendor == "postgresql":
+        sql, params = objects.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), False
+    count = objects.order_by()[: limit + 1].count()
+    return min(count, limit), count <= limit
+
+
 class Table(HtmlBase):
     """
     Formatter that renders ResultSet
@@ -58,6 +205,18 @@ class Table(HtmlBase):
     Attributes:
     - Fields: List of entity field names to include,
       could be set as class variable and/or could be overriden in __init__.
+    - keyset: column for the keyset pagination (like "-id"),
+      that should be indexed. Pages are navigated with the
+      ``after`` and ``before`` cursors instead of the page numbers,
+      so the deep pages cost the same as the first one.
+    - estimate_count: show estimated number of items in the keyset mode.
+    - formatters: field name -> function that renders the value as HTML,
+      values of other fields are escaped.
+    - labels: field name -> column name, instead of the verbose name.
+
+    Tables that don't override ``rows`` are rendered with the compiled
+    row template, and the values are fetched with ``values_list``
+    when possible, so the model instances aren't created at all.
     """
 
     fields: ty.List[str] = []
@@ -67,11 +226,17 @@ class Table(HtmlBase):
     paginator: Paginator = None
     page: Page = None
     size: int = 20
+    max_size = 100
+    keyset: ty.Optional[str] = None
+    estimate_count = False
+    formatters: ty.Mapping[str, ty.Callable[[ty.Any], str]] = {}
+    labels: ty.Mapping[str, str] = {}
 
     def __init__(self, value, fields: ty.List[str] = None, request=None, paginate=True):
         if value is None:
             raise ValueError("'value' could not be None")
         self.request = request
+        self.count: ty.Optional[ty.Tuple[int, bool]] = None
         self.objects = self._build_page(value) if paginate else value
         self.model = value.model
         self.model_fields = self.model._meta.fields
@@ -83,7 +248,13 @@ class Table(HtmlBase):
             data = fields
             self.model_fields.sort(key=lambda x: data.index(x.name))
 
+    @property
+    def paginated(self) -> bool:
+        return self.paginator is not None or isinstance(self.page, KeysetPage)
+
     def _build_page(self, objects):
+        if self.keyset:
+            return self._build_keyset_page(objects)
         request = self.request.GET if self.request else {}
         page_num, self.size = request.get("page", 1), request.get("size", 20)
         if not objects.ordered:
@@ -95,10 +266,23 @@ class Table(HtmlBase):
             raise exceptions.NotFound() from None
         return self.page
 
+    def _build_keyset_page(self, objects):
+        request = self.request.GET if self.request else {}
+        try:
+            self.size = min(int(request.get("size", self.size)), self.max_size)
+        except ValueError:
+            raise exceptions.NotFound() from None
+        if self.estimate_count:
+            self.count = estimate_count(objects)
+        self.page = Keyset(objects, self.keyset).page(
+            self.size, after=request.get("after"), before=request.get("before")
+        )
+        return self.page
+
     def head(self) -> ty.Iterator[str]:
         """ Column names. """
         for field in self.model_fields:
-            yield field.verbose_name.capitalize()
+            yield self.labels.get(field.name, field.verbose_name.capitalize())
 
     def _head(self) -> ty.Iterable:
         yield "<thead>"
@@ -124,6 +308,67 @@ class Table(HtmlBase):
             yield "<tr>", map("<td>{}</td>".format, row), "</tr>"
         yield "</tbody>"
 
+    def _values(self) -> ty.Tuple[ty.Sequence[ty.Sequence], bool]:
+        """
+        Field values of the objects, as tuples,
+        and whether they are raw database values.
+        """
+        objects = self.objects
+        if isinstance(objects, Page):
+            objects = objects.object_list
+        names = [x.name for x in self.model_fields]
+        if (
+            isinstance(objects, models.QuerySet)
+            # pylint: disable=protected-access
+            and objects._result_cache is None
+            and not any(x.is_relation for x in self.model_fields)
+        ):
+            return list(objects.values_list(*names)), True
+        getter = operator.attrgetter(*names)
+        if len(names) == 1:
+            return [(getter(x),) for x in objects], False
+        return list(map(getter, objects)), False
+
+    def _columns(self, rows: ty.Sequence[ty.Sequence], raw: bool) -> ty.List:
+        """
+        Renders the values column by column, so every column
+        picks its formatter once. Raw values of the plain fields
+        go to the row template as they are.
+        """
+        columns = []
+        for field, column in zip(self.model_fields, zip(*rows)):
+            func = self.formatters.get(field.name)
+            if func:
+                column = list(map(func, column))
+            elif not raw:
+                column = list(map(escape, column))
+            elif not isinstance(field, PLAIN_FIELDS):
+                column = escape_all(column)
+            columns.append(column)
+        return columns
+
+    def _compiled_html(self) -> str:
+        rows, raw = self._values()
+        if not rows:
+            return self._empty()
+        fmt = ("<tr>" + "<td>{}</td>" * len(self.model_fields) + "</tr>").format
+        body = itertools.starmap(fmt, zip(*self._columns(rows, raw)))
+        head = "".join(f"<th>{x}</th>" for x in self.head())
+        table = [
+            '<table class="table">',
+            f"<thead>{head}</thead>",
+            "<tbody>",
+            "\n".join(body),
+            "</tbody>",
+            "</table>",
+        ]
+        if self.paginated:
+            table.append(str(self.page_info()))
+        return "\n".join(table)
+
+    def _empty(self) -> str:
+        return '<p style="align: center;">{}</p>'.format(str(self.empty_msg))
+
     def _get_reverse(self):
         if not (self.reverse_link or self.request):
             raise ValueError(
@@ -134,6 +379,8 @@ class Table(HtmlBase):
         return self.request.path
 
     def page_info(self) -> Flatter:
+        if isinstance(self.page, KeysetPage):
+            return self._keyset_info()
         page = self.page
         items = ["page {} of {}".format(page.number, self.paginator.num_pages)]
         a_icon = '<a href="%s?page={}">{}</a>' % self._get_reverse()
@@ -145,14 +392,33 @@ class Table(HtmlBase):
             '<div class="row centered"><p>', " ".join(items), "</p></div>", sep=""
         )
 
+    def _keyset_info(self) -> Flatter:
+        page = self.page
+        items = []
+        if self.count is not None:
+            count, exact = self.count
+            items.append(f"{count} items" if exact else f"~{count} items")
+        link = '<a href="%s?{}">{}</a>' % self._get_reverse()
+        if page.prev_cursor:
+            query = urlencode(dict(before=page.prev_cursor, size=self.size))
+            items.insert(0, link.format(query, "prev"))
+        if page.next_cursor:
+            query = urlencode(dict(after=page.next_cursor, size=self.size))
+            items.append(link.format(query, "next"))
+        return Flatter(
+            '<div class="row centered"><p>', " ".join(items), "</p></div>", sep=""
+        )
+
     def html(self):
+        if type(self).rows is Table.rows:
+            return self._compiled_html()
         if self.objects:
             table = ['<table class="table">', self._head(), self._body(), "</table>"]
-            if self.paginator:
+            if self.paginated:
                 table.append(self.page_info())
             return Flatter(obj=table)
         else:
-            return '<p style="align: center;">{}</p>'.format(str(self.empty_msg))
+            return self._empty()
 
 
 class Sidebar(HtmlBase):
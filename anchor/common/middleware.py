@@ -4,10 +4,15 @@ import functools
 import inspect
 import logging
 import typing as ty
+from importlib import import_module
 
+from django.conf import settings
+from django.contrib import auth
 from django.contrib.auth.views import redirect_to_login
-from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, QueryDict
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed
 from django.http.response import HttpResponseBase
+from django.urls import Resolver404, resolve
+from django.utils.functional import SimpleLazyObject
 
 from .. import exceptions
 from . import helpers
@@ -35,9 +40,11 @@ class ExtraMiddleware:
         return self._wrap_json(response)
 
     def process_view(self, request, view_func, view_args, view_kwargs) -> HttpResponse:
-        binder = RequestBinder(request, existing_kwargs=view_kwargs)
+        handlers = getattr(view_func, "upload_handlers", None)
+        if handlers:
+            request.upload_handlers = [handler(request) for handler in handlers]
         try:
-            kwargs = binder.bind_view(view_func)
+            kwargs = BindingPlan.for_view(view_func).bind(request, view_kwargs)
             if isinstance(kwargs, HttpResponseNotAllowed):
                 return kwargs
             view_kwargs.update(kwargs)
@@ -63,6 +70,46 @@ class ExtraMiddleware:
             return exception.to_response()
 
 
+class FastPathMiddleware:
+    """
+    Middleware that serves GET and HEAD requests to the package-serving routes
+    (prefixes from the ``ANCHOR_FAST_PATHS`` setting) by itself,
+    skipping the rest of the middleware stack: sessions, CSRF,
+    messages and ExtraMiddleware with its parameters binding.
+
+    Views get URL parameters only, and the user is resolved lazily,
+    so anonymous requests to public packages don't touch
+    the sessions or users at all.
+    Place it right after the SecurityMiddleware.
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.prefixes = tuple(getattr(settings, "ANCHOR_FAST_PATHS", ()))
+        self.session_store = import_module(settings.SESSION_ENGINE).SessionStore
+
+    def __call__(self, request) -> HttpResponse:
+        if request.method not in {"GET", "HEAD"} or not request.path_info.startswith(
+            self.prefixes
+        ):
+            return self.get_response(request)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            # e.g. missing trailing slash, that is handled by the CommonMiddleware
+            return self.get_response(request)
+        request.resolver_match = match
+        # session isn't loaded until the user is accessed, and never saved
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        request.session = self.session_store(session_key)
+        request.user = SimpleLazyObject(lambda: auth.get_user(request))
+        try:
+            return match.func(request, *match.args, **match.kwargs)
+        except exceptions.ServiceError as exception:
+            log.debug("Caught %r at fast path %s", exception, request.path_info)
+            return exception.to_response()
+
+
 class FunctionInfo:
     """
     Various information about function.
@@ -109,80 +156,126 @@ class FunctionInfo:
         return "{}({})".format(self.__class__.__name__, self)
 
 
-class RequestBinder:
+class BindingPlan:
     """
-    Class that can bind request data to the various classes, function params etc.
+    Precompiled binding of the request parameters to the callable:
+    list of (argument, request field, converter, default)
+    or the POST dataclass with its own plan.
+    Plans are built once per view (on the first request that resolves to it),
+    so requests just run a flat loop.
     """
 
-    def __init__(self, request: HttpRequest, existing_kwargs=None):
-        self.request = request
-        self.kwargs = existing_kwargs or {}
+    __slots__ = ("params", "post")
 
-    def bind_view(self, view: ty.Callable) -> ty.Union[dict, HttpResponseNotAllowed]:
-        """Binds request to the view function"""
-        info = FunctionInfo(view)
-        return self._bind(info)
+    # parameters that are passed by Django or belong to class-based views
+    view_exclude = frozenset({"self", "request", "args", "kwargs"})
 
-    def _bind(self, info: FunctionInfo) -> ty.Union[dict, HttpResponseNotAllowed]:
-        out = {}
-        params = info.signature.parameters
+    def __init__(self, params: list, post: ty.Tuple[ty.Callable, BindingPlan] = None):
+        self.params = params
+        self.post = post
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def for_view(cls, view: ty.Callable) -> BindingPlan:
+        params = FunctionInfo.from_cache(view).signature.parameters
         if "post" in params:
-            if self.request.method != "POST":
-                return HttpResponseNotAllowed(["POST"])
             # we've got the POST view, so we have to extract post annotation
             # and look at her signature
-            cls = params["post"].annotation
-            cls_args = self.bind_callable(cls)
-            out["post"] = cls(**cls_args)
-        else:
-            out = self.bind_params(
-                params, exclude={"self", "request", "args", "kwargs"}
-            )
-        return out
+            post_cls = params["post"].annotation
+            return cls([], post=(post_cls, cls.for_callable(post_cls)))
+        return cls.compile(params, exclude=cls.view_exclude)
 
-    def bind_callable(self, func: ty.Callable, exclude: ty.Container = None) -> dict:
-        params = cached_signature(func).parameters
-        return self.bind_params(params, exclude=exclude)
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def for_callable(cls, func: ty.Callable, exclude=frozenset()) -> BindingPlan:
+        return cls.compile(cached_signature(func).parameters, exclude=exclude)
 
-    def bind_params(self, params: ty.Mapping, exclude: ty.Container = None) -> dict:
-        """ Binds request to the provided params."""
-        exclude = exclude or set()
+    @classmethod
+    def compile(cls, params: ty.Mapping, exclude: ty.Container = ()) -> BindingPlan:
+        compiled = []
+        for name, param in params.items():
+            if name in exclude:
+                continue
+            field = name[:-1] if name.endswith("_") else name
+            compiled.append((name, field, converter(param.annotation), param.default))
+        return cls(compiled)
+
+    def bind(
+        self, request: HttpRequest, existing: ty.Container = ()
+    ) -> ty.Union[dict, HttpResponseNotAllowed]:
+        """
+        Returns arguments for the callable.
+        Arguments from *existing* (e.g. URL kwargs) are skipped.
+        """
+        if self.post is not None:
+            if request.method != "POST":
+                return HttpResponseNotAllowed(["POST"])
+            post_cls, plan = self.post
+            return {"post": post_cls(**plan.bind(request))}
         out = {}
-        items = self.request.GET or self.request.POST
-        for field, field_type, value in iter_params(items, params, exclude=exclude):
-            if field in self.kwargs:
+        if not self.params:
+            return out
+        items = request.GET or request.POST
+        empty = inspect.Parameter.empty
+        for name, field, convert, default in self.params:
+            if name in existing or field in existing:
                 # field already provided by another middleware
                 continue
+            value = items.getlist(field)
+            if not value and default is not empty:
+                continue
             try:
-                out[field] = convert_arg(value, field_type.annotation)
+                out[name] = convert(value)
             except IndexError as e:  # empty list - no param provided
                 raise exceptions.UserError(f"Parameter {field!r} not provided") from e
         return out
 
 
-def iter_params(
-    items: QueryDict, params: ty.Mapping[str, ty.Any], exclude: ty.Container[str] = None
-) -> ty.Iterator[ty.Tuple[str, inspect.Parameter, ty.Any]]:
+class RequestBinder:
     """
-    Yields field name, field type annotation and the items[value].
-    Accepts:
-
+    Class that can bind request data to the various classes, function params etc.
     """
-    exclude = exclude or set()
-    for field, field_type in params.items():
-        if field in exclude:
-            continue
-        if field.endswith("_"):
-            field = field[:-1]
-        value = items.getlist(field)
-        yield (field, field_type, value)
+
+    def __init__(self, request: HttpRequest, existing_kwargs=None):
+        self.request = request
+        self.kwargs = existing_kwargs or {}
+
+    def bind_view(self, view: ty.Callable) -> ty.Union[dict, HttpResponseNotAllowed]:
+        """Binds request to the view function"""
+        return BindingPlan.for_view(view).bind(self.request, self.kwargs)
+
+    def bind_callable(self, func: ty.Callable, exclude: ty.Container = None) -> dict:
+        plan = BindingPlan.for_callable(func, exclude=frozenset(exclude or ()))
+        return plan.bind(self.request, self.kwargs)
+
+    def bind_params(self, params: ty.Mapping, exclude: ty.Container = None) -> dict:
+        """ Binds request to the provided params."""
+        return BindingPlan.compile(params, exclude or ()).bind(
+            self.request, self.kwargs
+        )
+
+
+def _first(arg: ty.List[str]):
+    return arg[0]
+
+
+def _all(arg: ty.List[str]):
+    return arg
+
+
+def converter(val_type) -> ty.Callable[[ty.List[str]], ty.Any]:
+    """ Returns function that converts list of request values to the val_type. """
+    if val_type in {str, "str"} or val_type is inspect.Signature.empty:
+        return _first
+    # List[str] and others
+    origin = getattr(val_type, "__origin__", val_type)
+    if isinstance(origin, type) and issubclass(origin, ty.Iterable):
+        return _all
+    if not callable(val_type):
+        # string annotation (from __future__ import annotations)
+        return _first
+    return lambda arg: val_type(arg[0])
 
 
 def convert_arg(arg: ty.List[str], val_type: ty.Type):
-    if val_type in {str, "str"}:
-        return arg[0]
-    if issubclass(val_type, ty.Iterable):
-        return arg
-    if val_type is inspect.Signature.empty:
-        return arg[0]
-    return val_type(arg[0])
+    return converter(val_type)(arg)
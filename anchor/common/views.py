@@ -5,32 +5,79 @@ import base64
 import functools
 
 from allauth.account.forms import LoginForm
-from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
 from django.http import HttpResponse
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 
 from .. import exceptions
+from ..users.auth import authenticate
 
-__all__ = ["basic_auth"]
+__all__ = ["basic_auth", "lazy_user", "upload_handlers"]
 
 
-def basic_auth(func):
-    """Decorator that wraps view behind HTTP basic authorization."""
+def basic_auth(func=None, *, scope: str = None, required=True):
+    """
+    Decorator that wraps view behind HTTP basic authorization.
+
+    - *scope*: API token scope required by the view ("read" or "upload");
+    - *required*: if False, anonymous requests are passed to the view
+      and credentials are checked only when the view accesses ``request.user``.
+    """
+    if func is None:
+        return functools.partial(basic_auth, scope=scope, required=required)
     if not callable(func):
         return _auth(func)
 
     @functools.wraps(func)
     def wrapper(request, *args, **kwargs):
+        if not required:
+            if "HTTP_AUTHORIZATION" in request.META:
+                request.user = lazy_user(request, getattr(request, "user", None))
+            return func(request, *args, **kwargs)
         result = _auth(request)
         if result is None:
             return HttpResponse("No authentication form provided", status=401)
         if not result:
             return HttpResponse("Invalid credentials", status=401)
+        token = getattr(result, "api_token", None)
+        if scope and token and not token.allows(scope):
+            return HttpResponse(f"Token has no {scope!r} scope", status=403)
         return func(request, *args, **kwargs)
 
     return wrapper
 
 
+def upload_handlers(*handlers):
+    """
+    Decorator that replaces upload handlers for the view.
+    Handlers are installed by ExtraMiddleware before request body is parsed.
+    """
+
+    def decorator(func):
+        func.upload_handlers = handlers
+        return func
+
+    return decorator
+
+
+def lazy_user(request, fallback=None) -> SimpleLazyObject:
+    """
+    User from the Authorization header, that is authenticated on the first access.
+    If there are no valid credentials, *fallback* user
+    (or the anonymous one) is used.
+    Token scopes aren't checked, so use it only for reading.
+    """
+
+    def resolve():
+        user = _auth(request)
+        if user:
+            return user
+        return fallback if fallback is not None else AnonymousUser()
+
+    return SimpleLazyObject(resolve)
+
+
 def _auth(request):
     """
     Tries to authorize the user.
@@ -42,10 +89,15 @@ def _auth(request):
     header = request.META.get("HTTP_AUTHORIZATION")
     if not header:
         return None
-    header = header.split()[1]
-    login, password = base64.b64decode(header).decode().split(":")
-    user = auth.authenticate(request, username=login, password=password)
+    try:
+        value = base64.b64decode(header.split()[1]).decode()
+    except (IndexError, ValueError):
+        return False
+    login, sep, password = value.partition(":")
+    if not sep:
+        return False
+    user = authenticate(request, login, password)
     if not user:
         return False
-    auth.login(request, user)
+    request.user = user
     return user
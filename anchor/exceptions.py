@@ -23,5 +23,11 @@ class Forbidden(ServiceError):
     status_code = 403
 
 
+class UpstreamError(ServiceError):
+    """ Upstream index is not available. """
+
+    status_code = 502
+
+
 class LoginRedirect(AnchorException):
     pass
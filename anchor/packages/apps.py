@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PackagesConfig(AppConfig):
     name = "anchor.packages"
+
+    def ready(self):
+        from . import signals  # noqa pylint: disable=unused-import
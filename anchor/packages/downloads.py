@@ -0,0 +1,281 @@
+"""
+Package files delivery.
+
+The transfer could be offloaded to the front proxy
+with the ``PACKAGES_DOWNLOAD_OFFLOAD`` setting:
+
+- ``nginx``: response with ``X-Accel-Redirect`` header, that points at
+  ``PACKAGES_DOWNLOAD_ACCEL_PREFIX`` + file path relative to the MEDIA_ROOT
+  (prefix should be an ``internal`` location in the nginx config);
+- ``sendfile``: response with ``X-Sendfile`` header with the absolute file path
+  (Apache mod_xsendfile, lighttpd, uWSGI ``offload-threads``);
+- empty (default): file is streamed by Django. WSGI servers that provide
+  ``wsgi.file_wrapper`` (uWSGI, gunicorn) send it with ``sendfile(2)``.
+
+Access checks are done in Django anyway.
+Conditional requests (``If-None-Match``, ``If-Modified-Since``)
+are answered before the transfer. ``Range`` requests are handled
+by Django only for streamed files, since proxies handle them on their own.
+
+Downloads are counted in the in-process buffer (:data:`counter`),
+that is flushed to the database by the background thread every
+``PACKAGES_DOWNLOADS_FLUSH_INTERVAL`` seconds and on the process exit,
+so the download itself doesn't write anything.
+"""
+import atexit
+import collections
+import logging
+import mimetypes
+import re
+import threading
+import time
+import typing as ty
+from urllib.parse import quote
+
+from django import http
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .. import exceptions
+from .models import DownloadStats, Package, PackageFile
+
+__all__ = ["serve", "send_file", "DownloadCounter", "counter"]
+
+log = logging.getLogger(__name__)
+
+# see django.http.FileResponse.set_headers
+_encodings = {
+    "bzip2": "application/x-bzip",
+    "gzip": "application/gzip",
+    "xz": "application/x-xz",
+}
+
+
+def content_type(filename: str) -> str:
+    mimetype, encoding = mimetypes.guess_type(filename)
+    # encoding isn't set to prevent clients from uncompressing files
+    return _encodings.get(encoding, mimetype) or "application/octet-stream"
+
+
+class Unsatisfiable(ValueError):
+    """ Requested range is outside of the file. """
+
+
+_range = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> ty.Optional[ty.Tuple[int, int]]:
+    """
+    Parses Range header with a single byte range.
+    Returns first and last (inclusive) byte positions,
+    or None if header should be ignored (missing, malformed or has many ranges).
+    """
+    match = _range.match(header.replace(" ", ""))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range: last N bytes
+        if not last:
+            return None
+        if not int(last):
+            raise Unsatisfiable(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise Unsatisfiable(header)
+    return start, end
+
+
+def requested_range(request, size: int, etag=None, last_modified=None):
+    """ Returns byte range from the request, taking If-Range into account. """
+    header = request.META.get("HTTP_RANGE")
+    if not header:
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range:
+        if if_range.startswith(('"', "W/")):
+            matches = etag is not None and if_range == etag
+        else:
+            matches = parse_http_date_safe(if_range) == last_modified
+        if not matches:
+            # file has changed, so client gets the whole new file
+            return None
+    return parse_range(header, size)
+
+
+def serve(request, pkg_file: PackageFile) -> http.response.HttpResponseBase:
+    """
+    Download view body: checks access, answers conditional
+    and range requests, and counts complete downloads.
+    ETag is the file sha256 if it's known.
+    """
+    if not pkg_file.package.has_permission(request.user, "read"):
+        raise exceptions.Forbidden
+    sha256 = getattr(pkg_file, "sha256", None)
+    etag = quote_etag(sha256) if sha256 else None
+    last_modified = int(pkg_file.uploaded.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = send_file(pkg_file, request, etag=etag, last_modified=last_modified)
+    if etag:
+        response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if response.status_code == 200:
+        counter.add(pkg_file)
+    return response
+
+
+def send_file(
+    pkg_file: PackageFile, request=None, etag=None, last_modified=None
+) -> http.response.HttpResponseBase:
+    """ Creates response with the package file contents. """
+    mode = getattr(settings, "PACKAGES_DOWNLOAD_OFFLOAD", None)
+    ctype = content_type(pkg_file.filename)
+    if mode == "nginx":
+        response = http.HttpResponse(content_type=ctype)
+        prefix = settings.PACKAGES_DOWNLOAD_ACCEL_PREFIX.rstrip("/")
+        response["X-Accel-Redirect"] = quote(f"{prefix}/{pkg_file.fileobj.name}")
+    elif mode == "sendfile":
+        response = http.HttpResponse(content_type=ctype)
+        response["X-Sendfile"] = str(pkg_file.path)
+    else:
+        if mode:
+            log.warning("Unknown download offload mode %r", mode)
+        size = pkg_file.path.stat().st_size
+        try:
+            byte_range = request and requested_range(request, size, etag, last_modified)
+        except Unsatisfiable:
+            response = http.HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if byte_range:
+            response = partial_response(pkg_file, byte_range, size, ctype)
+        else:
+            # file opened by absolute path provides Content-Length and fileno()
+            response = http.FileResponse(pkg_file.path.open("rb"), content_type=ctype)
+        response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def partial_response(pkg_file: PackageFile, byte_range, size: int, ctype: str):
+    """ 206 response with the part of the file. """
+    start, end = byte_range
+    length = end - start + 1
+
+    def chunks(block_size=http.FileResponse.block_size):
+        with pkg_file.path.open("rb") as fd:
+            fd.seek(start)
+            left = length
+            while left > 0:
+                chunk = fd.read(min(left, block_size))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+
+    response = http.StreamingHttpResponse(chunks(), status=206, content_type=ctype)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = length
+    return response
+
+
+class DownloadCounter:
+    """
+    Buffer of download counters.
+    Collects downloads in memory and writes aggregated deltas
+    with ``UPDATE ... SET downloads = downloads + N`` queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (package id, file id, day) -> downloads
+        self._counts: ty.Counter[tuple] = collections.Counter()
+        self._thread: ty.Optional[threading.Thread] = None
+
+    @property
+    def interval(self) -> float:
+        return getattr(settings, "PACKAGES_DOWNLOADS_FLUSH_INTERVAL", 0)
+
+    def add(self, pkg_file: PackageFile):
+        """ Counts download of the package file. """
+        key = (pkg_file.package_id, pkg_file.id, timezone.localdate())
+        with self._lock:
+            self._counts[key] += 1
+            if self.interval and self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="download-counter", daemon=True
+                )
+                self._thread.start()
+
+    def pending(self) -> int:
+        """ Number of downloads that are not written yet. """
+        return sum(self._counts.values())
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def flush(self) -> int:
+        """ Writes buffered counters to the database. """
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        if not counts:
+            return 0
+        try:
+            self._write(counts)
+        except Exception:
+            # return counters back to the buffer, they'll be written next time
+            with self._lock:
+                self._counts.update(counts)
+            raise
+        return sum(counts.values())
+
+    def _write(self, counts: ty.Counter[tuple]):
+        packages: ty.Counter[int] = collections.Counter()
+        files: ty.Counter[tuple] = collections.Counter()
+        for (pkg_id, file_id, day), count in counts.items():
+            packages[pkg_id] += count
+            files[file_id, day] += count
+        # files could be removed while their downloads were buffered
+        file_ids = {file_id for file_id, _ in files}
+        existing = set(
+            PackageFile.objects.filter(id__in=file_ids).values_list("id", flat=True)
+        )
+        with transaction.atomic():
+            for pkg_id, count in packages.items():
+                Package.objects.filter(id=pkg_id).update(
+                    downloads=models.F("downloads") + count
+                )
+            for (file_id, day), count in files.items():
+                if file_id in existing:
+                    DownloadStats.add(file_id, day, count)
+        log.debug(
+            "Written %s downloads of %s files", sum(packages.values()), len(files)
+        )
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to write download counters")
+            finally:
+                connections.close_all()
+
+    def _exit(self):
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Lost %s downloads on exit", self.pending())
+
+
+counter = DownloadCounter()
+atexit.register(counter._exit)  # pylint: disable=protected-access
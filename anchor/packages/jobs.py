@@ -0,0 +1,187 @@
+"""
+Background jobs, stored in the database (see :class:`~.models.Job`).
+
+Tasks are plain functions registered with :func:`task`
+and queued with :func:`enqueue`, their arguments should be JSON-serializable::
+
+    @task(priority=10)
+    def remove_unused_blob(blob_id: int):
+        ...
+
+    enqueue(remove_unused_blob, blob.id)
+
+With ``PACKAGES_JOBS_ASYNC`` enabled, jobs are inserted in the current
+transaction and run by ``manage.py run_jobs`` workers after the commit,
+otherwise tasks are called right after the commit, by the process itself.
+
+Workers take jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``
+(or with the conditional update on SQLite), so any number of them
+could run in parallel. Failed jobs are retried with the exponential delay,
+jobs of the dead workers are returned to the queue
+after ``PACKAGES_JOBS_TIMEOUT`` seconds.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import typing as ty
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Job
+
+__all__ = ["task", "enqueue", "run", "Worker"]
+
+log = logging.getLogger(__name__)
+
+_tasks: ty.Dict[str, ty.Callable] = {}
+
+
+def task(func: ty.Callable = None, *, priority: int = 0, max_attempts: int = 3):
+    """ Registers function as a task, that could be queued. """
+
+    def register(func):
+        func.job_name = f"{func.__module__}.{func.__qualname__}"
+        func.job_priority = priority
+        func.job_max_attempts = max_attempts
+        _tasks[func.job_name] = func
+        return func
+
+    return register(func) if func is not None else register
+
+
+def is_async() -> bool:
+    return getattr(settings, "PACKAGES_JOBS_ASYNC", False)
+
+
+def enqueue(
+    func: ty.Callable, *args, key: str = "", delay: timedelta = None, **kwargs
+) -> ty.Optional[Job]:
+    """
+    Runs the task after the current transaction is committed.
+    Returns queued job, or None if the task is called by this process
+    (or the job with the same key is queued already).
+    """
+    if not is_async():
+        transaction.on_commit(lambda: func(*args, **kwargs))
+        return None
+    return Job.objects.enqueue(
+        func.job_name,
+        args,
+        kwargs,
+        key=key,
+        priority=func.job_priority,
+        delay=delay,
+        max_attempts=func.job_max_attempts,
+    )
+
+
+def run(job: Job) -> Job:
+    """ Runs claimed job, failed one is queued again if it has attempts left. """
+    started = time.monotonic()
+    try:
+        func = _tasks.get(job.task)
+        if func is None:
+            raise LookupError(f"Unknown task {job.task}")
+        arguments = job.arguments
+        func(*arguments["args"], **arguments["kwargs"])
+        job.status, job.error = Job.DONE, ""
+    except Exception as e:  # pylint: disable=broad-except
+        log.exception("%s failed", job)
+        job.error = repr(e)
+        if job.attempts < job.max_attempts:
+            retry = getattr(settings, "PACKAGES_JOBS_RETRY_DELAY", 10)
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(
+                seconds=retry * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = Job.FAILED
+    finally:
+        job.duration = timedelta(seconds=time.monotonic() - started)
+        job.save(update_fields=["status", "error", "run_after", "duration"])
+    log.info("%s %s in %.3fs", job, job.status, job.duration.total_seconds())
+    return job
+
+
+class Worker:
+    """ Runs queued jobs in the pool of threads. """
+
+    # seconds between requeues of the stale jobs
+    cleanup_interval = 60
+
+    def __init__(self, threads: int = 1, interval: float = 1.0):
+        self.threads = threads
+        self.interval = interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopped = threading.Event()
+
+    @property
+    def timeout(self) -> timedelta:
+        return timedelta(seconds=getattr(settings, "PACKAGES_JOBS_TIMEOUT", 3600))
+
+    @property
+    def keep(self) -> timedelta:
+        return timedelta(seconds=getattr(settings, "PACKAGES_JOBS_KEEP", 86400))
+
+    def run_pending(self) -> int:
+        """ Runs due jobs in the current thread, until there are none. """
+        count = 0
+        while not self.stopped.is_set():
+            job = Job.objects.claim(f"{self.name}:{threading.get_ident()}")
+            if job is None:
+                break
+            run(job)
+            count += 1
+        return count
+
+    def cleanup(self):
+        requeued = Job.objects.requeue_stale(self.timeout)
+        pruned = Job.objects.prune(self.keep)
+        if requeued or pruned:
+            log.info("Requeued %s stale jobs, removed %s done ones", requeued, pruned)
+
+    def serve(self, once=False):
+        """ Runs jobs in the threads, until stopped (or queue is empty, if once). """
+        self.cleanup()
+        pool = [
+            threading.Thread(
+                target=self._loop, args=(once,), name=f"jobs-{x}", daemon=True
+            )
+            for x in range(self.threads)
+        ]
+        for thread in pool:
+            thread.start()
+        cleaned = time.monotonic()
+        try:
+            while any(x.is_alive() for x in pool):
+                for thread in pool:
+                    thread.join(self.interval)
+                # housekeeping is done by the main thread
+                if not once and time.monotonic() - cleaned > self.cleanup_interval:
+                    self.cleanup()
+                    cleaned = time.monotonic()
+        finally:
+            self.stop()
+            for thread in pool:
+                thread.join()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _loop(self, once: bool):
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.run_pending()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("Failed to take a job")
+                if once:
+                    break
+                self.stopped.wait(self.interval)
+        finally:
+            connections.close_all()
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+import humanize
+from django.core.management.base import BaseCommand
+
+from ...models import Blob
+
+
+class Command(BaseCommand):
+    help = "Removes unused blobs and files left by failed uploads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=60,
+            help="Keep files younger than this number of minutes (default: 60)",
+        )
+
+    def handle(self, *args, grace=60, **options):
+        result = Blob.objects.collect(grace=timedelta(minutes=grace))
+        self.stdout.write(
+            "Removed {blobs} blobs and {files} unknown files, freed {size}".format(
+                blobs=result["blobs"],
+                files=result["files"],
+                size=humanize.naturalsize(result["size"]),
+            )
+        )
@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ...jobs import Worker
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (PACKAGES_JOBS_ASYNC should be enabled)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-t", "--threads", type=int, default=1, help="Number of worker threads"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1,
+            help="Seconds between checks of the empty queue",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def handle(self, *args, threads=1, interval=1, once=False, **options):
+        if options["verbosity"] > 1:
+            logging.getLogger("anchor.packages.jobs").setLevel(logging.INFO)
+        worker = Worker(threads=threads, interval=interval)
+        try:
+            worker.serve(once=once)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the current jobs")
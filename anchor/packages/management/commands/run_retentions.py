@@ -0,0 +1,88 @@
+import time
+
+import humanize
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...jobs import enqueue
+from ...models import RetentionPolicy
+from ...tasks import apply_retention
+
+
+class Command(BaseCommand):
+    help = "Runs due retention policies, or the given ones right away."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "policies", nargs="*", type=int, help="IDs of the policies to run now"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count files that would be removed",
+        )
+        parser.add_argument(
+            "--background",
+            action="store_true",
+            help="Queue policies for the run_jobs workers instead of running them",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and check due policies every N seconds",
+        )
+
+    def handle(
+        self,
+        *args,
+        policies=(),
+        dry_run=False,
+        background=False,
+        interval=0,
+        **options,
+    ):
+        if background:
+            self.enqueue(policies, dry_run)
+            return
+        progress = self.report if options["verbosity"] > 1 else None
+        if policies:
+            for policy in RetentionPolicy.objects.filter(id__in=policies):
+                self.report(policy.apply(dry_run=dry_run, progress=progress))
+            return
+        while True:
+            runs = RetentionPolicy.objects.run_due(dry_run=dry_run, progress=progress)
+            for run in runs:
+                self.report(run)
+            if not interval:
+                break
+            connections.close_all()
+            time.sleep(interval)
+
+    def enqueue(self, policies, dry_run: bool):
+        if policies:
+            targets = RetentionPolicy.objects.filter(id__in=policies)
+        else:
+            due = RetentionPolicy.objects.due()
+            targets = [x for x in due if dry_run or RetentionPolicy.objects.claim(x)]
+        for policy in targets:
+            # queued dry run shouldn't prevent the real one
+            key = "" if dry_run else f"packages.retention:{policy.id}"
+            enqueue(apply_retention, policy.id, dry_run=dry_run, key=key)
+            self.stdout.write(f"{policy}: queued")
+
+    def report(self, run):
+        if run.error:
+            self.stderr.write(f"{run.policy}: failed with {run.error}")
+            return
+        self.stdout.write(
+            "{policy}: {action} {files} files of {packages} packages, "
+            "{size} in {seconds:.1f}s".format(
+                policy=run.policy,
+                action="found" if run.dry_run else "removed",
+                files=run.files,
+                packages=run.packages,
+                size=humanize.naturalsize(run.size),
+                seconds=run.duration.total_seconds(),
+            )
+        )
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-17 04:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0007_auto_20190621_1242"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="packagefile",
+            name="uploaded",
+            field=models.DateTimeField(verbose_name="Uploaded"),
+        ),
+        migrations.CreateModel(
+            name="DownloadStats",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="packages.PackageFile",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("file", "day")},},
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+import anchor.packages.models
+
+
+class Migration(migrations.Migration):
+
+    # python columns of the pypi files are renamed before
+    dependencies = [("packages", "0009_blobs"), ("pypi", "0006_rename_python_columns")]
+
+    operations = [
+        migrations.AddField(
+            model_name="packagefile",
+            name="pkg_type",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    (anchor.packages.models.PackageTypes("python"), "python"),
+                    (anchor.packages.models.PackageTypes("rpm"), "rpm"),
+                    (anchor.packages.models.PackageTypes("deb"), "deb"),
+                    (anchor.packages.models.PackageTypes("docker"), "docker"),
+                ],
+                db_index=True,
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="dist_type",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="sha256",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="_metadata",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="core_metadata",
+            field=models.BinaryField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="core_metadata_sha256",
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+"""
+Moves frequently used python metadata fields (and the long description)
+from the JSON column to their own columns.
+"""
+import json
+
+from django.db import migrations, models
+
+# metadata field -> column, see anchor.pypi.models.PackageFile
+COLUMNS = {
+    "filetype": "dist_type",
+    "metadata_version": "metadata_version",
+    "requires_python": "requires_python",
+    "sha256_digest": "sha256",
+    "description": "description",
+}
+
+
+def to_columns(apps, schema_editor):
+    PackageFile = apps.get_model("packages", "PackageFile")
+    files = (
+        PackageFile.objects.using(schema_editor.connection.alias)
+        .filter(pkg_type="python")
+        .exclude(_metadata="")
+    )
+    for file in files.iterator():
+        data = json.loads(file._metadata)
+        for field, column in COLUMNS.items():
+            value = data.pop(field, None) or ""
+            # sha256 of the stored file is more reliable than the form one
+            if column != "sha256" or not file.sha256:
+                setattr(file, column, value)
+        file._metadata = json.dumps(data)
+        file.save(update_fields=[*COLUMNS.values(), "_metadata"])
+
+
+def to_json(apps, schema_editor):
+    PackageFile = apps.get_model("packages", "PackageFile")
+    files = (
+        PackageFile.objects.using(schema_editor.connection.alias)
+        .filter(pkg_type="python")
+        .exclude(_metadata="")
+    )
+    for file in files.iterator():
+        data = json.loads(file._metadata)
+        data.update((field, getattr(file, column)) for field, column in COLUMNS.items())
+        file._metadata = json.dumps(data)
+        file.save(update_fields=["_metadata"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("packages", "0010_single_table"), ("pypi", "0007_single_table")]
+
+    operations = [
+        migrations.AddField(
+            model_name="packagefile",
+            name="metadata_version",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="requires_python",
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="description",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name="packagefile",
+            name="dist_type",
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+        migrations.RunPython(to_columns, to_json),
+    ]
@@ -0,0 +1,43 @@
+import collections
+
+import packaging.utils
+from django.db import migrations, models
+
+
+def fill_canonical_names(apps, schema_editor):
+    Package = apps.get_model("packages", "Package")
+    packages = Package.objects.using(schema_editor.connection.alias)
+    seen = collections.defaultdict(list)
+    for package in packages.iterator():
+        # see anchor.packages.models.canonical_name
+        if package.pkg_type == "python":
+            name = packaging.utils.canonicalize_name(package.name)
+        else:
+            name = package.name.lower()
+        seen[package.pkg_type, name].append(package.name)
+        packages.filter(pk=package.pk).update(canonical_name=name)
+    conflicts = {key: names for key, names in seen.items() if len(names) > 1}
+    if conflicts:
+        raise RuntimeError(
+            "Packages have the same canonical names, rename them first: "
+            + "; ".join(", ".join(x) for x in conflicts.values())
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("packages", "0011_file_metadata_columns")]
+
+    operations = [
+        migrations.AddField(
+            model_name="package",
+            name="canonical_name",
+            field=models.CharField(default="", editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_canonical_names, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="package",
+            unique_together={("pkg_type", "name"), ("pkg_type", "canonical_name")},
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+from anchor.packages.versions import is_prerelease, version_key
+
+
+def fill_version_keys(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Package = apps.get_model("packages", "Package")
+    PackageFile = apps.get_model("packages", "PackageFile")
+    files = PackageFile.objects.using(alias)
+    for pk, version in files.values_list("pk", "version").iterator():
+        files.filter(pk=pk).update(
+            version_key=version_key(version), prerelease=is_prerelease(version)
+        )
+    # see Package.update_latest
+    for package in Package.objects.using(alias).iterator():
+        ordered = files.filter(package=package).order_by("-version_key", "-uploaded")
+        newest = ordered.values_list("id", "version").first()
+        stable = ordered.filter(prerelease=False).values_list("id", "version").first()
+        package.latest_prerelease_id = newest and newest[0]
+        package.latest_stable_id = stable and stable[0]
+        if stable or newest:
+            package.version = (stable or newest)[1]
+        package.save(update_fields=["latest_prerelease", "latest_stable", "version"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0012_canonical_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="package",
+            name="latest_prerelease",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="packages.PackageFile",
+            ),
+        ),
+        migrations.AddField(
+            model_name="package",
+            name="latest_stable",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="packages.PackageFile",
+            ),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="prerelease",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="version_key",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="packagefile",
+            index=models.Index(
+                fields=["package", "version_key"], name="packages_pa_package_f26d82_idx"
+            ),
+        ),
+        migrations.RunPython(fill_version_keys, migrations.RunPython.noop),
+    ]
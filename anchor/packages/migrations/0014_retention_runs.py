@@ -0,0 +1,51 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0013_version_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="retentionpolicy",
+            name="next_run",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="retentionpolicy",
+            name="schedule",
+            field=models.DurationField(blank=True, null=True, verbose_name="Run every"),
+        ),
+        migrations.CreateModel(
+            name="RetentionRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dry_run", models.BooleanField(default=False)),
+                ("started", models.DateTimeField()),
+                ("duration", models.DurationField(null=True)),
+                ("files", models.IntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0, verbose_name="Freed bytes")),
+                ("error", models.TextField(blank=True)),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="runs",
+                        to="packages.RetentionPolicy",
+                    ),
+                ),
+            ],
+            options={"ordering": ["-started"],},
+        ),
+    ]
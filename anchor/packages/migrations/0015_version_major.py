@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+from anchor.packages.versions import major_key
+
+
+def fill_version_major(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    PackageFile = apps.get_model("packages", "PackageFile")
+    files = PackageFile.objects.using(alias)
+    for pk, version in files.values_list("pk", "version").iterator():
+        files.filter(pk=pk).update(version_major=major_key(version))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0014_retention_runs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="packagefile",
+            name="version_major",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_version_major, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+import anchor.packages.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0015_version_major"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="retentionpolicy",
+            name="name_glob",
+            field=models.CharField(
+                blank=True, max_length=64, verbose_name="Package names (glob)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="retentionpolicy",
+            name="pkg_type",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    (anchor.packages.models.PackageTypes("python"), "python"),
+                    (anchor.packages.models.PackageTypes("rpm"), "rpm"),
+                    (anchor.packages.models.PackageTypes("deb"), "deb"),
+                    (anchor.packages.models.PackageTypes("docker"), "docker"),
+                ],
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="retentionrun",
+            name="packages",
+            field=models.IntegerField(default=0, verbose_name="Affected packages"),
+        ),
+        migrations.AlterField(
+            model_name="retentionpolicy",
+            name="applied_to",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="packages.Package",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+# version keys are compared byte by byte (see anchor.packages.versions),
+# while locale collations of PostgreSQL (like en_US.UTF-8) skip spaces and dots
+# on the first comparison level, so "1.0" could go after "1.0.1"
+COLLATE = (
+    "ALTER TABLE packages_packagefile "
+    'ALTER COLUMN version_key TYPE varchar(255) COLLATE "{}"'
+)
+
+
+def binary_collation(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(COLLATE.format("C"))
+
+
+def default_collation(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(COLLATE.format("default"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("packages", "0017_jobs")]
+
+    operations = [migrations.RunPython(binary_collation, default_collation)]
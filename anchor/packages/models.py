@@ -1,20 +1,33 @@
+import collections
 import dataclasses
 import enum
 import functools
+import hashlib
 import json
 import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
 import typing as ty
 from datetime import timedelta
 from pathlib import Path
 
+import packaging.utils
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import Coalesce, DenseRank
+from django.dispatch import Signal
 from django.urls import reverse
 from django.utils import timezone
 
 from ..common.helpers import DataclassExtras
 from ..exceptions import UserError
 from ..users.models import PermissionAware
+from .versions import is_prerelease, major_key, version_key
 
 log = logging.getLogger(__name__)
 
@@ -36,6 +49,133 @@ class Metadata(DataclassExtras):
     description: str
 
 
+def canonical_name(name: str, pkg_type: str) -> str:
+    """
+    Name that is used for the lookups:
+    `PEP 503`_ normalization for Python projects, lowercase name for others.
+
+    .. _`PEP 503`: https://www.python.org/dev/peps/pep-0503/#normalized-names
+    """
+    if pkg_type == PackageTypes.Python.value:
+        return packaging.utils.canonicalize_name(name)
+    return name.lower()
+
+
+class TypedManager(models.Manager):
+    """ Manager of the proxy model, that returns only objects of its type. """
+
+    def __init__(self, pkg_type: PackageTypes):
+        super().__init__()
+        self.pkg_type = pkg_type
+
+    def get_queryset(self):
+        return super().get_queryset().filter(pkg_type=self.pkg_type.value)
+
+
+class PackageFileQuerySet(models.QuerySet):
+    def by_version(self):
+        """ Newest versions first. """
+        return self.order_by("-version_key", "-uploaded")
+
+    def stable(self):
+        return self.filter(prerelease=False)
+
+    def versions_between(self, lower: str = None, upper: str = None):
+        """ Files with lower <= version < upper, any bound could be omitted. """
+        query = self
+        if lower is not None:
+            query = query.filter(version_key__gte=version_key(lower))
+        if upper is not None:
+            query = query.filter(version_key__lt=version_key(upper))
+        return query
+
+    def newest(self, count: int, per_major=False):
+        """
+        Files of the ``count`` newest versions of every package
+        (or of every major line of the package).
+        Versions are ranked by the database, with the window function.
+        """
+        partition = [models.F("package")]
+        if per_major:
+            partition.append(models.F("version_major"))
+        ranked = self.annotate(
+            version_rank=Window(
+                DenseRank(),
+                partition_by=partition,
+                order_by=models.F("version_key").desc(),
+            )
+        ).values("id", "version_rank")
+        sql, params = ranked.query.sql_with_params()
+        # window functions can't be filtered by the ORM yet
+        return self.filter(
+            id__in=_Subquery(
+                f"SELECT id FROM ({sql}) ranked WHERE version_rank <= %s",
+                (*params, count),
+            )
+        )
+
+    def remove(self) -> int:
+        """
+        Removes files in bulk. Per-file signal handlers are skipped:
+        stored files are released with a few queries, and packages
+        are updated (and ``files_removed`` is sent) once per package.
+        Returns number of removed files.
+        """
+        files = list(self.values_list("id", "package", "blob", "fileobj"))
+        if not files:
+            return 0
+        package_ids = sorted({x[1] for x in files})
+        with transaction.atomic(using=self.db):
+            _bulk_removal.active = True
+            try:
+                self.model.objects.filter(id__in=[x[0] for x in files]).delete()
+            finally:
+                _bulk_removal.active = False
+            Blob.objects.release(*(x[2] for x in files if x[2]))
+            legacy = [x[3] for x in files if not x[2] and x[3]]
+            if legacy:
+                # tasks depend on the models
+                from .jobs import enqueue
+                from .tasks import delete_stored_file
+
+                enqueue(delete_stored_file, *legacy)
+            for package_id in package_ids:
+                Package.update_latest(package_id)
+            files_removed.send(sender=self.model, package_ids=package_ids)
+        return len(files)
+
+
+_bulk_removal = threading.local()
+
+# sent after PackageFileQuerySet.remove(), instead of the per-file signals
+files_removed = Signal(providing_args=["package_ids"])
+
+
+def in_bulk_removal() -> bool:
+    """ Files are removed by PackageFileQuerySet.remove() right now. """
+    return getattr(_bulk_removal, "active", False)
+
+
+class _Subquery(RawSQL):
+    """ Raw subquery for the __in lookup, that adds parentheses by itself. """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class PackageFileManager(models.Manager.from_queryset(PackageFileQuerySet)):  # type: ignore
+    """ Large columns are loaded only when they're accessed. """
+
+    deferred = ["description"]
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.deferred)
+
+
+class TypedFileManager(TypedManager, PackageFileManager):
+    pass
+
+
 class Package(PermissionAware):
     """Base model that represents common package information."""
 
@@ -43,6 +183,8 @@ class Package(PermissionAware):
         max_length=16, db_index=True, choices=[(tag, tag.value) for tag in PackageTypes]
     )
     name = models.CharField(max_length=64, db_index=True)
+    # set on save, see canonical_name()
+    canonical_name = models.CharField(max_length=64, editable=False)
     version = models.CharField("Latest version", max_length=64)
     summary = models.TextField(null=True)
     # various package attributes, set as JSON
@@ -51,6 +193,14 @@ class Package(PermissionAware):
     updated = models.DateTimeField("Last updated")
     downloads = models.IntegerField("Downloads count", default=0)
     public = models.BooleanField("Package visible to all", default=True)
+    # newest files, maintained by the signal handlers (see update_latest)
+    latest_stable = models.ForeignKey(
+        "PackageFile", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    # includes pre-releases, same as latest_stable if the newest one is stable
+    latest_prerelease = models.ForeignKey(
+        "PackageFile", null=True, on_delete=models.SET_NULL, related_name="+"
+    )
 
     _permissions = {
         "maintainer": "remove_files",
@@ -59,14 +209,20 @@ class Package(PermissionAware):
     }
 
     class Meta:
-        unique_together = ["pkg_type", "name"]
-        # index_together?
+        unique_together = [["pkg_type", "name"], ["pkg_type", "canonical_name"]]
 
-    def __init__(self, *args, metadata=None):
-        super().__init__(*args)
+    def __init__(self, *args, metadata=None, **kwargs):
+        super().__init__(*args, **kwargs)
         if metadata:
             self.from_metadata(metadata)
 
+    def save(self, *args, **kwargs):
+        self.canonical_name = canonical_name(self.name, self.pkg_type)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "canonical_name"}
+        super().save(*args, **kwargs)
+
     def has_permission(self, user, permission):
         if permission == "read" and self.public:
             return True
@@ -86,6 +242,31 @@ class Package(PermissionAware):
     def stats(self):
         return self.files.aggregate(count=models.Count("*"), size=models.Sum("size"))
 
+    def versions(self, count: int = None, prerelease=True) -> ty.List[str]:
+        """ Newest versions first. """
+        files = self.files if prerelease else self.files.stable()
+        versions = (
+            files.order_by("-version_key").values_list("version", flat=True).distinct()
+        )
+        return list(versions[:count] if count else versions)
+
+    @classmethod
+    def update_latest(cls, package_id: int):
+        """
+        Points latest_stable and latest_prerelease to the newest files,
+        and sets the version to the newest stable (or pre-release) one.
+        """
+        files = PackageFile.objects.filter(package_id=package_id).by_version()
+        newest = files.values_list("id", "version").first()
+        stable = files.stable().values_list("id", "version").first()
+        changes: ty.Dict[str, ty.Any] = dict(
+            latest_prerelease_id=newest and newest[0],
+            latest_stable_id=stable and stable[0],
+        )
+        if stable or newest:
+            changes["version"] = (stable or newest)[1]
+        cls.objects.filter(pk=package_id).update(**changes)
+
     def update_time(self):
         self.updated = timezone.now()
 
@@ -97,7 +278,8 @@ class Package(PermissionAware):
         Returns URL with latest available
         package file, if package has any.
         """
-        return ""  # TODO
+        latest = self.latest_stable or self.latest_prerelease
+        return latest.link if latest else None
 
     def download_bundle(self):
         """
@@ -143,20 +325,281 @@ class ChunkedReader:
             raise UserError("Empty file")
 
 
+class BlobManager(models.Manager):
+    root = "blobs"
+
+    def store(self, src) -> "Blob":
+        """
+        Saves file contents to the blob storage
+        (or finds the existing blob with the same contents)
+        and takes a reference to it.
+        """
+        root = Path(settings.MEDIA_ROOT, self.root)
+        root.mkdir(parents=True, exist_ok=True)
+        sha256 = getattr(src, "sha256", None)
+        moved = bool(sha256) and hasattr(src, "temporary_file_path")
+        if moved:
+            # hashed by the upload handler, so the file is just renamed
+            tmp, size = src.temporary_file_path(), src.size
+        else:
+            tmp, sha256, size = self._copy(src, root)
+        with transaction.atomic():
+            blob, created = self.select_for_update().get_or_create(
+                sha256=sha256, defaults=dict(size=size)
+            )
+            self.filter(pk=blob.pk).update(refs=models.F("refs") + 1)
+        if created or not blob.path.exists():
+            blob.path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, blob.path)
+            os.chmod(blob.path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        elif not moved:
+            os.unlink(tmp)
+        log.debug("Stored %s (%s bytes, new: %s)", blob.name, size, created)
+        return blob
+
+    def _copy(self, src, root: Path) -> ty.Tuple[str, str, int]:
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in src.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+                size = out.tell()
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp, digest.hexdigest(), size
+
+    def release(self, *blob_ids: int):
+        """
+        Drops references to the blobs (one per id, ids could repeat),
+        unused blobs are removed by the job.
+        """
+        # tasks depend on the models
+        from .jobs import enqueue
+        from .tasks import remove_unused_blob
+
+        if not blob_ids:
+            return
+        refs = collections.Counter(blob_ids)
+        # one query per distinct number of references
+        by_count: ty.Dict[int, ty.List[int]] = collections.defaultdict(list)
+        for blob_id, count in refs.items():
+            by_count[count].append(blob_id)
+        for count, ids in by_count.items():
+            self.filter(pk__in=ids).update(refs=models.F("refs") - count)
+        enqueue(remove_unused_blob, *sorted(refs))
+
+    def remove_unused(self, **filters) -> ty.Tuple[int, int]:
+        """
+        Removes unreferenced blobs and their files.
+        Returns number of removed blobs and freed bytes.
+        """
+        unused = self._unused(self.filter(refs__lte=0, **filters))
+        count = size = 0
+        for pk in unused.values_list("pk", flat=True):
+            with transaction.atomic(using=self.db):
+                # store() could take a reference since the query
+                blob = self._unused(
+                    self.select_for_update().filter(pk=pk, refs__lte=0)
+                ).first()
+                if blob is None:
+                    continue
+                blob.delete()
+                # the file is kept if the transaction is rolled back
+                transaction.on_commit(
+                    functools.partial(self._unlink, blob), using=self.db
+                )
+            count += 1
+            size += blob.size
+        return count, size
+
+    def _unused(self, blobs: models.QuerySet) -> models.QuerySet:
+        for model, field in self._referencing():
+            blobs = blobs.exclude(
+                id__in=model.objects.filter(**{f"{field}__isnull": False}).values(field)
+            )
+        return blobs
+
+    def _unlink(self, blob: "Blob"):
+        """
+        Removes file of the deleted blob. The same contents could be stored
+        again after the commit, so the file is moved away before the check:
+        store() either creates the row before the check (and the file
+        is put back) or writes the file again after it.
+        """
+        path = blob.path
+        tombstone = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp")
+        try:
+            os.replace(path, tombstone)
+        except FileNotFoundError:
+            return
+        if self.filter(sha256=blob.sha256).exists():
+            # contents are the same, so it doesn't matter which copy wins
+            os.replace(tombstone, path)
+        else:
+            tombstone.unlink()
+
+    def _referencing(self) -> ty.List[ty.Tuple[ty.Type[models.Model], str]]:
+        """ Models with foreign keys to blobs, and names of these keys. """
+        return [
+            (rel.related_model, rel.field.name)
+            for rel in self.model._meta.get_fields(include_hidden=True)
+            if rel.one_to_many and rel.auto_created
+        ]
+
+    def collect(self, grace: timedelta = timedelta(hours=1)) -> dict:
+        """
+        Mark-and-sweep garbage collection.
+        Reference counters are recalculated from the package files
+        (and other models that use blobs, like mirrored files),
+        then unreferenced blobs and unknown files (like leftovers from
+        failed uploads) older than grace period are removed.
+        """
+        refs = models.Value(0)
+        for model, field in self._referencing():
+            count = (
+                model.objects.filter(**{field: models.OuterRef("pk")})
+                .values(field)
+                .annotate(count=models.Count("*"))
+                .values("count")
+            )
+            refs = refs + Coalesce(models.Subquery(count), models.Value(0))
+        self.update(refs=refs)
+        threshold = (timezone.now() - grace).timestamp()
+        blobs, size = self.remove_unused(created__lt=timezone.now() - grace)
+        files = 0
+        root = Path(settings.MEDIA_ROOT, self.root)
+        unknown = list(root.glob("*.tmp"))
+        # one query per shard directory
+        for shard in root.glob("*/*"):
+            known = set(
+                self.filter(
+                    sha256__startswith=shard.parent.name + shard.name
+                ).values_list("sha256", flat=True)
+            )
+            unknown.extend(x for x in shard.iterdir() if x.name not in known)
+        for path in unknown:
+            stat = path.stat()
+            if stat.st_mtime < threshold:
+                log.debug("Removing unknown file %s", path)
+                path.unlink()
+                files += 1
+                size += stat.st_size
+        return dict(blobs=blobs, files=files, size=size)
+
+
+class Blob(models.Model):
+    """
+    File contents, stored once under their sha256
+    at ``MEDIA_ROOT/blobs/ab/cd/abcdef...``.
+    Identical files uploaded under other names are stored only once.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    # number of package files that use the blob
+    refs = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    @property
+    def name(self) -> str:
+        """ Path relative to the MEDIA_ROOT. """
+        sha = self.sha256
+        return f"{BlobManager.root}/{sha[:2]}/{sha[2:4]}/{sha}"
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.MEDIA_ROOT, self.name)
+
+    def __str__(self):
+        return self.sha256
+
+
 class PackageFile(models.Model):
-    """Package file representation. Bounded to the package."""
+    """
+    Package file representation. Bounded to the package.
 
+    Files of all package types are stored in this table,
+    with the type-specific columns left empty for other types,
+    and the type-specific models are proxies filtered by ``pkg_type``.
+    """
+
+    pkg_type = models.CharField(
+        max_length=16,
+        db_index=True,
+        blank=True,
+        choices=[(tag, tag.value) for tag in PackageTypes],
+    )
     package = models.ForeignKey(Package, on_delete=models.CASCADE)
     filename = models.CharField(max_length=64, unique=True)
     fileobj = models.FileField()
+    # files uploaded before blob storage have no blob
+    blob = models.ForeignKey(Blob, null=True, on_delete=models.PROTECT)
     size = models.IntegerField()
     version = models.CharField(max_length=64)
+    # set on save, see anchor.packages.versions;
+    # has "C" collation on PostgreSQL (migration 0018), keep it on changes
+    version_key = models.CharField(max_length=255, blank=True, editable=False)
+    version_major = models.CharField(max_length=64, blank=True, editable=False)
+    prerelease = models.BooleanField(default=False, editable=False)
     uploaded = models.DateTimeField("Uploaded")
 
+    # python
+    dist_type = models.CharField(max_length=16, db_index=True, blank=True)
+    metadata_version = models.CharField(max_length=16, blank=True)
+    requires_python = models.CharField(max_length=255, db_index=True, blank=True)
+    sha256 = models.CharField(max_length=64, db_index=True, blank=True)
+    # the rest of the upload metadata, as JSON
+    _metadata = models.TextField(blank=True)
+    # deferred by the manager, could be very long
+    description = models.TextField(blank=True)
+    # PEP 658 metadata file, served as <download url>.metadata
+    core_metadata = models.BinaryField(null=True, editable=False)
+    core_metadata_sha256 = models.CharField(max_length=64, null=True)
+
+    objects = PackageFileManager()
+
+    # package type -> name of the download URL, that accepts filename
+    download_views = {PackageTypes.Python.value: "pypi.download"}
+
+    class Meta:
+        indexes = [models.Index(fields=["package", "version_key"])]
+
+    def save(self, *args, **kwargs):
+        self.version_key = version_key(self.version)
+        self.version_major = major_key(self.version)
+        self.prerelease = is_prerelease(self.version)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "version" in update_fields:
+            kwargs["update_fields"] = {
+                *update_fields,
+                "version_key",
+                "version_major",
+                "prerelease",
+            }
+        super().save(*args, **kwargs)
+
+    @property
+    def link(self) -> ty.Optional[str]:
+        view = self.download_views.get(self.pkg_type)
+        return reverse(view, args=[self.filename]) if view else None
+
     def update(self, src: ChunkedReader, metadata):
-        self.fileobj.save(src.name, src, save=False)
-        if src.size is 0:
-            raise IOError("Storage didn't read the file (empty?)")
+        old_blob, old_name = self.blob_id, self.fileobj.name
+        self.blob = Blob.objects.store(src)
+        self.fileobj.name = self.blob.name
+        if old_blob:
+            Blob.objects.release(old_blob)
+        elif old_name:
+            # file was uploaded before blob storage
+            from .jobs import enqueue
+            from .tasks import delete_stored_file
+
+            enqueue(delete_stored_file, old_name)
         log.debug("Saved file (%s bytes) to %s", src.size, self.path)
         self.filename = Path(src.name).name
         self.size = src.size
@@ -173,15 +616,98 @@ class PackageFile(models.Model):
         return self.filename
 
 
+class DownloadStats(models.Model):
+    """ Daily downloads count of the package file. """
+
+    file = models.ForeignKey(PackageFile, on_delete=models.CASCADE)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ["file", "day"]
+
+    @classmethod
+    def add(cls, file_id: int, day, count: int):
+        """ Increments counter without reading it. """
+        query = cls.objects.filter(file_id=file_id, day=day)
+        if query.update(count=models.F("count") + count):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(file_id=file_id, day=day, count=count)
+        except IntegrityError:
+            # concurrent flush created the row first
+            query.update(count=models.F("count") + count)
+
+
+class RetentionPolicyManager(models.Manager):
+    def due(self, now=None):
+        """ Scheduled policies that should run now. """
+        return self.filter(schedule__isnull=False, next_run__lte=now or timezone.now())
+
+    def claim(self, policy: "RetentionPolicy", now=None) -> bool:
+        """
+        Moves the next run of the policy forward.
+        Returns False if another process has claimed this run first.
+        """
+        now = now or timezone.now()
+        claimed = self.filter(pk=policy.pk, next_run=policy.next_run).update(
+            next_run=now + policy.schedule
+        )
+        return bool(claimed)
+
+    def run_due(
+        self, dry_run=False, now=None, progress=None
+    ) -> ty.List["RetentionRun"]:
+        """
+        Runs all due policies, returns their reports.
+        Dry runs don't claim policies, so the scheduled runs aren't skipped.
+        Failed policy doesn't stop the others, its error is in the report.
+        """
+        runs = []
+        for policy in self.due(now).select_related("applied_to"):
+            if not dry_run and not self.claim(policy, now):
+                continue
+            try:
+                runs.append(policy.apply(dry_run=dry_run, progress=progress))
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Retention policy %s failed", policy)
+                # saved by apply() with the error
+                failed = policy.runs.first()
+                if failed is not None:
+                    runs.append(failed)
+        return runs
+
+
 class RetentionPolicy(models.Model):
+    """
+    Rules that define which package files should be removed.
+
+    Files that match any ``drop`` rule (or all files, if there are no
+    such rules) and don't match any ``keep`` rule are removed.
+    Scheduled policies (see ``every``) are run by ``manage.py run_retentions``.
+
+    Policy is applied either to one package, or to all packages
+    of the type, which names match the glob (see ``for_packages``).
+    """
+
     # right now anchor project is not so big to have reasons for many to many everywhere
     # applied_to = models.ManyToManyField(Package, null=True)
-    applied_to = models.ForeignKey(Package, on_delete=models.CASCADE)
+    applied_to = models.ForeignKey(
+        Package, null=True, blank=True, on_delete=models.CASCADE
+    )
+    pkg_type = models.CharField(
+        max_length=16, blank=True, choices=[(tag, tag.value) for tag in PackageTypes]
+    )
+    name_glob = models.CharField("Package names (glob)", max_length=64, blank=True)
     _criteria = models.TextField("Retention settings (JSON)")
-    schedule = None
+    schedule = models.DurationField("Run every", null=True, blank=True)
+    next_run = models.DateTimeField(null=True, blank=True, db_index=True)
 
-    def __init__(self, *args):
-        super().__init__(*args)
+    objects = RetentionPolicyManager()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.criteria = json.loads(self._criteria or "{}")
         self.criteria.setdefault("keep", [])
         self.criteria.setdefault("drop", [])
@@ -190,6 +716,12 @@ class RetentionPolicy(models.Model):
         target = Package.objects.get(pkg_type=pkg_type, name=name)
         self.applied_to = target
 
+    def for_packages(self, pkg_type: PackageTypes = None, glob: str = "*"):
+        """ Applies the policy to all packages that match the glob, like ``ci-*``. """
+        self.applied_to = None
+        self.pkg_type = pkg_type.value if pkg_type else ""
+        self.name_glob = glob
+
     def keep(
         self, regexp: str = None, before_age: timedelta = None, size_less: int = None
     ):
@@ -198,61 +730,339 @@ class RetentionPolicy(models.Model):
         This parameter has a higher priority over `drop`.
         """
         self.criteria["keep"].append(
-            dict(regexp=regexp, before_age=before_age, size_less=size_less)
+            dict(regexp=regexp, before_age=_seconds(before_age), size_less=size_less)
         )
 
     def drop(
         self, regexp: str = None, after_age: timedelta = None, size_exceeds: int = None
     ):
         self.criteria["drop"].append(
-            dict(regexp=regexp, after_age=after_age, size_exceeds=size_exceeds)
+            dict(
+                regexp=regexp, after_age=_seconds(after_age), size_exceeds=size_exceeds
+            )
+        )
+
+    def keep_last(self, count: int, prerelease: bool = None, per_major=False):
+        """
+        Keeps files of the ``count`` newest versions,
+        only stable ones or pre-releases if ``prerelease`` is set.
+        """
+        self.criteria["keep"].append(
+            dict(last=count, prerelease=prerelease, per_major=per_major)
         )
 
     def every(self, time: timedelta):
+        """ Schedules the policy, first run is due right away. """
         self.schedule = time
+        self.next_run = timezone.now()
 
     _pol_mapping = {
         "regexp": "version__iregex",
-        "before_age": "uploaded__lt",
-        "after_age": "uploaded__gt",
+        # younger than
+        "before_age": "uploaded__gt",
+        # older than
+        "after_age": "uploaded__lt",
         "size_less": "size__lt",
         "size_exceeds": "size__gt",
     }
+    _ages = {"before_age", "after_age"}
 
-    def run(self, check=False):
-        packages = PackageFile.objects.filter(package=self.applied_to)
+    def files(self):
+        """ Files of all packages the policy is applied to. """
+        if self.applied_to_id is not None:
+            return PackageFile.objects.filter(package=self.applied_to_id)
+        files = PackageFile.objects.all()
+        if self.pkg_type:
+            files = files.filter(pkg_type=self.pkg_type)
+        if self.name_glob and self.name_glob != "*":
+            glob = canonical_name(self.name_glob, self.pkg_type)
+            files = files.filter(package__canonical_name__regex=_glob_regex(glob))
+        return files
+
+    def candidates(self, now=None):
+        """
+        Files that should be removed,
+        of all packages the policy is applied to, with one query.
+        """
+        now = now or timezone.now()
+        packages = self.files()
         # this could be rewritten in sequence generator, but then it'll be hard to debug =/
-        drop = self._reduce_policies(self.criteria["drop"])
-        keep = self._reduce_policies(self.criteria["keep"])
+        drop = self._reduce_policies(self.criteria["drop"], now)
+        keep = self._reduce_policies(self.criteria["keep"], now)
         # TODO drop only if setting enabled and by soft/hard policy settings?
-        log.debug("Queries:\n%s;\n%s", drop, keep)
-        log.debug("Initial: %s", packages)
-        packages = packages.filter(drop)
-        log.debug("Filtered: %s", packages)
-        packages = packages.exclude(keep)
-        log.debug("Excluded: %s", packages)
+        files = packages.filter(drop).exclude(keep)
+        # Q repr would evaluate the subqueries
+        log.debug("Query: %s", files.query)
+        return files
+
+    def run(self, check=False):
         if check:
-            return packages
-        packages.delete()
+            return self.candidates()
+        return self.apply()
+
+    def apply(
+        self,
+        dry_run=False,
+        batch_size: int = None,
+        progress: ty.Callable[["RetentionRun"], None] = None,
+    ) -> "RetentionRun":
+        """
+        Removes files in batches, every batch in its own transaction,
+        so the files table isn't locked for long.
+        Candidates are selected once and read with the database cursor,
+        so only one batch is kept in memory, whatever the number of packages.
+        Stored files are released with the file records.
+        Report is saved (and passed to ``progress``) after every batch.
+        Dry run only counts files and their size with one query.
+        Returns saved report of the run.
+        """
+        batch_size = batch_size or getattr(
+            settings, "PACKAGES_RETENTION_BATCH_SIZE", 500
+        )
+        run = RetentionRun(policy=self, dry_run=dry_run, started=timezone.now())
+        started = time.monotonic()
+        try:
+            files = self.candidates(now=run.started)
+            if dry_run:
+                found = files.aggregate(
+                    count=models.Count("*"),
+                    size=models.Sum("size"),
+                    packages=models.Count("package", distinct=True),
+                )
+                run.files, run.size = found["count"], found["size"] or 0
+                run.packages = found["packages"]
+                return run
+            run.save()
+            rows = files.order_by("package", "id").values_list("package", "id", "size")
+            batch: ty.List[tuple] = []
+            last_package = None
+            for row in rows.iterator(chunk_size=batch_size):
+                if row[0] != last_package:
+                    run.packages += 1
+                    last_package = row[0]
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._remove(run, batch, started, progress)
+                    batch = []
+            if batch:
+                self._remove(run, batch, started, progress)
+            return run
+        except Exception as e:
+            run.error = repr(e)
+            raise
+        finally:
+            run.duration = timedelta(seconds=time.monotonic() - started)
+            run.save()
+            log.info("%s", run)
 
-    def _reduce_policies(self, policies: list) -> models.Q:
+    def _remove(self, run: "RetentionRun", batch: list, started: float, progress):
+        PackageFile.objects.filter(id__in=[x for _, x, _ in batch]).remove()
+        run.files += len(batch)
+        run.size += sum(size for _, _, size in batch)
+        run.duration = timedelta(seconds=time.monotonic() - started)
+        run.save(update_fields=["files", "size", "packages", "duration"])
+        log.debug("%s so far", run)
+        if progress is not None:
+            progress(run)
+
+    def _reduce_policies(self, policies: list, now) -> models.Q:
         out = []
         for policy in policies:
+            if "last" in policy:
+                out.append(self._newest(**policy))
+                continue
             param = {
-                self._pol_mapping[key]: value
+                self._pol_mapping[key]: (
+                    now - timedelta(seconds=value) if key in self._ages else value
+                )
                 for key, value in policy.items()
                 if value is not None
             }
             out.append(models.Q(**param))
         return functools.reduce(lambda x, y: x | y, out, models.Q())
 
+    def _newest(self, last: int, prerelease: bool = None, per_major=False) -> models.Q:
+        files = self.files()
+        if prerelease is not None:
+            files = files.filter(prerelease=prerelease)
+        return models.Q(id__in=files.newest(last, per_major).values("id"))
+
     def save(
         self, force_insert=False, force_update=False, using=None, update_fields=None
     ):
-        self._criteria = json.dumps(self._criteria)
+        if self.applied_to_id is None and not (self.pkg_type or self.name_glob):
+            raise UserError("Policy should be applied to a package or packages glob")
+        self._criteria = json.dumps(self.criteria)
         super().save(
             force_insert=force_insert,
             force_update=force_update,
             using=using,
             update_fields=update_fields,
         )
+
+    def __str__(self):
+        if self.applied_to_id is not None:
+            target = self.applied_to.name
+        else:
+            target = " ".join(filter(None, [self.pkg_type, self.name_glob or "*"]))
+        return f"Retention policy #{self.pk} of {target}"
+
+
+def _seconds(value: ty.Optional[timedelta]) -> ty.Optional[float]:
+    # criteria are stored as JSON
+    return value.total_seconds() if value is not None else None
+
+
+def _glob_regex(glob: str) -> str:
+    """ Only ``*`` and ``?`` wildcards, the regexp works in any database. """
+    wildcards = {"*": ".*", "?": "."}
+    return "^{}$".format("".join(wildcards.get(x) or re.escape(x) for x in glob))
+
+
+class RetentionRun(models.Model):
+    """ Report of the retention policy run. """
+
+    policy = models.ForeignKey(
+        RetentionPolicy, on_delete=models.CASCADE, related_name="runs"
+    )
+    dry_run = models.BooleanField(default=False)
+    started = models.DateTimeField()
+    duration = models.DurationField(null=True)
+    # removed (or found, in the dry run) files
+    files = models.IntegerField(default=0)
+    size = models.BigIntegerField("Freed bytes", default=0)
+    packages = models.IntegerField("Affected packages", default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-started"]
+
+    def __str__(self):
+        action = "found" if self.dry_run else "removed"
+        return (
+            f"{self.policy}: {action} {self.files} files ({self.size} bytes) "
+            f"in {self.duration.total_seconds() if self.duration else 0:.1f}s"
+        )
+
+
+class JobManager(models.Manager):
+    def enqueue(
+        self,
+        task: str,
+        args=(),
+        kwargs: dict = None,
+        key: str = "",
+        priority: int = 0,
+        delay: timedelta = None,
+        max_attempts: int = 3,
+    ) -> ty.Optional["Job"]:
+        """
+        Adds job to the queue, it's visible to the workers
+        after the current transaction is committed.
+        Jobs with the same key are queued only once.
+        Queued job could be taken by a worker before the current transaction
+        is committed, so keys suit only tasks that don't depend
+        on the changes of this transaction.
+        """
+        if key and self.filter(key=key, status=Job.QUEUED).exists():
+            return None
+        job = Job(
+            task=task,
+            key=key,
+            priority=priority,
+            run_after=timezone.now() + (delay or timedelta(0)),
+            max_attempts=max_attempts,
+        )
+        job.arguments = dict(args=list(args), kwargs=kwargs or {})
+        job.save()
+        return job
+
+    def claim(self, worker: str, now=None) -> ty.Optional["Job"]:
+        """
+        Takes the next due job, by priority (lower first).
+        Locked rows are skipped, so workers don't wait for each other.
+        """
+        now = now or timezone.now()
+        queued = self.filter(status=Job.QUEUED, run_after__lte=now).order_by(
+            "priority", "id"
+        )
+        changes = dict(status=Job.RUNNING, worker=worker, started=now)
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            with transaction.atomic(using=self.db):
+                job = queued.select_for_update(skip_locked=True).first()
+                if job is None:
+                    return None
+                self.filter(pk=job.pk).update(
+                    attempts=models.F("attempts") + 1, **changes
+                )
+        else:
+            # SQLite has no row locks, but its writes are serialized,
+            # so only one worker updates the job that is still queued
+            for pk in queued.values_list("pk", flat=True)[:10]:
+                claimed = self.filter(pk=pk, status=Job.QUEUED).update(
+                    attempts=models.F("attempts") + 1, **changes
+                )
+                if claimed:
+                    job = Job(pk=pk)
+                    break
+            else:
+                return None
+        job.refresh_from_db()
+        return job
+
+    def requeue_stale(self, timeout: timedelta, now=None) -> int:
+        """ Returns jobs of the dead workers (running for too long) to the queue. """
+        now = now or timezone.now()
+        stale = self.filter(status=Job.RUNNING, started__lt=now - timeout)
+        failed = stale.filter(attempts__gte=models.F("max_attempts")).update(
+            status=Job.FAILED, error="Timed out"
+        )
+        return failed + stale.update(status=Job.QUEUED, run_after=now)
+
+    def prune(self, keep: timedelta, now=None) -> int:
+        """ Removes jobs that are done for longer than ``keep``. """
+        now = now or timezone.now()
+        deleted, _ = self.filter(status=Job.DONE, started__lt=now - keep).delete()
+        return deleted
+
+
+class Job(models.Model):
+    """ Background job, see anchor.packages.jobs. """
+
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+    task = models.CharField(max_length=255)
+    _arguments = models.TextField("Arguments (JSON)", default="{}")
+    # queued jobs with the same key are merged
+    key = models.CharField(max_length=255, blank=True, db_index=True)
+    # lower runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(
+        max_length=16,
+        default=QUEUED,
+        choices=[(x, x) for x in (QUEUED, RUNNING, DONE, FAILED)],
+    )
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.SmallIntegerField(default=0)
+    max_attempts = models.SmallIntegerField(default=3)
+    worker = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    duration = models.DurationField(null=True)
+    error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "priority", "run_after"])]
+
+    @property
+    def arguments(self) -> dict:
+        return json.loads(self._arguments)
+
+    @arguments.setter
+    def arguments(self, value: dict):
+        self._arguments = json.dumps(value)
+
+    def __str__(self):
+        return f"{self.task} #{self.pk}"
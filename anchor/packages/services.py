@@ -3,8 +3,9 @@ import typing as ty
 
 from django.db import transaction
 
-from ..exceptions import Forbidden
-from .models import ChunkedReader, Package, PackageFile
+from ..exceptions import Forbidden, UserError
+from .models import ChunkedReader, Package, PackageFile, canonical_name
+from .uploads import HashedUploadedFile
 
 
 class Uploader:
@@ -12,6 +13,7 @@ class Uploader:
 
     pkg = Package
     pkg_file = PackageFile
+    pkg_type = ""
     reader = ChunkedReader
 
     def __init__(self, name: str = None):
@@ -20,13 +22,20 @@ class Uploader:
         self.fd: ty.BinaryIO
 
     def get_reader(self):
+        if isinstance(self.fd, HashedUploadedFile):
+            # already hashed and checked by the upload handler
+            if not self.fd.size:
+                raise UserError("Empty file")
+            return self.fd
         return self.reader(self.fd, max_size_kb=2 ** 20)  # 1GB hard limit TODO
 
     def __call__(self, user, metadata, fd):
         self.metadata = metadata
         self.fd = fd
         try:
-            package = self.pkg.objects.get(name=metadata.name)
+            package = self.pkg.objects.get(
+                canonical_name=canonical_name(metadata.name, self.pkg_type)
+            )
             if not package.has_permission(user, "upload"):
                 raise Forbidden(f"You have no access to upload files in {package.name}")
         except self.pkg.DoesNotExist:
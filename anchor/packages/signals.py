@@ -0,0 +1,28 @@
+"""
+Signal handlers that clean up storage after removal of package files
+and keep pointers to the latest package files.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .jobs import enqueue
+from .models import Blob, Package, PackageFile, in_bulk_removal
+from .tasks import delete_stored_file
+
+
+# proxy models of the package types send signals with their own sender
+@receiver(post_delete)
+def file_removed(sender, instance, **kwargs):
+    if not isinstance(instance, PackageFile) or in_bulk_removal():
+        return
+    if instance.blob_id:
+        Blob.objects.release(instance.blob_id)
+    elif instance.fileobj.name:
+        # file was uploaded before blob storage
+        enqueue(delete_stored_file, instance.fileobj.name)
+
+
+@receiver([post_save, post_delete])
+def file_changed(sender, instance, raw=False, **kwargs):
+    if isinstance(instance, PackageFile) and not raw and not in_bulk_removal():
+        Package.update_latest(instance.package_id)
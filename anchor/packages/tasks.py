@@ -0,0 +1,28 @@
+"""
+Background tasks of the packages, see anchor.packages.jobs.
+"""
+from django.core.files.storage import default_storage
+
+from .jobs import task
+from .models import Blob, RetentionPolicy
+
+
+@task(priority=10)
+def remove_unused_blob(*blob_ids: int):
+    Blob.objects.remove_unused(id__in=blob_ids)
+
+
+@task(priority=10)
+def delete_stored_file(*names: str):
+    """ Removes files uploaded before the blob storage. """
+    for name in names:
+        default_storage.delete(name)
+
+
+@task(priority=20, max_attempts=1)
+def apply_retention(policy_id: int, dry_run=False):
+    try:
+        policy = RetentionPolicy.objects.get(id=policy_id)
+    except RetentionPolicy.DoesNotExist:
+        return
+    policy.apply(dry_run=dry_run)
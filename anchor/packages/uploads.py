@@ -0,0 +1,71 @@
+"""
+Upload handler that checks size and computes sha256 of the file
+while it's received from the client.
+File is written next to its final location (in the blob storage),
+so the storage just renames it instead of copying,
+and the data is passed only once.
+Leftovers of the failed uploads are removed by ``Blob.objects.collect``.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from ..exceptions import UserError
+from .models import BlobManager
+
+__all__ = ["HashedUploadedFile", "HashingUploadHandler"]
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """ Temporary file in the blob storage with precomputed sha256. """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        # TemporaryUploadedFile.__init__ is skipped
+        # because it places file in the FILE_UPLOAD_TEMP_DIR
+        _, ext = os.path.splitext(name)
+        root = Path(settings.MEDIA_ROOT, BlobManager.root)
+        root.mkdir(parents=True, exist_ok=True)
+        # .tmp files are collected with the other leftovers
+        file = tempfile.NamedTemporaryFile(
+            prefix="upload-", suffix=ext + ".tmp", dir=root
+        )
+        UploadedFile.__init__(  # pylint: disable=non-parent-init-called
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+        self.sha256 = None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """ Streams uploaded files to the HashedUploadedFile. """
+
+    max_size_kb = 2 ** 20  # 1GB, same as Uploader
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self._size > self.max_size_kb * 1024:
+            self.file.close()
+            raise UserError(
+                f"File size exceeds available ({self.max_size_kb * 1024} bytes)"
+            )
+        self._sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self._sha256.hexdigest()
+        return self.file
@@ -0,0 +1,91 @@
+"""
+Sortable keys of the PEP 440 versions.
+
+Key is an ASCII string, that is ordered (byte by byte)
+the same way as ``packaging.version.Version`` objects,
+so versions could be sorted and compared in SQL with the plain index:
+
+>>> sorted(["1.0", "1.0rc1", "1.0.post1", "1.0.dev1", "0.9"], key=version_key)
+['0.9', '1.0.dev1', '1.0rc1', '1.0', '1.0.post1']
+
+Numbers are prefixed with their length, so ``10`` goes after ``9``,
+and fields are separated with the space, that goes before any
+other character, so ``1.0`` goes before ``1.0.1``.
+Invalid versions have an empty key and go before all valid ones.
+"""
+import re
+import typing as ty
+
+from packaging.version import InvalidVersion, Version
+
+__all__ = ["version_key", "major_key", "is_prerelease"]
+
+_digits = "123456789abcdefghijklmnopqrstuvwxyz"
+_pre = {"a": "1", "b": "2", "rc": "3"}
+
+
+def _number(value: int) -> str:
+    digits = str(value)
+    if len(digits) > len(_digits):
+        raise InvalidVersion(f"Number {value} is too long")
+    return _digits[len(digits) - 1] + digits
+
+
+def _local(local: str) -> str:
+    # numbers go after strings, like in packaging
+    return ".".join(
+        f"1{_number(int(x))}" if x.isdigit() else f"0{x.lower()}"
+        for x in re.split(r"[._-]", local)
+    )
+
+
+def _parse(version: str) -> ty.Optional[Version]:
+    try:
+        return Version(version)
+    except InvalidVersion:
+        return None
+
+
+def version_key(version: str) -> str:
+    """ Returns key of the version, that is sortable byte by byte. """
+    parsed = _parse(version)
+    if parsed is None:
+        return ""
+    release = list(parsed.release)
+    # trailing zeros don't matter: 1.0 == 1
+    while len(release) > 1 and not release[-1]:
+        release.pop()
+    if parsed.pre is not None:
+        pre = _pre[parsed.pre[0]] + _number(parsed.pre[1])
+    elif parsed.post is None and parsed.dev is not None:
+        # 1.0.dev1 goes before 1.0a1
+        pre = "0"
+    else:
+        pre = "4"
+    post = "0" if parsed.post is None else "1" + _number(parsed.post)
+    dev = "1" if parsed.dev is None else "0" + _number(parsed.dev)
+    local = "0" if parsed.local is None else "1" + _local(parsed.local)
+    fields = [
+        _number(parsed.epoch),
+        ".".join(map(_number, release)),
+        pre,
+        post,
+        dev,
+        local,
+    ]
+    return " ".join(fields)
+
+
+def major_key(version: str) -> str:
+    """ Key of the major line (epoch and the first release number). """
+    key = version_key(version)
+    if not key:
+        return ""
+    epoch, release = key.split(" ")[:2]
+    return f"{epoch} {release.split('.')[0]}"
+
+
+def is_prerelease(version: str) -> bool:
+    """ Development and pre-releases, invalid versions are not. """
+    parsed = _parse(version)
+    return parsed is not None and parsed.is_prerelease
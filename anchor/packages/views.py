@@ -1,13 +1,12 @@
-from django import http
+from django.db.models import Q
 from django.views.generic import ListView, DetailView as DjangoDetail
-from django.shortcuts import get_object_or_404, reverse
+from django.shortcuts import get_object_or_404, redirect, reverse
 
 import humanize
 
 from .models import Package, PackageFile
 from ..users.auth import DetailView, AccessMixin
 from ..common import html
-from .. import exceptions
 
 
 class PackageSidebar(html.Sidebar):
@@ -34,12 +33,32 @@ class Index(ListView):
 
     def get_queryset(self):
         """
-        Returns list of packages that current user owns,
+        Returns list of packages that current user owns or has a role in,
         otherwise list of public packages.
         """
-        if self.request.user.is_authenticated:
-            return self.model.objects.filter(owner=self.request.user)
-        return self.model.objects.filter(public=True)
+        # latest files are used by the download links
+        packages = self.model.objects.select_related(
+            "latest_stable", "latest_prerelease"
+        )
+        user = self.request.user
+        if user.is_authenticated:
+            return packages.filter(
+                Q(owner=user)
+                | Q(user_roles__user=user)
+                | Q(group_roles__group__in=user.groups.all())
+            ).distinct()
+        return packages.filter(public=True)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        user = self.request.user
+        if user.is_authenticated:
+            # roles of the whole page are resolved at once
+            packages = context["package_list"]
+            levels = Package.effective_levels(user, packages)
+            for package in packages:
+                package.role = levels[package.pk].name
+        return context
 
 
 class PackageDetail(DetailView, SidebarSupport):
@@ -54,43 +73,48 @@ class PackageDetail(DetailView, SidebarSupport):
         # context["role"] = getattr(role, "name", None)
         # context["role_level"] = int(role)
         # context["permissions"] = self.object.permissions_for(level=role)
-        files = self.object.files.order_by("uploaded")[:10]
+        files = self.object.files.by_version()[:10]
         context["files"] = files
         context["files_table"] = FilesTable(files, paginate=False)
         context["stats"] = self.object.stats()
         return context
 
 
+def download_link(filename):
+    return '<a href="{}">{}</a>'.format(
+        reverse("pypi.download", args=[filename]), html.escape(filename)
+    )
+
+
+def file_actions(file_id):
+    return str(
+        html.DropdownButtons(
+            parent=None,
+            button="Actions",
+            contents={
+                "delete": reverse("packages:files_rm", args=[file_id]),
+                "rename": "#",
+            },
+        )
+    )
+
+
 class FilesTable(html.Table):
     fields = ["filename", "version", "size", "uploaded"]
-
-    def rows(self):
-        for row in super().rows():
-            link = '<a href="{}">{}</a>'.format(
-                reverse("pypi.download", args=[row[0]]), row[0]
-            )
-            row[0] = link
-            row[2] = humanize.naturalsize(row[2])
-            row[3] = humanize.naturalday(row[3])
-            yield row
+    formatters = {
+        "filename": download_link,
+        "size": humanize.naturalsize,
+        "uploaded": humanize.naturalday,
+    }
 
 
 class FilesActionsTable(FilesTable):
-    fields = FilesTable.fields + [""]
-
-    def rows(self):
-        for row in super().rows():
-            row.append(
-                html.DropdownButtons(
-                    parent=row,
-                    button="Actions",
-                    contents={
-                        "delete": reverse("packages:files_rm", args=[row.item.id]),
-                        "rename": "#",
-                    },
-                )
-            )
-            yield row
+    fields = FilesTable.fields + ["id"]
+    formatters = dict(FilesTable.formatters, id=file_actions)
+    labels = {"id": ""}
+    # packages could have thousands of files
+    keyset = "-id"
+    estimate_count = True
 
 
 class ListFiles(ListView, AccessMixin, SidebarSupport):
@@ -120,7 +144,7 @@ class FileRemove(DjangoDetail, AccessMixin, SidebarSupport):
     file = None
 
     def get_object(self, queryset=None):
-        self.file = PackageFile.objects.get(id=self.kwargs["id"])
+        self.file = get_object_or_404(PackageFile, id=self.kwargs["id"])
         pkg = self.file.package
         self.check_access(pkg, "remove_files")
         return pkg
@@ -130,14 +154,8 @@ class FileRemove(DjangoDetail, AccessMixin, SidebarSupport):
         context["file"] = self.file
         return context
 
-    def post(self, request, id_):
-        raise Exception("LOH")
-
-
-def download_file(request, filename: str):
-    pkg_file = get_object_or_404(PackageFile, filename=filename)
-    if not pkg_file.package.has_permission(request.user, "read"):
-        raise exceptions.Forbidden
-    pkg_file.package.downloads += 1
-    pkg_file.package.save()
-    return http.FileResponse(pkg_file.fileobj)
+    def post(self, request, *args, **kwargs):
+        pkg = self.get_object()
+        # stored file is removed by the background job
+        self.file.delete()
+        return redirect("packages:files", id=pkg.id)
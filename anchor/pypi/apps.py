@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PypiConfig(AppConfig):
     name = "anchor.pypi"
+
+    def ready(self):
+        from . import signals  # noqa pylint: disable=unused-import
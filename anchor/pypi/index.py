@@ -0,0 +1,210 @@
+"""
+Precomputed PEP 503 simple index.
+
+Pages are rendered once and kept in the cache until
+an upload or a file removal invalidates them, so warm requests
+touch neither the database nor the template engine.
+Optionally, pages are also written to the directory
+that could be served by the front proxy as a static files.
+Project pages are keyed by the canonical project names.
+"""
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import typing as ty
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+
+from ..packages.models import PackageTypes
+from .models import PackageFile, Project
+
+__all__ = ["SimpleIndex", "StaticIndex", "simple_index", "static_index"]
+
+log = logging.getLogger(__name__)
+
+
+class SimpleIndex:
+    """ Renders simple index pages and keeps them in the cache. """
+
+    prefix = "pypi.simple"
+
+    def __init__(self, cache_alias: str = "default"):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def timeout(self):
+        # pages are invalidated only in the local cache of the process,
+        # if the cache isn't shared, so they expire anyway
+        return getattr(settings, "PYPI_INDEX_TIMEOUT", 60)
+
+    def key(self, name: str = None) -> str:
+        """ Cache key of the project page, or of the root page if name is None. """
+        if name is None:
+            return f"{self.prefix}:projects"
+        return f"{self.prefix}:files:{quote(name)}"
+
+    def render_projects(self) -> str:
+        projects = Project.objects.order_by("canonical_name").values(
+            "name", "canonical_name"
+        )
+        return render_to_string("projects.html", {"projects": projects})
+
+    def render_files(self, name: str, files: ty.Iterable[PackageFile] = None) -> str:
+        """ Page of the project with the canonical name. """
+        if files is None:
+            files = PackageFile.objects.filter(
+                package__pkg_type=PackageTypes.Python.value,
+                package__canonical_name=name,
+            ).defer("core_metadata")
+        return render_to_string(
+            "files.html", dict(title=f"{name.capitalize()} files", files=files)
+        )
+
+    def projects(self) -> str:
+        """ Root page with all available projects. """
+        return self._get_or_render(self.key(), self.render_projects)
+
+    def cached(self, name: str) -> ty.Optional[str]:
+        """ Cached page of the project, if it's there. """
+        return self.cache.get(self.key(name))
+
+    def files(self, name: str) -> str:
+        """ Page with all files of the project, by the canonical name. """
+        return self._get_or_render(self.key(name), lambda: self.render_files(name))
+
+    def _get_or_render(self, key, render) -> str:
+        page = self.cache.get(key)
+        if page is None:
+            log.debug("Rendering %s", key)
+            page = render()
+            self.cache.set(key, page, self.timeout)
+        return page
+
+    def invalidate(self, name: str = None, root=False):
+        """
+        Drops cached page of the project.
+        Root page is dropped if name is None or root is set.
+        """
+        keys = []
+        if name is not None:
+            keys.append(self.key(name))
+        if name is None or root:
+            keys.append(self.key())
+        log.debug("Invalidating %s", keys)
+        self.cache.delete_many(keys)
+
+
+class StaticIndex:
+    """
+    Writes simple index pages to the directory:
+    ``<root>/index.html`` and ``<root>/<project>/index.html``.
+
+    Every page is written to a temporary file next to the target
+    and renamed over it, so readers never see partially written pages.
+    Project directories are marked, so only directories written
+    by the index are ever removed from the root.
+    """
+
+    marker = ".anchor-index"
+
+    def __init__(self, index: SimpleIndex, root: str = None):
+        self.index = index
+        self._root = root
+
+    @property
+    def root(self) -> ty.Optional[Path]:
+        root = self._root or getattr(settings, "PYPI_STATIC_INDEX_ROOT", None)
+        return Path(root) if root else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def write_projects(self):
+        self._write(self.root / "index.html", self.index.render_projects())
+
+    def write_files(self, name: str, files: ty.Iterable[PackageFile] = None):
+        page = self.index.render_files(name, files)
+        path = self._project_dir(name)
+        self._write(path / "index.html", page)
+        if not (path / self.marker).exists():
+            (path / self.marker).touch()
+
+    def remove_files(self, name: str):
+        path = self._project_dir(name)
+        if self._is_project_dir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _is_project_dir(self, path: Path) -> bool:
+        return (path / self.marker).is_file()
+
+    def _project_dir(self, name: str) -> Path:
+        if not name or name in {".", ".."} or "/" in name or "\\" in name:
+            raise ValueError(f"Invalid project name {name!r}")
+        return self.root / name
+
+    def update(self, name: str, root=False):
+        """
+        Regenerates page of the single project (if it still exists)
+        and root page if requested.
+        """
+        if Project.objects.filter(canonical_name=name).exists():
+            self.write_files(name)
+        else:
+            self.remove_files(name)
+        if root:
+            self.write_projects()
+
+    def build(self) -> int:
+        """
+        Writes the whole index from scratch.
+        Files are fetched in one query and grouped by the project name.
+        """
+        self.write_projects()
+        names = set(Project.objects.values_list("canonical_name", flat=True))
+        files = (
+            PackageFile.objects.select_related("package")
+            .defer("core_metadata")
+            .order_by("package__canonical_name", "filename")
+            .iterator()
+        )
+        written = set()
+        for name, group in itertools.groupby(
+            files, key=lambda x: x.package.canonical_name
+        ):
+            self.write_files(name, list(group))
+            written.add(name)
+        for name in names - written:
+            self.write_files(name, [])
+        for path in self.root.iterdir():
+            if path.name not in names and self._is_project_dir(path):
+                log.debug("Removing stale %s", path)
+                shutil.rmtree(path)
+        return len(names)
+
+    def _write(self, path: Path, content: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                out.write(content)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        log.debug("Written %s", path)
+
+
+simple_index = SimpleIndex()
+static_index = StaticIndex(simple_index)
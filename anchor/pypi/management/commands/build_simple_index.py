@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...index import StaticIndex, simple_index, static_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes static simple index pages to PYPI_STATIC_INDEX_ROOT. "
+        "Without arguments rebuilds the whole index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "projects", nargs="*", help="Regenerate only these projects"
+        )
+        parser.add_argument("-o", "--output", help="Output directory")
+
+    def handle(self, *args, projects=(), output=None, **options):
+        index = StaticIndex(simple_index, root=output) if output else static_index
+        if not index.enabled:
+            raise CommandError("Set PYPI_STATIC_INDEX_ROOT or provide --output")
+        start = time.monotonic()
+        if projects:
+            for name in projects:
+                index.update(name)
+            index.write_projects()
+            count = len(projects)
+        else:
+            count = index.build()
+        self.stdout.write(
+            "Written %s projects to %s in %.2fs"
+            % (count, index.root, time.monotonic() - start)
+        )
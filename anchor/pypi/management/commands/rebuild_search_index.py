@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ... import search
+
+
+class Command(BaseCommand):
+    help = "Fills the projects search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, database="default", **options):
+        backend = search.backend(database)
+        count = backend.rebuild()
+        self.stdout.write(f"Indexed {count} projects with {type(backend).__name__}")
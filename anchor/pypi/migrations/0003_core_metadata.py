@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pypi", "0002_auto_20190524_1447"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="packagefile",
+            name="core_metadata",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="packagefile",
+            name="core_metadata_sha256",
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pypi", "0003_core_metadata"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="packagefile",
+            name="sha256",
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# see anchor.pypi.search
+VECTOR = (
+    "setweight(to_tsvector('simple', name), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(summary, '')), 'B')"
+)
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX pypi_search_idx ON packages_package USING gin (({VECTOR}))"
+        )
+    elif connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            if ("ENABLE_FTS5",) not in cursor.fetchall():
+                # search falls back to LIKE queries
+                return
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE pypi_search USING fts5(name, summary, prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO pypi_search (rowid, name, summary) "
+            "SELECT p.id, p.name, coalesce(p.summary, '') FROM packages_package p "
+            "JOIN pypi_project pp ON pp.package_ptr_id = p.id"
+        )
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS pypi_search_idx")
+    elif connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS pypi_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("pypi", "0004_blobs")]
+
+    operations = [migrations.RunPython(create_index, drop_index)]
@@ -0,0 +1,19 @@
+"""
+Python columns move to the packages table (see 0007_single_table),
+child columns are renamed first, so they don't clash with the new ones.
+"""
+from django.db import migrations
+
+COLUMNS = ["dist_type", "sha256", "_metadata", "core_metadata", "core_metadata_sha256"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("pypi", "0005_search")]
+
+    operations = [
+        migrations.RenameField(
+            model_name="packagefile", old_name=name, new_name=f"old{name}"
+        )
+        for name in COLUMNS
+    ]
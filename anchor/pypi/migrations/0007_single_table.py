@@ -0,0 +1,80 @@
+"""
+Moves python columns from the pypi tables to the packages ones,
+so Project and PackageFile become proxy models without joins.
+"""
+from django.db import migrations
+
+COLUMNS = ["dist_type", "sha256", "_metadata", "core_metadata", "core_metadata_sha256"]
+# see 0006_rename_python_columns
+OLD_COLUMNS = [f"old{x}" for x in COLUMNS]
+
+
+def to_single_table(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Project = apps.get_model("pypi", "Project")
+    PackageFile = apps.get_model("pypi", "PackageFile")
+    Package = apps.get_model("packages", "Package")
+    BaseFile = apps.get_model("packages", "PackageFile")
+    Package.objects.using(alias).filter(
+        id__in=Project.objects.using(alias).values("package_ptr")
+    ).update(pkg_type="python")
+    rows = (
+        PackageFile.objects.using(alias)
+        .values_list("packagefile_ptr", *OLD_COLUMNS)
+        .iterator()
+    )
+    for pk, *values in rows:
+        BaseFile.objects.using(alias).filter(pk=pk).update(
+            pkg_type="python", **dict(zip(COLUMNS, values))
+        )
+
+
+def to_child_tables(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    Project = apps.get_model("pypi", "Project")
+    PackageFile = apps.get_model("pypi", "PackageFile")
+    Package = apps.get_model("packages", "Package")
+    BaseFile = apps.get_model("packages", "PackageFile")
+    # raw save writes only the child table and keeps the parent rows as is
+    for pk in (
+        Package.objects.using(alias)
+        .filter(pkg_type="python")
+        .values_list("pk", flat=True)
+    ):
+        Project(package_ptr_id=pk).save_base(raw=True, force_insert=True, using=alias)
+    rows = (
+        BaseFile.objects.using(alias)
+        .filter(pkg_type="python")
+        .values_list("pk", *COLUMNS)
+        .iterator()
+    )
+    for pk, *values in rows:
+        PackageFile(packagefile_ptr_id=pk, **dict(zip(OLD_COLUMNS, values))).save_base(
+            raw=True, force_insert=True, using=alias
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0010_single_table"),
+        ("pypi", "0006_rename_python_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(to_single_table, to_child_tables),
+        migrations.DeleteModel(name="PackageFile"),
+        migrations.DeleteModel(name="Project"),
+        migrations.CreateModel(
+            name="PackageFile",
+            fields=[],
+            options={"proxy": True, "indexes": [], "constraints": []},
+            bases=("packages.packagefile",),
+        ),
+        migrations.CreateModel(
+            name="Project",
+            fields=[],
+            options={"proxy": True, "indexes": [], "constraints": []},
+            bases=("packages.package",),
+        ),
+    ]
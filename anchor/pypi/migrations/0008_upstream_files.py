@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("packages", "0017_jobs"),
+        ("pypi", "0007_single_table"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UpstreamFile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("project", models.CharField(db_index=True, max_length=64)),
+                ("filename", models.CharField(max_length=255, unique=True)),
+                ("url", models.TextField()),
+                ("sha256", models.CharField(blank=True, max_length=64)),
+                ("requires_python", models.CharField(blank=True, max_length=255)),
+                ("fileobj", models.FileField(blank=True, upload_to="")),
+                ("fetching", models.DateTimeField(null=True)),
+                (
+                    "blob",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="packages.Blob",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,394 @@
+"""
+Pull-through mirror of the upstream simple index (``PYPI_UPSTREAM_URL``).
+
+Projects that don't exist in Anchor are looked up in the upstream index.
+Files listed by the upstream page are recorded (:class:`~.models.UpstreamFile`)
+and the page is served with the links to Anchor downloads.
+
+Pages are cached for ``PYPI_UPSTREAM_TTL`` seconds. After that, the stale page
+is served for ``PYPI_UPSTREAM_STALE`` seconds more, while it's refreshed
+in the background (or it's served until the upstream is back, if it's down).
+Projects that are missing upstream are remembered
+for ``PYPI_UPSTREAM_NEGATIVE_TTL`` seconds.
+
+Files are fetched on the first download: upstream response is streamed
+to the client while it's written to the blob storage.
+Only one request fetches the file, concurrent ones wait
+until it's stored, so upstream sees a single download of every file.
+The fetching request renews its claim (``PYPI_UPSTREAM_LEASE``)
+while the file is transferred, so slow clients don't cause another fetch.
+"""
+import collections
+import hashlib
+import html.parser
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing as ty
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import quote, unquote, urldefrag, urljoin, urlparse
+from urllib.request import Request, urlopen
+
+from django import http
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import quote_etag
+
+import anchor
+
+from ..exceptions import UpstreamError
+from ..packages import downloads, jobs
+from ..packages.models import Blob
+from .models import UpstreamFile
+
+__all__ = ["Mirror", "mirror", "parse_page"]
+
+log = logging.getLogger(__name__)
+
+
+class _Links(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links: ty.List[ty.Tuple[dict, str]] = []
+        self._current: ty.Optional[dict] = None
+        self._text: ty.List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._current, self._text = dict(attrs), []
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._current is not None:
+            self.links.append((self._current, "".join(self._text).strip()))
+            self._current = None
+
+
+def parse_page(page: str, base_url: str) -> ty.List[dict]:
+    """ Files of the `PEP 503`_ project page: filename, url, sha256 and requires_python. """
+    parser = _Links()
+    parser.feed(page)
+    files = []
+    for attrs, text in parser.links:
+        if not attrs.get("href"):
+            continue
+        url, fragment = urldefrag(urljoin(base_url, attrs["href"]))
+        filename = text or unquote(Path(urlparse(url).path).name)
+        if not filename or "/" in filename or "\\" in filename:
+            continue
+        algorithm, _, digest = fragment.partition("=")
+        files.append(
+            dict(
+                filename=filename,
+                url=url,
+                sha256=digest if algorithm == "sha256" else "",
+                requires_python=attrs.get("data-requires-python") or "",
+            )
+        )
+    return files
+
+
+class _Fetched:
+    """ Fetched file, that is moved to the blob storage, see BlobManager.store """
+
+    def __init__(self, path: str, sha256: str, size: int):
+        self.path, self.sha256, self.size = path, sha256, size
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+
+class Mirror:
+    """ Caches upstream project pages and files. """
+
+    prefix = "pypi.mirror"
+    chunk_size = 64 * 1024
+    # seconds between checks of the file, that is fetched by another request
+    poll_interval = 0.2
+
+    def __init__(self, cache_alias: str = "default"):
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._locks: ty.Dict[str, threading.Lock] = collections.defaultdict(
+            threading.Lock
+        )
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def url(self) -> ty.Optional[str]:
+        return getattr(settings, "PYPI_UPSTREAM_URL", None)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url)
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, "PYPI_UPSTREAM_TTL", 600)
+
+    @property
+    def stale(self) -> int:
+        return getattr(settings, "PYPI_UPSTREAM_STALE", 86400)
+
+    @property
+    def negative_ttl(self) -> int:
+        return getattr(settings, "PYPI_UPSTREAM_NEGATIVE_TTL", 300)
+
+    @property
+    def timeout(self) -> int:
+        return getattr(settings, "PYPI_UPSTREAM_TIMEOUT", 60)
+
+    @property
+    def lease(self) -> float:
+        return getattr(settings, "PYPI_UPSTREAM_LEASE", 120)
+
+    @property
+    def wait(self) -> float:
+        return getattr(settings, "PYPI_UPSTREAM_WAIT", 900)
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}:files:{quote(name)}"
+
+    # pages
+
+    def cached(self, name: str) -> bool:
+        """
+        Project is looked up upstream and not added to Anchor since
+        (local projects drop their upstream pages, see ``forget``).
+        """
+        return self.cache.get(self.key(name)) is not None
+
+    def forget(self, name: str):
+        self.cache.delete(self.key(name))
+
+    def files(self, name: str) -> ty.Optional[str]:
+        """
+        Page of the upstream project, by the canonical name.
+        Returns None if there is no such project upstream.
+        """
+        entry = self.cache.get(self.key(name))
+        if entry is None:
+            return self.refresh(name)
+        if entry["page"] is not None and time.time() - entry["fetched"] > self.ttl:
+            self.revalidate(name)
+        return entry["page"]
+
+    def refresh(self, name: str) -> ty.Optional[str]:
+        """ Fetches the page, concurrent fetches of the process are merged. """
+        with self._lock:
+            lock = self._locks[name]
+        with lock:
+            entry = self.cache.get(self.key(name))
+            if entry is not None and time.time() - entry["fetched"] <= self.ttl:
+                # fetched while we were waiting
+                return entry["page"]
+            try:
+                links = self.fetch_links(name)
+            except UpstreamError:
+                if entry is None:
+                    raise
+                log.warning("Serving stale page of %s", name, exc_info=True)
+                return entry["page"]
+            page = None if links is None else self.record(name, links)
+            timeout = self.negative_ttl if page is None else self.ttl + self.stale
+            self.cache.set(
+                self.key(name), dict(fetched=time.time(), page=page), timeout
+            )
+            return page
+
+    def revalidate(self, name: str):
+        """ Refreshes the stale page in the background. """
+        if not self.cache.add(f"{self.prefix}:refresh:{quote(name)}", 1, self.timeout):
+            return
+        if jobs.is_async():
+            jobs.enqueue(refresh_page, name)
+        else:
+            threading.Thread(
+                target=_refresh_thread, args=(name,), name="mirror-refresh", daemon=True
+            ).start()
+
+    def fetch_links(self, name: str) -> ty.Optional[ty.List[dict]]:
+        url = urljoin(self.url.rstrip("/") + "/", quote(name) + "/")
+        try:
+            with self.open(url, accept="text/html") as response:
+                charset = response.headers.get_content_charset() or "utf-8"
+                page, final_url = response.read().decode(charset), response.geturl()
+        except HTTPError as e:
+            if e.code == 404:
+                log.debug("%s is missing upstream", name)
+                return None
+            raise UpstreamError(f"Upstream index responded with {e.code}") from e
+        except OSError as e:
+            raise UpstreamError(f"Upstream index is not available: {e}") from e
+        return parse_page(page, final_url)
+
+    def record(self, name: str, links: ty.List[dict]) -> str:
+        """ Saves upstream files and renders the page with the local links. """
+        UpstreamFile.objects.bulk_create(
+            [UpstreamFile(project=name, **link) for link in links],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        return render_to_string(
+            "files.html", dict(title=f"{name.capitalize()} files", files=links)
+        )
+
+    def open(self, url: str, accept: str = "*/*"):
+        headers = {"Accept": accept, "User-Agent": f"anchor/{anchor.__version__}"}
+        return urlopen(Request(url, headers=headers), timeout=self.timeout)
+
+    # files
+
+    def download(self, request, filename: str) -> http.response.HttpResponseBase:
+        """ Serves stored upstream file, fetches it on the first download. """
+        pkg_file = get_object_or_404(UpstreamFile, filename=filename)
+        deadline = time.monotonic() + self.wait
+        lease = timedelta(seconds=self.lease)
+        while pkg_file.blob_id is None:
+            claimed = timezone.now()
+            if UpstreamFile.objects.claim(pkg_file.pk, lease, now=claimed):
+                return self.fetch(pkg_file, claimed)
+            # another request fetches the file
+            if time.monotonic() > deadline:
+                raise UpstreamError(f"Timed out waiting for {filename}")
+            time.sleep(self.poll_interval)
+            pkg_file.refresh_from_db()
+        etag = quote_etag(pkg_file.sha256)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = downloads.send_file(pkg_file, request, etag=etag)
+        response["ETag"] = etag
+        return response
+
+    def fetch(
+        self, pkg_file: UpstreamFile, claimed: datetime
+    ) -> http.StreamingHttpResponse:
+        """ Streams upstream file to the client and the storage. """
+        try:
+            upstream = self.open(pkg_file.url)
+        except OSError as e:
+            UpstreamFile.objects.filter(pk=pkg_file.pk, fetching=claimed).update(
+                fetching=None
+            )
+            raise UpstreamError(f"Failed to fetch {pkg_file.filename}: {e}") from e
+        response = http.StreamingHttpResponse(
+            self._tee(pkg_file, upstream, claimed),
+            content_type=downloads.content_type(pkg_file.filename),
+        )
+        if upstream.headers.get("Content-Length"):
+            response["Content-Length"] = upstream.headers["Content-Length"]
+        if pkg_file.sha256:
+            response["ETag"] = quote_etag(pkg_file.sha256)
+        return response
+
+    def _tee(
+        self, pkg_file: UpstreamFile, upstream, claimed: datetime
+    ) -> ty.Iterator[bytes]:
+        """
+        Yields upstream chunks and writes them to the storage.
+        If the claim is lost (the fetch is taken over by another request),
+        the client still gets the file, but it isn't stored by this request.
+        """
+        root = Path(settings.MEDIA_ROOT, Blob.objects.root)
+        root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+        digest = hashlib.sha256()
+        current: ty.Optional[datetime] = claimed
+        stored = False
+        try:
+            with os.fdopen(fd, "wb") as out, upstream:
+                # returns what's received, instead of waiting for the full chunk
+                chunks = iter(lambda: upstream.read1(self.chunk_size), b"")
+                try:
+                    for chunk in chunks:
+                        if current is not None:
+                            digest.update(chunk)
+                            out.write(chunk)
+                            current = self._renew(pkg_file, current)
+                        yield chunk
+                except GeneratorExit:
+                    # client has gone, but the others wait for the file
+                    for chunk in chunks:
+                        if current is None:
+                            break
+                        digest.update(chunk)
+                        out.write(chunk)
+                        current = self._renew(pkg_file, current)
+                size = out.tell()
+            if current is not None:
+                fetched = _Fetched(tmp, digest.hexdigest(), size)
+                stored = self._store(pkg_file, current, fetched)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            if not stored and current is not None:
+                UpstreamFile.objects.filter(pk=pkg_file.pk, fetching=current).update(
+                    fetching=None
+                )
+
+    def _renew(
+        self, pkg_file: UpstreamFile, claimed: datetime
+    ) -> ty.Optional[datetime]:
+        """ Extends the claim of the file, returns None if it's lost. """
+        now = timezone.now()
+        if (now - claimed).total_seconds() < self.lease / 4:
+            return claimed
+        if UpstreamFile.objects.renew(pkg_file.pk, claimed, now):
+            return now
+        log.warning("Fetch of %s is taken over by another request", pkg_file)
+        return None
+
+    def _store(
+        self, pkg_file: UpstreamFile, claimed: datetime, fetched: _Fetched
+    ) -> bool:
+        if pkg_file.sha256 and pkg_file.sha256 != fetched.sha256:
+            log.error(
+                "%s sha256 mismatch: %s instead of %s",
+                pkg_file.filename,
+                fetched.sha256,
+                pkg_file.sha256,
+            )
+            return False
+        blob = Blob.objects.store(fetched)
+        updated = UpstreamFile.objects.filter(pk=pkg_file.pk, fetching=claimed).update(
+            blob=blob, fileobj=blob.name, sha256=blob.sha256, fetching=None
+        )
+        if not updated:
+            log.warning("Fetch of %s is taken over by another request", pkg_file)
+            Blob.objects.release(blob.id)
+            return False
+        log.info("Fetched %s (%s bytes)", pkg_file.filename, fetched.size)
+        return True
+
+
+mirror = Mirror()
+
+
+@jobs.task
+def refresh_page(name: str):
+    try:
+        mirror.refresh(name)
+    finally:
+        mirror.cache.delete(f"{mirror.prefix}:refresh:{quote(name)}")
+
+
+def _refresh_thread(name: str):
+    try:
+        refresh_page(name)
+    finally:
+        connections.close_all()
@@ -5,25 +5,34 @@ import hashlib
 import json
 import logging
 import re
+import tarfile
 import typing as ty
+import zipfile
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # https://github.com/pypa/packaging
 import packaging.utils
+import packaging.version
 import pkg_resources
 import stdlib_list
+from django.conf import settings
 from django.db import models
-from django.urls import reverse
+from django.utils import timezone
 
 from ..exceptions import ServiceError, UserError
+from ..packages import jobs
 from ..packages import models as base_models
 
-__all__ = ["Metadata", "Project", "PackageFile"]
+__all__ = ["Metadata", "Project", "PackageFile", "UpstreamFile"]
 
 log = logging.getLogger(__name__)
 prohibited_packages = set(stdlib_list.stdlib_list("3.7"))
 # TODO maybe also allow zip and egg?
 allowed_files = re.compile(r".+\.(tar\.gz|whl)$", re.I)
+metadata_version_re = re.compile(rb"^Metadata-Version:[ \t]*(\S+)", re.I | re.M)
+# sdist metadata before 2.2 (PEP 643) doesn't promise the fields are static
+SDIST_METADATA_VERSION = packaging.version.Version("2.2")
 
 
 @dataclasses.dataclass
@@ -38,6 +47,7 @@ class Metadata(base_models.Metadata):
     metadata_version: str
     description: str
     sha256_digest: str
+    requires_python: str = ""
 
     def __post_init__(self):
         self.name = pkg_resources.safe_name(self.name)
@@ -49,8 +59,13 @@ class Metadata(base_models.Metadata):
 class Project(base_models.Package):
     """Python project (set of packages)"""
 
-    def __init__(self, *args):
-        super().__init__(*args)
+    objects = base_models.TypedManager(base_models.PackageTypes.Python)
+
+    class Meta:
+        proxy = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.pkg_type = base_models.PackageTypes.Python.value
 
 
@@ -77,25 +92,102 @@ class ShaReader(base_models.ChunkedReader):
             )
 
 
+def read_core_metadata(path: Path, filename: str = None) -> ty.Optional[bytes]:
+    """
+    Extracts core metadata file from the distribution:
+    METADATA from the wheel's .dist-info directory or PKG-INFO from the sdist.
+    Returns None if there is no such file, or if the sdist's metadata
+    is older than 2.2, so installers build the sdist to get the real one.
+    """
+    # stored file could be renamed by storage, so type is taken from the original name
+    name = (filename or path.name).lower()
+    try:
+        if name.endswith(".whl"):
+            with zipfile.ZipFile(path) as wheel:
+                found = [
+                    x
+                    for x in wheel.namelist()
+                    if x.count("/") == 1 and x.endswith(".dist-info/METADATA")
+                ]
+                return wheel.read(found[0]) if len(found) == 1 else None
+        if name.endswith(".tar.gz"):
+            with tarfile.open(path, "r:gz") as sdist:
+                for member in sdist:
+                    if (
+                        member.isfile()
+                        and member.name.count("/") == 1
+                        and member.name.endswith("/PKG-INFO")
+                    ):
+                        data = sdist.extractfile(member).read()  # type: ignore
+                        return data if _static_metadata(data) else None
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        log.debug("Failed to read metadata from %s: %r", path, e)
+    return None
+
+
+def _static_metadata(data: bytes) -> bool:
+    """ Checks that sdist's metadata version is at least 2.2. """
+    match = metadata_version_re.search(data)
+    try:
+        version = packaging.version.Version(match.group(1).decode())
+    except (AttributeError, UnicodeDecodeError, packaging.version.InvalidVersion):
+        return False
+    return version >= SDIST_METADATA_VERSION
+
+
 class PackageFile(base_models.PackageFile):
-    dist_type = models.CharField(max_length=16)
-    sha256 = models.CharField(max_length=64, unique=True)
-    _metadata = models.TextField()
+    """
+    Python distribution, python columns are stored in the base table.
+
+    Frequently used metadata fields are stored in their own columns
+    (see ``columns``), the rest is stored as JSON and decoded
+    at most once per instance.
+    """
+
+    objects = base_models.TypedFileManager(base_models.PackageTypes.Python)
+
+    # metadata field -> column
+    columns = {
+        "filetype": "dist_type",
+        "metadata_version": "metadata_version",
+        "requires_python": "requires_python",
+        "sha256_digest": "sha256",
+        "description": "description",
+    }
+    _decoded: ty.Optional[dict] = None
+
+    class Meta:
+        proxy = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pkg_type = base_models.PackageTypes.Python.value
 
     @property
     def metadata(self) -> Metadata:
-        if not self._metadata:
-            raise ValueError("No metadata available")
-        return Metadata(**json.loads(self._metadata))
+        """ Full metadata, loads the description if it's deferred. """
+        extra = {field: getattr(self, column) for field, column in self.columns.items()}
+        return Metadata(**self._fields(), **extra)
 
     @metadata.setter
     def metadata(self, val: Metadata):
-        self.dist_type = val.filetype
-        self._metadata = json.dumps(val.__dict__)
+        data = dict(val.__dict__)
+        for field, column in self.columns.items():
+            setattr(self, column, data.pop(field) or "")
+        self._metadata = json.dumps(data)
+        self._decoded = data
 
-    @property
-    def link(self):
-        return reverse("pypi.download", kwargs={"filename": self.name})
+    def _fields(self) -> dict:
+        """ Metadata fields stored as JSON. """
+        if self._decoded is None:
+            if not self._metadata:
+                raise ValueError("No metadata available")
+            self._decoded = json.loads(self._metadata)
+        return self._decoded
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._decoded = None
 
     def update(self, src, metadata):
         super().update(src, metadata)
@@ -103,6 +195,17 @@ class PackageFile(base_models.PackageFile):
         self._extract_name(src)
         self.sha256 = src.sha256
         log.debug("%s sha256: %s", self.filename, self.sha256)
+        if jobs.is_async():
+            # extracted by the job after upload, see PyUploader
+            self.core_metadata = self.core_metadata_sha256 = None
+        else:
+            self.update_core_metadata()
+
+    def update_core_metadata(self):
+        """ Extracts core metadata from the stored file. """
+        data = read_core_metadata(self.path, self.filename)
+        self.core_metadata = data
+        self.core_metadata_sha256 = hashlib.sha256(data).hexdigest() if data else None
 
     def _extract_name(self, pkg, filename=None):
         filename = Path(
@@ -119,7 +222,63 @@ class PackageFile(base_models.PackageFile):
         return self.filename
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
         try:
-            return getattr(self.metadata, name)
-        except AttributeError:
+            return self._fields()[name]
+        except (KeyError, ValueError):
             raise AttributeError(name) from None
+
+
+class UpstreamFileManager(models.Manager):
+    def claim(self, pk: int, lease: timedelta, now=None) -> bool:
+        """
+        Marks the file as being fetched.
+        Returns False if it's fetched by another request right now,
+        claims that weren't renewed for the lease time are taken over.
+        """
+        now = now or timezone.now()
+        claimed = (
+            self.filter(pk=pk, blob__isnull=True)
+            .filter(
+                models.Q(fetching__isnull=True) | models.Q(fetching__lt=now - lease)
+            )
+            .update(fetching=now)
+        )
+        return bool(claimed)
+
+    def renew(self, pk: int, claimed: datetime, now=None) -> bool:
+        """ Extends the claim, returns False if it's taken by another request. """
+        renewed = self.filter(pk=pk, blob__isnull=True, fetching=claimed).update(
+            fetching=now or timezone.now()
+        )
+        return bool(renewed)
+
+
+class UpstreamFile(models.Model):
+    """
+    File of the project from the upstream index (see anchor.pypi.mirror),
+    contents are stored in the blob storage on the first download.
+    """
+
+    # canonical name
+    project = models.CharField(max_length=64, db_index=True)
+    filename = models.CharField(max_length=255, unique=True)
+    url = models.TextField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    requires_python = models.CharField(max_length=255, blank=True)
+    blob = models.ForeignKey(
+        base_models.Blob, null=True, on_delete=models.PROTECT, related_name="+"
+    )
+    fileobj = models.FileField(blank=True)
+    # set while the file is downloaded from the upstream
+    fetching = models.DateTimeField(null=True)
+
+    objects = UpstreamFileManager()
+
+    @property
+    def path(self) -> Path:
+        return Path(settings.MEDIA_ROOT, self.fileobj.name)
+
+    def __str__(self):
+        return self.filename
@@ -0,0 +1,251 @@
+"""
+Full-text search of the projects, used by the XML-RPC ``search`` method.
+
+Implementation depends on the database:
+
+- SQLite: FTS5 table ``pypi_search``, that is updated by the signal handlers
+  in the same transaction as the project itself;
+- PostgreSQL: GIN index over the ``tsvector`` of the name and summary,
+  that is maintained by the database;
+- others (or SQLite without FTS5): ``LIKE`` queries over the projects table.
+
+Values are split into words and matched by the word prefixes,
+so ``rest`` finds both ``django-rest-framework`` and ``restview``.
+Name matches are ranked higher than summary ones.
+"""
+import functools
+import logging
+import operator as op
+import re
+import typing as ty
+
+from django.db import connections, models
+
+from ..exceptions import UserError
+from .models import Project
+
+__all__ = ["Term", "SearchBackend", "backend", "search"]
+
+log = logging.getLogger(__name__)
+
+fields = ("name", "summary")
+# Warehouse returns at most 100 projects per call
+max_results = 100
+
+# underscores are separators in both FTS5 and tsvector
+_words = re.compile(r"[^\W_]+")
+
+
+class Term(ty.NamedTuple):
+    """ Words that should be found in the field. """
+
+    field: str
+    words: ty.Tuple[str, ...]
+
+
+def parse_spec(spec: ty.Mapping[str, ty.Iterable[str]]) -> ty.List[Term]:
+    """ Converts XML-RPC spec (field -> list of values) to the terms. """
+    if not isinstance(spec, dict):
+        raise UserError("Spec should be a struct")
+    if not all(x in fields for x in spec):
+        raise UserError("Function supports only 'name' and 'summary' fields")
+    terms = []
+    for field, values in spec.items():
+        if isinstance(values, str):
+            values = [values]
+        for value in values:
+            words = tuple(_words.findall(str(value).lower()))
+            if words:
+                terms.append(Term(field, words))
+    return terms
+
+
+class SearchBackend:
+    """ Fallback search with LIKE queries. """
+
+    weights = {"name": 10, "summary": 1}
+
+    def __init__(self, alias: str = "default"):
+        self.alias = alias
+
+    @property
+    def connection(self):
+        return connections[self.alias]
+
+    def update(self, project: Project):
+        """ Adds or updates project in the index. """
+
+    def remove(self, project_id: int):
+        """ Removes project from the index. """
+
+    def rebuild(self) -> int:
+        """ Fills the index from scratch. """
+        return 0
+
+    def search(self, terms: ty.List[Term], operator="and", offset=0, limit=None):
+        matches = [
+            functools.reduce(
+                op.and_,
+                (models.Q(**{f"{term.field}__icontains": w}) for w in term.words),
+            )
+            for term in terms
+        ]
+        query = functools.reduce(op.and_ if operator == "and" else op.or_, matches)
+        score = sum(
+            (
+                models.Case(
+                    models.When(match, then=self.weights[term.field]),
+                    default=0,
+                    output_field=models.IntegerField(),
+                )
+                for term, match in zip(terms, matches)
+            ),
+            models.Value(0),
+        )
+        projects = (
+            Project.objects.using(self.alias)
+            .filter(query)
+            .annotate(score=score)
+            .order_by("-score", "name")
+            .values("name", "version", "summary")
+        )
+        return list(projects[offset : offset + limit])
+
+
+class SqliteBackend(SearchBackend):
+    """ SQLite FTS5 virtual table with rowid = project id. """
+
+    table = "pypi_search"
+
+    def available(self) -> bool:
+        return self.table in self.connection.introspection.table_names()
+
+    def update(self, project: Project):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.table} (rowid, name, summary) "
+                "VALUES (%s, %s, %s)",
+                [project.id, project.name, project.summary or ""],
+            )
+
+    def remove(self, project_id: int):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [project_id])
+
+    def rebuild(self) -> int:
+        projects = Project.objects.using(self.alias).values_list(
+            "id", "name", "summary"
+        )
+        rows = [(pk, name, summary or "") for pk, name, summary in projects.iterator()]
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, name, summary) VALUES (%s, %s, %s)",
+                rows,
+            )
+        return len(rows)
+
+    def match(self, terms: ty.List[Term], operator: str) -> str:
+        """ FTS5 query, like ``(name : "foo"* AND name : "bar"*) OR (...)`` """
+        groups = [
+            "({})".format(
+                " AND ".join(f'{term.field} : "{word}"*' for word in term.words)
+            )
+            for term in terms
+        ]
+        return f" {operator.upper()} ".join(groups)
+
+    def search(self, terms: ty.List[Term], operator="and", offset=0, limit=None):
+        weights = ", ".join(str(float(self.weights[x])) for x in fields)
+        sql = (
+            "SELECT p.name, p.version, p.summary "
+            f"FROM {self.table} s JOIN packages_package p ON p.id = s.rowid "
+            f"WHERE {self.table} MATCH %s "
+            f"ORDER BY bm25({self.table}, {weights}), p.name "
+            "LIMIT %s OFFSET %s"
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [self.match(terms, operator), limit, offset])
+            return [
+                dict(name=name, version=version, summary=summary)
+                for name, version, summary in cursor.fetchall()
+            ]
+
+
+class PostgresBackend(SearchBackend):
+    """
+    Expression GIN index on the packages table.
+    Name words have weight A and summary words have weight B,
+    so a term restricted to the field is ``word:*A``.
+    """
+
+    index = "pypi_search_idx"
+    vector = (
+        "setweight(to_tsvector('simple', name), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(summary, '')), 'B')"
+    )
+    labels = {"name": "A", "summary": "B"}
+
+    def query(self, terms: ty.List[Term], operator: str) -> str:
+        """ tsquery, like ``(foo:*A & bar:*A) | (foo:*B)`` """
+        groups = [
+            "({})".format(
+                " & ".join(f"{word}:*{self.labels[term.field]}" for word in term.words)
+            )
+            for term in terms
+        ]
+        return (" & " if operator == "and" else " | ").join(groups)
+
+    def search(self, terms: ty.List[Term], operator="and", offset=0, limit=None):
+        sql = (
+            "SELECT name, version, summary FROM packages_package "
+            f"WHERE pkg_type = %s AND ({self.vector}) @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank({self.vector}, to_tsquery('simple', %s)) DESC, name "
+            "LIMIT %s OFFSET %s"
+        )
+        query = self.query(terms, operator)
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, ["python", query, query, limit, offset])
+            return [
+                dict(name=name, version=version, summary=summary)
+                for name, version, summary in cursor.fetchall()
+            ]
+
+
+_backends: ty.Dict[str, SearchBackend] = {}
+
+
+def backend(alias: str = "default") -> SearchBackend:
+    """ Returns search backend for the database connection. """
+    if alias not in _backends:
+        vendor = connections[alias].vendor
+        if vendor == "postgresql":
+            found: SearchBackend = PostgresBackend(alias)
+        elif vendor == "sqlite" and SqliteBackend(alias).available():
+            found = SqliteBackend(alias)
+        else:
+            found = SearchBackend(alias)
+        log.debug("Using %s for %s", type(found).__name__, alias)
+        _backends[alias] = found
+    return _backends[alias]
+
+
+def search(
+    spec: ty.Mapping[str, ty.Iterable[str]], operator="and", offset=0, limit=None
+) -> ty.List[dict]:
+    """
+    Searches the projects.
+    Returns at most ``max_results`` dicts with name, version and summary,
+    the best matches first.
+    """
+    operator = str(operator).lower()
+    if operator not in {"and", "or"}:
+        raise UserError("Operator should be 'and' or 'or'")
+    offset = int(offset or 0)
+    limit = min(int(limit or max_results), max_results)
+    if offset < 0 or limit < 0:
+        raise UserError("Offset and limit should be positive")
+    terms = parse_spec(spec)
+    if not terms:
+        return []
+    return backend().search(terms, operator, offset, limit)
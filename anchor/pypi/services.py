@@ -1,5 +1,9 @@
-from ..packages import services
+from ..exceptions import UserError
+from ..packages import jobs, services
+from ..packages.models import PackageTypes
+from ..packages.uploads import HashedUploadedFile
 from .models import PackageFile, Project, ShaReader
+from .tasks import extract_core_metadata
 
 
 class PyUploader(services.Uploader):
@@ -7,12 +11,26 @@ class PyUploader(services.Uploader):
     # for such situations generics are useful, but they're too hard
     pkg = Project  # type: ignore
     pkg_file = PackageFile
+    pkg_type = PackageTypes.Python.value
     reader = ShaReader
 
     def get_reader(self):
         reader = super().get_reader()
+        if isinstance(reader, HashedUploadedFile):
+            if reader.sha256 != self.metadata.sha256_digest:
+                raise UserError(
+                    f"Form checksum does not match checksum from the file {reader.sha256}"
+                )
+            return reader
         reader.hash = self.metadata.sha256_digest
         return reader
 
+    def __call__(self, user, metadata, fd):
+        pkg_file = super().__call__(user, metadata, fd)
+        if jobs.is_async():
+            # see PackageFile.update
+            jobs.enqueue(extract_core_metadata, pkg_file.id)
+        return pkg_file
+
 
 upload_file = PyUploader(__name__)
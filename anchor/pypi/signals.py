@@ -0,0 +1,81 @@
+"""
+Signal handlers that keep derived data (like the simple index
+and the search index) in sync with uploaded and removed files.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ..packages import models as base_models
+from ..packages.jobs import enqueue
+from . import search
+from .index import simple_index, static_index
+from .mirror import mirror
+from .models import PackageFile, Project
+from .tasks import update_static_index
+
+
+def _changed(name: str, root=False):
+    # page is dropped right now and once more after commit,
+    # so readers that re-rendered it in between won't keep stale data
+    _invalidate(name, root=root)
+    transaction.on_commit(lambda: _invalidate(name, root=root))
+    if static_index.enabled:
+        # not deduplicated by key: queued job could be taken by a worker
+        # before this transaction is committed and write the old page
+        enqueue(update_static_index, name, root=root)
+
+
+def _invalidate(name: str, root=False):
+    simple_index.invalidate(name, root=root)
+    if mirror.enabled:
+        # local project takes precedence over the upstream one
+        mirror.forget(name)
+
+
+def _is_python(instance) -> bool:
+    return instance.pkg_type == base_models.PackageTypes.Python.value
+
+
+# files and projects removed by cascade (or through the base models)
+# are sent with the base model as a sender
+@receiver([post_save, post_delete], sender=base_models.PackageFile)
+@receiver([post_save, post_delete], sender=PackageFile)
+def file_changed(sender, instance: PackageFile, **kwargs):
+    if not _is_python(instance) or base_models.in_bulk_removal():
+        return
+    try:
+        name = instance.package.canonical_name
+    except base_models.Package.DoesNotExist:
+        # package is removed too, so its handler will do the job
+        return
+    _changed(name)
+
+
+@receiver(base_models.files_removed)
+def files_removed(sender, package_ids, **kwargs):
+    names = base_models.Package.objects.filter(
+        id__in=package_ids, pkg_type=base_models.PackageTypes.Python.value
+    ).values_list("canonical_name", flat=True)
+    for name in names:
+        _changed(name)
+
+
+@receiver(post_save, sender=base_models.Package)
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance: Project, created=False, using=None, **kwargs):
+    if not _is_python(instance):
+        return
+    # summary could change with every upload
+    search.backend(using).update(instance)
+    if created:
+        _changed(instance.canonical_name, root=True)
+
+
+@receiver(post_delete, sender=base_models.Package)
+@receiver(post_delete, sender=Project)
+def project_removed(sender, instance: Project, using=None, **kwargs):
+    if not _is_python(instance):
+        return
+    search.backend(using).remove(instance.id)
+    _changed(instance.canonical_name, root=True)
@@ -0,0 +1,25 @@
+"""
+Background tasks of the python packages, see anchor.packages.jobs.
+"""
+from ..packages.jobs import task
+from .index import static_index
+from .mirror import refresh_page  # noqa pylint: disable=unused-import
+from .models import PackageFile
+
+
+@task
+def extract_core_metadata(file_id: int):
+    try:
+        pkg_file = PackageFile.objects.get(id=file_id)
+    except PackageFile.DoesNotExist:
+        # removed before the job was run
+        return
+    pkg_file.update_core_metadata()
+    pkg_file.save(update_fields=["core_metadata", "core_metadata_sha256"])
+
+
+@task
+def update_static_index(name: str, root=False):
+    """ Writes the static index page of the project (and the root one). """
+    if static_index.enabled:
+        static_index.update(name, root=root)
@@ -1,6 +1,5 @@
 # Python package index API views.
 
-import functools
 import logging
 import re
 import typing as ty
@@ -8,14 +7,20 @@ import xmlrpc.server
 from xmlrpc.client import Fault
 
 from django import http
-from django.db import models
 from django.http import HttpResponseBadRequest as badrequest
-from django.shortcuts import get_object_or_404, render
+from django.db import transaction
+from django.shortcuts import get_object_or_404, reverse
 from django.views.decorators import csrf
 
-from ..common.views import basic_auth
+from ..common.views import basic_auth, upload_handlers
+from ..packages import downloads
+from ..packages.models import PackageTypes, canonical_name
+from ..packages.uploads import HashingUploadHandler
 from ..exceptions import UserError, Forbidden
+from . import search as fulltext
 from . import services
+from .index import simple_index
+from .mirror import mirror
 from .models import Metadata, PackageFile, Project
 
 log = logging.getLogger(__name__)
@@ -26,6 +31,7 @@ __all__ = [
     "list_projects",
     "list_files",
     "download_file",
+    "download_metadata",
     "xmlrpc_dispatch",
     "search",
 ]
@@ -35,7 +41,8 @@ allowed_files = re.compile(r".+\.(tar\.gz|zip|whl|egg)$", re.I)
 
 
 @csrf.csrf_exempt
-@basic_auth
+@basic_auth(scope="upload")
+@upload_handlers(HashingUploadHandler)
 def upload_package(request, post: Metadata):
     """
     Uploads new package to the server.
@@ -56,14 +63,70 @@ def upload_package(request, post: Metadata):
 
 def list_projects(request):
     """ Returns page with list of all available projects. """
-    return render(request, "projects.html", {"projects": Project.objects.all()})
+    return http.HttpResponse(simple_index.projects())
 
 
 def list_files(request, name: str):
-    """ Returns page with list of all existing files for the package. """
-    result = PackageFile.objects.filter(package__name=name)
-    return render(
-        request, "files.html", dict(title=f"{name.capitalize()} files", files=result)
+    """
+    Returns page with list of all existing files for the package.
+    Non-canonical names are redirected to the canonical ones.
+    """
+    canonical = canonical_name(name, PackageTypes.Python.value)
+    if name != canonical:
+        return http.HttpResponsePermanentRedirect(
+            reverse("pypi.files", args=[canonical])
+        )
+    # warm requests don't touch the database, whatever the project is
+    page = simple_index.cached(name)
+    if page is None and mirror.enabled:
+        if (
+            mirror.cached(name)
+            or not Project.objects.filter(canonical_name=name).exists()
+        ):
+            page = mirror.files(name)
+            if page is None:
+                raise http.Http404(f"Project {name} not found")
+    if page is None:
+        page = simple_index.files(name)
+    return http.HttpResponse(page)
+
+
+# mirrored files could be waited for, so the transaction isn't kept open
+@transaction.non_atomic_requests
+@basic_auth(scope="read", required=False)
+def download_file(request, filename: str):
+    """
+    Returns package file.
+    Supports conditional requests (sha256 is used as ETag)
+    and range requests, so interrupted downloads could be resumed.
+    Files of the upstream projects are fetched if mirror is enabled.
+    """
+    try:
+        pkg_file = PackageFile.objects.select_related("package").get(filename=filename)
+    except PackageFile.DoesNotExist:
+        if mirror.enabled:
+            return mirror.download(request, filename)
+        raise http.Http404(f"File {filename} not found")
+    return downloads.serve(request, pkg_file)
+
+
+@basic_auth(scope="read", required=False)
+def download_metadata(request, filename: str):
+    """
+    Returns core metadata of the package file (`PEP 658`_),
+    so resolvers don't have to download the whole distribution.
+
+    .. _`PEP 658`: https://www.python.org/dev/peps/pep-0658/
+    """
+    pkg_file = get_object_or_404(
+        PackageFile.objects.select_related("package"),
+        filename=filename,
+        core_metadata_sha256__isnull=False,
+    )
+    if not pkg_file.package.has_permission(request.user, "read"):
+        raise Forbidden
+    return http.HttpResponse(
+        bytes(pkg_file.core_metadata), content_type="text/plain; charset=utf-8"
     )
 
 
@@ -71,7 +134,7 @@ def list_files(request, name: str):
 def xmlrpc_dispatch(request):
     """
     Dispatcher for any `XML RPC`_ methods.
-    Currently supports only `search(spec[, operator="and"])`,
+    Currently supports only `search(spec[, operator="and"[, offset[, limit]]])`,
     that is used by ``pip search``.
 
     .. _`XML RPC`: https://docs.python.org/3/library/xmlrpc.html
@@ -81,15 +144,20 @@ def xmlrpc_dispatch(request):
     log.debug("%s params: %s", methodname, params)
     if methodname == "search":
         try:
-            response = tuple(search(*params))
-        except UserError as e:
+            # single value, so clients always get a list
+            response = (search(*params),)
+        except (UserError, TypeError, ValueError) as e:
             response = Fault(400, str(e))
     else:
         response = Fault(405, "Function not found")
-    return http.HttpResponse(xmlrpc.server.dumps(response, allow_none=True), "text/xml")
+    return http.HttpResponse(
+        xmlrpc.server.dumps(response, methodresponse=True, allow_none=True), "text/xml"
+    )
 
 
-def search(spec: ty.Mapping[str, ty.List[str]], operator: str = "and"):
+def search(
+    spec: ty.Mapping[str, ty.List[str]], operator: str = "and", offset=0, limit=None
+):
     """
     Searches for the available packages.
 
@@ -97,24 +165,15 @@ def search(spec: ty.Mapping[str, ty.List[str]], operator: str = "and"):
 
     - *spec*: fields and lists of values for search.
     - *operator*: string with the operator for combination of specifications.
+    - *offset*, *limit*: pagination, extension of the PyPI API.
 
     Example:
 
-    >>> search({'name': ['foo'], 'summary': ['foo']}, 'or')
-    # -> all packages that name or summary contains 'foo'
+    >>> search({'name': ['foo', 'bar'], 'summary': ['foo']}, 'or')
+    # -> all packages that name contains 'foo' or 'bar', or summary contains 'foo'
 
-    Returns list of dicts with fields *name*, *version* and *summary*.
+    Returns list of dicts with fields *name*, *version* and *summary*,
+    best matches first.
     Warehouse implementation returns at most 100 packages, so did we.
     """
-    if not all(x in {"name", "summary"} for x in spec):
-        raise UserError("Function supports only 'name' and 'summary' fields")
-
-    query_spec = [models.Q(**{f"{key}__contains": val[0]}) for key, val in spec.items()]
-
-    params = functools.reduce(lambda x, y: getattr(x, f"__{operator}__")(y), query_spec)
-    log.debug("Query parameters: %s", params)
-
-    query = Project.objects.filter(params)
-    return [
-        dict(name=x.name, version=x.version, summary=x.summary) for x in query[:100]
-    ]
+    return fulltext.search(spec, operator, offset=offset, limit=limit)
@@ -3,6 +3,7 @@ from django.contrib.auth import admin as auth_admin
 from django.contrib.auth import get_user_model
 
 from anchor.users.forms import UserChangeForm, UserCreationForm
+from anchor.users.models import ApiToken
 
 User = get_user_model()
 
@@ -15,3 +16,15 @@ class UserAdmin(auth_admin.UserAdmin):
     fieldsets = (("User", {"fields": ("name",)}),) + auth_admin.UserAdmin.fieldsets
     list_display = ["username", "name", "is_superuser"]
     search_fields = ["name"]
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+
+    list_display = ["name", "user", "prefix", "scope", "created", "expires"]
+    readonly_fields = ["prefix", "digest"]
+    search_fields = ["name", "prefix", "user__username"]
+
+    def has_add_permission(self, request):
+        # raw token is shown only once, see `manage.py create_token`
+        return False
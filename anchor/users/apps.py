@@ -5,3 +5,6 @@ class UsersAppConfig(AppConfig):
 
     name = "anchor.users"
     verbose_name = "Users"
+
+    def ready(self):
+        from . import signals  # noqa pylint: disable=unused-import
@@ -1,9 +1,64 @@
+import hashlib
+import hmac
+import logging
+import typing as ty
+
+from django.conf import settings
+from django.contrib import auth
+from django.core.cache import cache
 from django.views.generic import View, DetailView as django_detail
 
 from ..exceptions import LoginRedirect, Forbidden
-from ..users.models import PermissionAware
+from ..users.models import ApiToken, PermissionAware, User
+
+__all__ = ["AccessMixin", "DetailView", "authenticate"]
+
+log = logging.getLogger(__name__)
+
+
+def authenticate(request, login: str, password: str) -> ty.Optional[User]:
+    """
+    Authenticates API client by the login and password or API token.
+    Session is not created, since clients are stateless.
+
+    Tokens (sent with the ``__token__`` login) are verified
+    with one indexed query and HMAC.
+    Passwords are verified by the auth backends (PBKDF2 is slow on purpose),
+    and successfully verified credentials are remembered
+    for ``USERS_BASIC_AUTH_TIMEOUT`` seconds.
+    Token used for authentication is set as ``user.api_token``.
+    """
+    if login == ApiToken.username:
+        token = ApiToken.objects.verify(password)
+        if token is None:
+            return None
+        user = token.user
+        user.api_token = token
+        return user
+    timeout = getattr(settings, "USERS_BASIC_AUTH_TIMEOUT", 0)
+    # keyed digests, so neither credentials nor password hashes are cached
+    key = "users.basic:" + _digest(f"{login}\0{password}")
+    cached = cache.get(key) if timeout else None
+    if cached:
+        user_id, password_digest = cached
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        # changed password invalidates cached credentials
+        if user and hmac.compare_digest(_digest(user.password), password_digest):
+            user.api_token = None
+            return user
+    user = auth.authenticate(request, username=login, password=password)
+    if user is None:
+        return None
+    if timeout:
+        cache.set(key, (user.id, _digest(user.password)), timeout)
+    user.api_token = None
+    return user
+
 
-__all__ = ["AccessMixin", "DetailView"]
+def _digest(value: str) -> str:
+    return hmac.new(
+        settings.SECRET_KEY.encode(), value.encode(), hashlib.sha256
+    ).hexdigest()
 
 
 class AccessMixin(View):
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import ApiToken, TokenScope, User
+
+
+class Command(BaseCommand):
+    help = "Creates API token for the user and prints it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("name", help="Token description, e.g. 'CI'")
+        parser.add_argument(
+            "--scope", choices=[x.value for x in TokenScope], default="read"
+        )
+        parser.add_argument("--days", type=int, help="Token lifetime in days")
+
+    def handle(self, *args, username, name, scope, days=None, **options):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User {username!r} not found")
+        expires = timezone.now() + timedelta(days=days) if days else None
+        _, raw = ApiToken.objects.generate(user, name, scope, expires=expires)
+        self.stdout.write(raw)
@@ -2,18 +2,23 @@ from __future__ import annotations
 
 import enum
 import functools
+import hashlib
+import hmac
 import logging
+import secrets
 import typing as ty
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Group
 from django.db import models
-from django.db.models import CharField, EmailField, Min, Model
+from django.db.models import CharField, EmailField, Model
 from django.urls import reverse
+from django.utils import timezone
 
 log = logging.getLogger(__name__)
 
 
-__all__ = ["User", "RoleType", "PermissionAware"]
+__all__ = ["User", "RoleType", "PermissionAware", "ApiToken"]
 
 
 class User(AbstractUser):
@@ -37,6 +42,14 @@ class User(AbstractUser):
         role_obj = UserRole(user=self, level=roletype)
         role_obj.save()
         obj.user_roles.add(role_obj)
+        # shared cache is invalidated by the signal handlers
+        self.forget_levels()
+
+    def forget_levels(self):
+        """ Drops role levels memoized on this instance. """
+        from .permissions import resolver  # circular import
+
+        resolver.forget(self)
 
     def __str__(self):
         return self.username
@@ -108,33 +121,40 @@ class PermissionAware(models.Model):
     class Meta:
         abstract = True
 
+    def is_owner(self, user: User) -> bool:
+        # compared by id, so the owner isn't fetched
+        return user.id is not None and self.owner_id == user.id
+
     def has_role(self, user: User, role: RoleLike) -> bool:
         """ Checks if user has a role. """
-        log.debug("owner: %r, user: %r", self.owner, user)
+        log.debug("owner: %r, user: %r", self.owner_id, user)
         return (
-            self.owner == user
+            self.is_owner(user)
             or user.is_superuser
             or self.effective_level(user) <= to_roletype(role)
         )
 
     def effective_level(self, user: User) -> RoleType:
-        """ Returns user role level, according to his groups. """
-        if user.id is None:
-            return RoleType.anonymous
-        if user == self.owner:
-            return RoleType.owner
-        try:
-            user_level = self.user_roles.get(user=user).level
-        except UserRole.DoesNotExist:
-            user_level = RoleType.anonymous
-        group_level = (
-            self.group_roles.filter(group__in=user.groups.all()).aggregate(
-                Min("level")
-            )["level__min"]
-            or 999
-        )
-        effective = min(user_level, group_level)
-        return to_roletype(effective)
+        """
+        Returns user role level, according to his groups.
+        Levels are cached, see :mod:`anchor.users.permissions`.
+        """
+        from .permissions import resolver  # circular import
+
+        return resolver.level(self, user)
+
+    @classmethod
+    def effective_levels(
+        cls, user: User, objects: ty.Iterable[PermissionAware]
+    ) -> ty.Dict[ty.Any, RoleType]:
+        """
+        Returns role levels of the user for many objects (pk -> level)
+        with two queries. Subsequent permission checks
+        of these objects use resolved levels.
+        """
+        from .permissions import resolver  # circular import
+
+        return resolver.levels(user, objects)
 
     def permissions_for(self, *, user: User = None, level: int = None) -> ty.Set[str]:
         """ Returns all permissions that user/role level has. """
@@ -156,7 +176,92 @@ class PermissionAware(models.Model):
     def has_permission(self, user: User, permission: str) -> bool:
         """ Checks if user has required permission. """
         return (
-            self.owner == user
+            self.is_owner(user)
             or user.is_superuser
             or permission in self.permissions_for(user=user)
         )
+
+
+class TokenScope(enum.Enum):
+    read = "read"
+    upload = "upload"
+
+
+class ApiTokenManager(models.Manager):
+    def generate(
+        self, user: User, name: str, scope: ty.Union[TokenScope, str], expires=None
+    ) -> ty.Tuple[ApiToken, str]:
+        """
+        Creates new token for the user.
+        Returns token object and the token itself, that is shown only once.
+        """
+        prefix = ApiToken.marker + secrets.token_hex(4)
+        raw = f"{prefix}.{secrets.token_urlsafe(32)}"
+        token = self.create(
+            user=user,
+            name=name,
+            prefix=prefix,
+            digest=ApiToken.make_digest(raw),
+            scope=TokenScope(scope).value,
+            expires=expires,
+        )
+        return token, raw
+
+    def verify(self, raw: str) -> ty.Optional[ApiToken]:
+        """ Finds the valid token by its prefix and checks its digest. """
+        prefix, _, secret = raw.partition(".")
+        if not secret:
+            return None
+        try:
+            token = self.select_related("user").get(prefix=prefix)
+        except ApiToken.DoesNotExist:
+            return None
+        if not hmac.compare_digest(token.digest, ApiToken.make_digest(raw)):
+            return None
+        if token.expires and token.expires < timezone.now():
+            return None
+        if not token.user.is_active:
+            return None
+        return token
+
+
+class ApiToken(Model):
+    """
+    Token for the API clients (twine, pip, CI),
+    that is sent as a password with the ``__token__`` username.
+
+    Only the digest is stored. It's a keyed SHA256 instead of the password hash,
+    since the token is random and long enough, so verification is cheap.
+    """
+
+    # tokens look like anchor-1a2b3c4d.<secret>
+    marker = "anchor-"
+    username = "__token__"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tokens")
+    name = CharField(max_length=64)
+    prefix = CharField(max_length=16, unique=True)
+    digest = CharField(max_length=64)
+    scope = CharField(
+        max_length=16,
+        choices=[(x.value, x.name) for x in TokenScope],
+        default=TokenScope.read.value,
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(null=True, blank=True)
+
+    objects = ApiTokenManager()
+
+    @staticmethod
+    def make_digest(raw: str) -> str:
+        return hmac.new(
+            settings.SECRET_KEY.encode(), raw.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def allows(self, scope: ty.Union[TokenScope, str]) -> bool:
+        """ Checks token scope, upload tokens also allow reading. """
+        scope = TokenScope(scope)
+        return scope == TokenScope.read or self.scope == scope.value
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
@@ -0,0 +1,182 @@
+"""
+Cached resolution of the user role levels.
+
+Levels are memoized on the user instance, that lives only
+during the request (``request.user``), and in the cache for
+``USERS_PERMISSIONS_TIMEOUT`` seconds. Cached level is stamped with
+the generations of the object roles, the user roles and the group roles,
+that are bumped by the signal handlers when roles change.
+Generations are bumped only in the cache of the process that changed roles
+if the cache isn't shared (like the default LocMemCache), so there
+the timeout is the only limit of how long other processes use stale levels.
+
+Ownership is not cached at all, since it's known from the object itself.
+"""
+import logging
+import typing as ty
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Min
+
+from .models import PermissionAware, RoleType, User, to_roletype
+
+__all__ = ["PermissionResolver", "resolver"]
+
+log = logging.getLogger(__name__)
+
+
+def _label(obj) -> str:
+    # roles of the Project are stored in the Package tables
+    return obj._meta.get_field("user_roles").model._meta.label_lower
+
+
+class PermissionResolver:
+    """ Computes effective role levels and caches them. """
+
+    prefix = "users.perm"
+    memo_attr = "_role_levels"
+
+    def __init__(self, cache_alias: str = "default"):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def timeout(self) -> int:
+        return getattr(settings, "USERS_PERMISSIONS_TIMEOUT", 60)
+
+    def level(self, obj: PermissionAware, user: User) -> RoleType:
+        """ Effective role level of the user for the object. """
+        if user.id is None:
+            return RoleType.anonymous
+        if obj.owner_id == user.id:
+            return RoleType.owner
+        memo = self._memo(user)
+        key = (_label(obj), obj.pk)
+        if key in memo:
+            return memo[key]
+        if not self.timeout:
+            memo[key] = self.compute(obj, user)
+            return memo[key]
+        level, generations = self._cached(key, user)
+        if level is None:
+            level = self.compute(obj, user)
+            # generations were read before the level was computed,
+            # so concurrent change makes this value stale instead of hiding it
+            self._store(key, user, level, generations)
+        memo[key] = level
+        return level
+
+    def compute(self, obj: PermissionAware, user: User) -> RoleType:
+        """ Level from the user and group roles, without any caching. """
+        levels = [
+            obj.user_roles.filter(user=user).aggregate(level=Min("level"))["level"],
+            obj.group_roles.filter(group__in=user.groups.all()).aggregate(
+                level=Min("level")
+            )["level"],
+        ]
+        # owner role (0) is a valid level too
+        return to_roletype(
+            min(x for x in levels + [RoleType.anonymous] if x is not None)
+        )
+
+    def levels(
+        self, user: User, objects: ty.Iterable[PermissionAware]
+    ) -> ty.Dict[ty.Any, RoleType]:
+        """
+        Resolves levels for many objects of the same model at once
+        (with two queries), e.g. for the package list.
+        Returns dict with object primary keys,
+        resolved levels are also memoized on the user.
+        """
+        objects = list(objects)
+        if not objects:
+            return {}
+        if user.id is None:
+            return {obj.pk: RoleType.anonymous for obj in objects}
+        result = {
+            obj.pk: RoleType.owner if obj.owner_id == user.id else RoleType.anonymous
+            for obj in objects
+        }
+        pks = [pk for pk, level in result.items() if level != RoleType.owner]
+        if pks:
+            label = _label(objects[0])
+            for field, filters in (
+                ("user_roles", dict(user=user)),
+                ("group_roles", dict(group__in=user.groups.all())),
+            ):
+                m2m = objects[0]._meta.get_field(field)
+                source, target = m2m.m2m_field_name(), m2m.m2m_reverse_field_name()
+                rows = m2m.remote_field.through.objects.filter(
+                    **{f"{source}__in": pks},
+                    **{f"{target}__{key}": value for key, value in filters.items()},
+                ).values_list(source, f"{target}__level")
+                for pk, level in rows:
+                    result[pk] = to_roletype(min(result[pk], level))
+            memo = self._memo(user)
+            memo.update(((label, pk), result[pk]) for pk in pks)
+        return result
+
+    def forget(self, user: User):
+        """ Drops levels memoized on the user instance. """
+        self._memo(user).clear()
+
+    # invalidation
+
+    def invalidate_object(self, obj: PermissionAware = None, label=None, pk=None):
+        self._bump(self._gen_key("obj", label or _label(obj), pk or obj.pk))
+
+    def invalidate_user(self, user_id: int):
+        self._bump(self._gen_key("user", user_id))
+
+    def invalidate_groups(self):
+        self._bump(self._gen_key("groups"))
+
+    # internals
+
+    def _memo(self, user: User) -> dict:
+        memo = getattr(user, self.memo_attr, None)
+        if memo is None:
+            memo = {}
+            setattr(user, self.memo_attr, memo)
+        return memo
+
+    def _gen_key(self, *parts) -> str:
+        return ":".join([self.prefix, "gen", *map(str, parts)])
+
+    def _keys(self, key: tuple, user: User) -> ty.List[str]:
+        label, pk = key
+        return [
+            f"{self.prefix}:{label}:{pk}:{user.id}",
+            self._gen_key("obj", label, pk),
+            self._gen_key("user", user.id),
+            self._gen_key("groups"),
+        ]
+
+    def _cached(self, key: tuple, user: User) -> ty.Tuple[ty.Optional[RoleType], list]:
+        """ Returns cached level (if it's still valid) and current generations. """
+        value_key, *gen_keys = keys = self._keys(key, user)
+        found = self.cache.get_many(keys)
+        generations = [found.get(x) for x in gen_keys]
+        if value_key in found:
+            cached_generations, level = found[value_key]
+            if cached_generations == generations:
+                return to_roletype(level), generations
+        return None, generations
+
+    def _store(self, key: tuple, user: User, level: RoleType, generations: list):
+        value_key = self._keys(key, user)[0]
+        self.cache.set(value_key, (generations, int(level)), self.timeout)
+
+    def _bump(self, key: str):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
+        log.debug("Bumped %s", key)
+
+
+resolver = PermissionResolver()
@@ -0,0 +1,48 @@
+"""
+Signal handlers that invalidate cached role levels
+(see :mod:`anchor.users.permissions`) when roles change.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import GroupRole, PermissionAware, User, UserRole
+from .permissions import resolver
+
+_actions = {"post_add", "post_remove", "post_clear", "pre_clear"}
+
+
+@receiver(m2m_changed)
+def roles_changed(sender, instance, action, **kwargs):
+    if action not in _actions:
+        return
+    if isinstance(instance, PermissionAware):
+        resolver.invalidate_object(instance)
+    # reverse changes, like role.package_set.add(...)
+    elif isinstance(instance, UserRole):
+        resolver.invalidate_user(instance.user_id)
+    elif isinstance(instance, GroupRole):
+        resolver.invalidate_groups()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def groups_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in _actions:
+        return
+    if isinstance(instance, User):
+        resolver.invalidate_user(instance.id)
+    else:
+        # group.user_set.add(...)
+        users = pk_set or instance.user_set.values_list("pk", flat=True)
+        for user_id in users:
+            resolver.invalidate_user(user_id)
+
+
+@receiver([post_save, post_delete], sender=UserRole)
+def user_role_changed(sender, instance: UserRole, **kwargs):
+    resolver.invalidate_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=GroupRole)
+def group_role_changed(sender, instance: GroupRole, **kwargs):
+    # members of the group are unknown here
+    resolver.invalidate_groups()
@@ -134,6 +134,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # https://docs.djangoproject.com/en/dev/ref/settings/#middleware
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "anchor.common.middleware.FastPathMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -163,6 +164,10 @@ STATICFILES_FINDERS = [
 MEDIA_ROOT = str(APPS_DIR("media"))
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = "/media/"
+# https://docs.djangoproject.com/en/dev/ref/settings/#file-upload-permissions
+# uploads are moved from the temporary files with 0600 mode,
+# but the front proxy should be able to read them
+FILE_UPLOAD_PERMISSIONS = 0o644
 
 # TEMPLATES
 # ------------------------------------------------------------------------------
@@ -241,3 +246,64 @@ LOGGING = {
     "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "verbose"}},
     "loggers": {"anchor": {"level": "INFO"}},
 }
+
+# ANCHOR
+# ------------------------------------------------------------------------------
+# Seconds to keep rendered simple index pages in the cache.
+# Pages are also dropped on upload or removal of a file, but only in the cache
+# of the process that handled it if the cache isn't shared (like LocMemCache),
+# so the timeout limits how long other processes serve stale pages.
+# With a shared cache (redis, memcached) it could be raised.
+PYPI_INDEX_TIMEOUT = env.int("PYPI_INDEX_TIMEOUT", default=60)
+# Directory for static simple index pages that could be served by the front proxy,
+# see `manage.py build_simple_index`. Disabled if not set.
+PYPI_STATIC_INDEX_ROOT = env("PYPI_STATIC_INDEX_ROOT", default=None)
+# Seconds to keep resolved user role levels in the cache, 0 disables caching.
+# Role changes are seen at once only with a shared cache (redis, memcached),
+# with a per-process one other processes use old levels up to this time.
+USERS_PERMISSIONS_TIMEOUT = env.int("USERS_PERMISSIONS_TIMEOUT", default=60)
+# Seconds to remember verified basic auth credentials,
+# so API clients don't pay for the password hashing on every request.
+USERS_BASIC_AUTH_TIMEOUT = env.int("USERS_BASIC_AUTH_TIMEOUT", default=300)
+# Routes served by the FastPathMiddleware, without sessions and other middlewares.
+ANCHOR_FAST_PATHS = env.list(
+    "ANCHOR_FAST_PATHS", default=["/py/simple/", "/py/download/"]
+)
+# Hand file transfers to the front proxy: "nginx" (X-Accel-Redirect),
+# "sendfile" (X-Sendfile) or empty to stream files from Django.
+PACKAGES_DOWNLOAD_OFFLOAD = env("PACKAGES_DOWNLOAD_OFFLOAD", default="")
+# nginx internal location that is aliased to the MEDIA_ROOT
+PACKAGES_DOWNLOAD_ACCEL_PREFIX = env(
+    "PACKAGES_DOWNLOAD_ACCEL_PREFIX", default="/protected/"
+)
+# Seconds between writes of buffered download counters, 0 disables background writes.
+PACKAGES_DOWNLOADS_FLUSH_INTERVAL = env.float(
+    "PACKAGES_DOWNLOADS_FLUSH_INTERVAL", default=10
+)
+# Files removed by the retention policy in one transaction.
+PACKAGES_RETENTION_BATCH_SIZE = env.int("PACKAGES_RETENTION_BATCH_SIZE", default=500)
+# Run background jobs (storage cleanup, metadata extraction, static index updates)
+# by the `manage.py run_jobs` workers, instead of the web processes after commit.
+PACKAGES_JOBS_ASYNC = env.bool("PACKAGES_JOBS_ASYNC", default=False)
+# Seconds before the first retry of the failed job, doubled on every attempt.
+PACKAGES_JOBS_RETRY_DELAY = env.int("PACKAGES_JOBS_RETRY_DELAY", default=10)
+# Seconds after which running job is considered lost and is queued again.
+PACKAGES_JOBS_TIMEOUT = env.int("PACKAGES_JOBS_TIMEOUT", default=3600)
+# Seconds to keep finished jobs.
+PACKAGES_JOBS_KEEP = env.int("PACKAGES_JOBS_KEEP", default=86400)
+# Simple index of the upstream (like https://pypi.org/simple/) to mirror projects
+# that aren't in Anchor. Mirroring is disabled if it's empty.
+PYPI_UPSTREAM_URL = env("PYPI_UPSTREAM_URL", default="")
+# Seconds to cache upstream project pages.
+PYPI_UPSTREAM_TTL = env.int("PYPI_UPSTREAM_TTL", default=600)
+# Seconds to serve expired page while it's refreshed (or while upstream is down).
+PYPI_UPSTREAM_STALE = env.int("PYPI_UPSTREAM_STALE", default=86400)
+# Seconds to remember projects that are missing upstream.
+PYPI_UPSTREAM_NEGATIVE_TTL = env.int("PYPI_UPSTREAM_NEGATIVE_TTL", default=300)
+# Timeout of upstream requests, in seconds.
+PYPI_UPSTREAM_TIMEOUT = env.int("PYPI_UPSTREAM_TIMEOUT", default=60)
+# Seconds without progress after which the file fetch is considered lost
+# and the file is fetched again.
+PYPI_UPSTREAM_LEASE = env.int("PYPI_UPSTREAM_LEASE", default=120)
+# Seconds to wait for the file that is fetched by another request.
+PYPI_UPSTREAM_WAIT = env.int("PYPI_UPSTREAM_WAIT", default=900)
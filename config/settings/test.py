@@ -60,3 +60,6 @@ EMAIL_PORT = 1025
 LOGGING["loggers"]["anchor"]["level"] = "DEBUG"
 LOGGING["loggers"]["anchor.common.middleware"] = {"level": "FATAL"}
 LOGGING["loggers"]["django.request"] = {"level": "FATAL"}
+
+# download counters are written explicitly by tests
+PACKAGES_DOWNLOADS_FLUSH_INTERVAL = 0
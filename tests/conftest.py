@@ -1,7 +1,9 @@
 import logging
 
 import pytest
+from django.core.cache import cache
 
+from anchor.packages.downloads import counter
 from anchor.users.models import User
 
 from . import Client, PackageFactory, RequestFactory
@@ -19,6 +21,18 @@ def media_storage(settings, tmp_path):
     settings.MEDIA_ROOT = media.absolute()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def download_counter():
+    counter.clear()
+    yield counter
+    counter.clear()
+
+
 @pytest.fixture
 def client():
     return Client()
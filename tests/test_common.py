@@ -1,5 +1,6 @@
 import json
 import logging
+import typing as ty
 from dataclasses import dataclass
 from unittest import TestCase
 
@@ -8,8 +9,9 @@ from django.http.request import QueryDict
 from pytest import mark
 
 from anchor import exceptions
-from anchor.common import debug, middleware, views
-from anchor.common.middleware import RequestBinder
+from anchor.common import debug, helpers, middleware, views
+from anchor.common.middleware import BindingPlan, FunctionInfo, RequestBinder
+from anchor.users.models import User
 
 from . import basic_auth
 
@@ -62,6 +64,29 @@ def test_serialize_response(requests):
     assert json.loads(response)
 
 
+def test_serialize_queryset(users, monkeypatch):
+    for i in range(5):
+        users.new(f"usr{i}@localhost")
+    monkeypatch.setattr(helpers.StreamingJsonResponse, "chunk_size", 2)
+    query = User.objects.filter(email__startswith="usr").order_by("id")
+    response = helpers.jsonify(query)
+    assert response.streaming
+    assert query._result_cache is None
+    items = json.loads(b"".join(response.streaming_content))["items"]
+    assert [x["email"] for x in items] == [f"usr{i}@localhost" for i in range(5)]
+    # not serializable and relations are skipped, as for the single model
+    assert "date_joined" not in items[0] and "groups" not in items[0]
+    assert items[0] == json.loads(helpers.jsonify(query.first()).content)
+
+    response = helpers.jsonify(query.values_list("username", flat=True))
+    items = json.loads(b"".join(response.streaming_content))["items"]
+    assert items == [f"usr{i}@localhost" for i in range(5)]
+
+    response = helpers.jsonify(query, include=["get_absolute_url"], exclude=[])
+    items = json.loads(b"".join(response.streaming_content))["items"]
+    assert len(items) == 5
+
+
 @dataclass
 class DataClass:
     number: int
@@ -106,6 +131,43 @@ def test_view_param_underscore(requests):
     RequestBinder(req).bind_view(view)
 
 
+@mark.unit
+def test_binding_plan(requests):
+    def view(request, id_: int, tags: ty.List[str], size: int = 4):
+        return id_, tags, size
+
+    plan = BindingPlan.for_view(view)
+    assert BindingPlan.for_view(view) is plan, "Plan is not cached"
+    req = requests.factory.get("/", dict(id=1, tags=["a", "b"]))
+    assert plan.bind(req) == dict(id_=1, tags=["a", "b"])
+    assert plan.bind(req, existing={"id_": 2}) == dict(tags=["a", "b"])
+    with pytest.raises(exceptions.UserError):
+        plan.bind(requests.get(data=dict(size=1)))
+
+
+def binder_view(request, page: int, size: int, query: str):
+    return {}
+
+
+@pytest.mark.benchmark(group="binder")
+def test_binder_compiled_benchmark(benchmark, requests):
+    req = requests.get(data=dict(page=1, size=10, query="abc"))
+    benchmark(lambda: BindingPlan.for_view(binder_view).bind(req))
+
+
+@pytest.mark.benchmark(group="binder")
+def test_binder_uncompiled_benchmark(benchmark, requests):
+    """ Previous behaviour: view is inspected on every request. """
+    req = requests.get(data=dict(page=1, size=10, query="abc"))
+
+    def bind():
+        params = FunctionInfo(binder_view).signature.parameters
+        plan = BindingPlan.compile(params, exclude=BindingPlan.view_exclude)
+        return plan.bind(req)
+
+    benchmark(bind)
+
+
 @mark.unit
 def test_view_no_annotation(requests):
     def view(request, data):
@@ -64,6 +64,55 @@ def test_table_pagination_more_pages(users, db):
     assert not soup.find("div")
 
 
+class KeysetTable(html.Table):
+    size = 2
+    keyset = "-id"
+    estimate_count = True
+
+    def __init__(self, request):
+        value = User.objects.filter(email__startswith="usr")
+        super().__init__(value=value, request=request)
+
+    soup = UsersTable.soup
+
+
+def test_table_keyset(users, requests):
+    for i in range(5):
+        users.new(f"usr{i}@localhost")
+    expected = [f"usr{i}@localhost" for i in reversed(range(5))]
+    found, params, pages = [], {}, []
+    while True:
+        table = KeysetTable(requests.get(data=params))
+        pages.append(table)
+        found.extend(x.email for x in table.objects)
+        assert "5 items" in str(table)
+        next_link = table.soup().find("a", string="next")
+        if not next_link:
+            break
+        params = dict(after=table.page.next_cursor)
+    assert found == expected
+    assert len(pages) == 3
+    # back from the last page
+    table = KeysetTable(requests.get(data=dict(before=pages[-1].page.prev_cursor)))
+    assert [x.email for x in table.objects] == expected[2:4]
+    assert table.page.prev_cursor and table.page.next_cursor
+    with pytest.raises(html.exceptions.NotFound):
+        KeysetTable(requests.get(data=dict(after="garbage")))
+
+
+def test_table_keyset_not_unique(users, requests, monkeypatch):
+    """ Items with the same column value are ordered by pk. """
+    for i in range(5):
+        users.new(f"usr{i}@localhost")
+    monkeypatch.setattr(KeysetTable, "keyset", "last_name")
+    found, params = [], {}
+    for _ in range(3):
+        table = KeysetTable(requests.get(data=params))
+        found.extend(x.email for x in table.objects)
+        params = dict(after=table.page.next_cursor)
+    assert found == [f"usr{i}@localhost" for i in range(5)]
+
+
 @pytest.mark.benchmark
 def test_table_benchmark(benchmark, users, db):
     for i in range(4):
@@ -75,3 +124,92 @@ def test_table_benchmark(benchmark, users, db):
 def test_dropdowns():
     dropdown = html.DropdownButtons(None, "Test", {"Link A": "#", "Link B": "#"})
     assert dropdown.html()
+
+
+def test_table_formatters(users, db):
+    users.new("usr<b>")
+    table = CompiledTable(User.objects.filter(email__startswith="usr"), paginate=False)
+    table.formatters = {"email": lambda x: f"<i>{x}</i>"}
+    table.labels = {"is_staff": "Staff"}
+    soup = bs4.BeautifulSoup(str(table), "html.parser")
+    assert [x.text for x in soup.thead.find_all("th")][-2:] == ["Staff", "Date joined"]
+    cells = soup.tbody.tr.find_all("td")
+    assert cells[0].text == "usr<b>"
+    assert cells[1].i
+    assert str(LegacyTable(User.objects.none(), paginate=False)) == str(
+        CompiledTable(User.objects.none(), paginate=False)
+    )
+
+
+def test_escape_all():
+    assert html.escape_all(["<a>", 1, None]) == ["&lt;a&gt;", "1", "None"]
+    assert html.escape_all(["a\0<b>", "&"]) == ["a\0&lt;b&gt;", "&amp;"]
+    assert html.escape_all([]) == []
+
+
+@pytest.fixture
+def many_users(db):
+    User.objects.bulk_create(
+        User(username=f"bulk{i}", email=f"bulk{i}@localhost") for i in range(10000)
+    )
+    return User.objects.filter(username__startswith="bulk").order_by("id")
+
+
+class LegacyTable(html.Table):
+    fields = ["username", "email", "is_staff", "date_joined"]
+
+    def rows(self):
+        yield from super().rows()
+
+
+class CompiledTable(html.Table):
+    fields = ["username", "email", "is_staff", "date_joined"]
+
+
+class BaselineFlatter(html.Flatter):
+    """ Flatter of the original renderer, with nested generators. """
+
+    def __iter__(self):
+        for item in self._items:
+            if isinstance(item, str):
+                yield item
+            elif hasattr(item, "__iter__"):
+                yield from BaselineFlatter(obj=item)
+            else:
+                yield str(item)
+
+
+class BaselineTable(LegacyTable):
+    """ Table rendering before the compiled row template. """
+
+    def html(self):
+        if self.objects:
+            table = ['<table class="table">', self._head(), self._body(), "</table>"]
+            return BaselineFlatter(obj=table)
+        return self._empty()
+
+
+@pytest.mark.benchmark(group="table-10k")
+def test_table_10k_baseline_benchmark(benchmark, many_users):
+    """ Original rows: model instances, nested generators, no escaping. """
+    result = benchmark.pedantic(
+        lambda: str(BaselineTable(many_users.all(), paginate=False)), rounds=5
+    )
+    assert result.count("<tr>") == 10000
+
+
+@pytest.mark.benchmark(group="table-10k")
+def test_table_10k_legacy_benchmark(benchmark, many_users):
+    """ Tables that override rows(): model instances and Flatter. """
+    result = benchmark.pedantic(
+        lambda: str(LegacyTable(many_users.all(), paginate=False)), rounds=5
+    )
+    assert result.count("<tr>") == 10000
+
+
+@pytest.mark.benchmark(group="table-10k")
+def test_table_10k_compiled_benchmark(benchmark, many_users):
+    result = benchmark.pedantic(
+        lambda: str(CompiledTable(many_users.all(), paginate=False)), rounds=5
+    )
+    assert result.count("<tr>") == 10000
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from anchor.packages import jobs, models
+from anchor.packages.tasks import remove_unused_blob
+
+calls = []
+
+
+@jobs.task(priority=5)
+def record(value):
+    calls.append(value)
+
+
+@jobs.task(max_attempts=2)
+def fail():
+    raise ValueError("oops")
+
+
+@pytest.fixture
+def worker(settings, db):
+    settings.PACKAGES_JOBS_ASYNC = True
+    calls.clear()
+    return jobs.Worker()
+
+
+def test_run_jobs(worker):
+    jobs.enqueue(record, "low")
+    job = jobs.enqueue(record, value="once", key="once")
+    assert jobs.enqueue(record, value="once", key="once") is None
+    models.Job.objects.enqueue(record.job_name, ["high"], priority=-1)
+    assert worker.run_pending() == 3
+    assert calls == ["high", "low", "once"]
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (models.Job.DONE, 1)
+    assert job.worker.startswith(worker.name)
+    assert job.duration is not None
+
+
+def test_retries(worker, settings):
+    settings.PACKAGES_JOBS_RETRY_DELAY = 60
+    job = jobs.enqueue(fail)
+    assert worker.run_pending() == 1
+    job.refresh_from_db()
+    assert job.status == models.Job.QUEUED
+    assert "oops" in job.error
+    # retried later
+    assert not worker.run_pending()
+    models.Job.objects.update(run_after=timezone.now())
+    assert worker.run_pending() == 1
+    job.refresh_from_db()
+    assert (job.status, job.attempts) == (models.Job.FAILED, 2)
+
+
+def test_claim(worker):
+    job = jobs.enqueue(record, 1)
+    assert models.Job.objects.claim("first") == job
+    assert models.Job.objects.claim("second") is None
+    # first worker is gone
+    later = timezone.now() + timedelta(hours=2)
+    assert models.Job.objects.requeue_stale(timedelta(hours=1), now=later) == 1
+    assert models.Job.objects.claim("second", now=later).worker == "second"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_remove_file(worker, packages, client):
+    pkg_file = packages.new_file()
+    client.force_login(packages.user)
+    response = client.post(f"/packages/files/{pkg_file.id}/rm")
+    assert response == 302
+    assert not models.PackageFile.objects.exists()
+    # storage is cleaned up by the worker
+    job = models.Job.objects.get()
+    assert job.task == remove_unused_blob.job_name
+    assert pkg_file.path.exists()
+    worker.run_pending()
+    assert not pkg_file.path.exists()
+    assert not models.Blob.objects.exists()
@@ -1,9 +1,24 @@
+import io
+import os
+import shutil
+import time
+from datetime import timedelta
+from pathlib import Path
+
 import pytest
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from anchor import exceptions
-from anchor.packages import models
+from anchor.packages import models, services
+from anchor.packages.uploads import HashedUploadedFile
+
+from django.contrib.auth.models import Group
 
-from anchor.users.models import RoleType
+from anchor.users.models import GroupRole, RoleType, User
 
 
 @pytest.mark.unit
@@ -37,6 +52,173 @@ def test_keep(packages):
     assert to_delete[0].version == "1.0.0rc2"
 
 
+def test_retention_batches(packages):
+    pkg = packages.new_package()
+    for i in range(5):
+        packages.new_file(version=f"1.0.{i}")
+    policy = models.RetentionPolicy(applied_to=pkg)
+    policy.keep(regexp=r"^1\.0\.4$")
+    policy.save()
+    removed = pkg.files.exclude(version="1.0.4")
+    sizes = sum(removed.values_list("size", flat=True))
+    # generated files may share the contents
+    blobs = set(removed.values_list("blob", flat=True)) - set(
+        pkg.files.filter(version="1.0.4").values_list("blob", flat=True)
+    )
+    run = policy.apply(batch_size=3)
+    assert (run.files, run.size, run.dry_run) == (4, sizes, False)
+    assert list(pkg.files.values_list("version", flat=True)) == ["1.0.4"]
+    assert set(models.Blob.objects.filter(refs=0).values_list("id", flat=True)) == blobs
+    assert list(policy.runs.all()) == [run]
+
+
+def test_retention_dry_run(packages, django_assert_num_queries):
+    pkg = packages.new_package()
+    packages.new_file(version="1.0.0rc1")
+    packages.new_file(version="1.0.0")
+    policy = models.RetentionPolicy(applied_to=pkg)
+    policy.drop(regexp="rc", after_age=timedelta(0))
+    policy.keep(before_age=timedelta(days=1), size_less=0)
+    policy.save()
+    # one aggregate query and the report
+    with django_assert_num_queries(2):
+        run = policy.apply(dry_run=True)
+    assert (run.files, run.dry_run) == (1, True)
+    assert run.size == pkg.files.get(version="1.0.0rc1").size
+    assert pkg.files.count() == 2
+
+
+def test_retention_schedule(packages):
+    pkg = packages.new_package()
+    packages.new_file(version="1.0.0rc1")
+    policy = models.RetentionPolicy(applied_to=pkg)
+    policy.drop(regexp="rc")
+    policy.every(timedelta(hours=1))
+    policy.save()
+    assert models.RetentionPolicy.objects.get().criteria == policy.criteria
+    out = io.StringIO()
+    call_command("run_retentions", "--dry-run", stdout=out)
+    assert "found 1 files" in out.getvalue()
+    # dry run doesn't postpone the scheduled one
+    (run,) = models.RetentionPolicy.objects.run_due()
+    assert run.files == 1
+    assert not pkg.files.exists()
+    # already run in this hour
+    packages.new_file(version="1.0.0rc2")
+    assert not models.RetentionPolicy.objects.run_due()
+    later = timezone.now() + timedelta(hours=2)
+    (run,) = models.RetentionPolicy.objects.run_due(now=later)
+    assert run.files == 1
+    assert not pkg.files.exists()
+
+
+def test_retention_failures(packages, monkeypatch):
+    pkg = packages.new_package()
+    packages.new_file(version="1.0.0rc1")
+    for _ in range(2):
+        policy = models.RetentionPolicy(applied_to=pkg)
+        policy.drop(regexp="rc")
+        policy.every(timedelta(hours=1))
+        policy.save()
+    candidates = models.RetentionPolicy.candidates
+
+    def broken(self, **kwargs):
+        if self.id == policy.id:
+            raise RuntimeError("broken")
+        return candidates(self, **kwargs)
+
+    monkeypatch.setattr(models.RetentionPolicy, "candidates", broken)
+    out, err = io.StringIO(), io.StringIO()
+    call_command("run_retentions", stdout=out, stderr=err)
+    # the other policy is run anyway
+    assert "failed with RuntimeError('broken')" in err.getvalue()
+    assert "removed 1 files" in out.getvalue()
+    assert not pkg.files.exists()
+    assert policy.runs.get().error
+
+
+def test_retention_keep_last(packages, django_assert_num_queries):
+    pkg = packages.new_package()
+    versions = ["1.9.0", "1.10.0", "1.10.1rc1", "1.10.0rc1", "2.0.0rc1", "2.0.0"]
+    for version in versions + ["10.0.0.dev1"]:
+        packages.new_file(version=version)
+    policy = models.RetentionPolicy(applied_to=pkg)
+    policy.keep_last(2, prerelease=False)
+    policy.keep_last(1, prerelease=True, per_major=True)
+    policy.save()
+    # ranked by the database, in the same query
+    with django_assert_num_queries(1):
+        dropped = sorted(x.version for x in policy.candidates())
+    assert dropped == ["1.10.0rc1", "1.9.0"]
+    policy = models.RetentionPolicy.objects.get()
+    assert policy.apply().files == 2
+    assert pkg.files.count() == 5
+
+
+def test_retention_bulk_removal(packages):
+    """ Work per batch doesn't depend on the number of files. """
+
+    def remove(name, count):
+        pkg = packages.new_package(name=name)
+        for version in range(count):
+            # large enough to have unique contents
+            packages.new_file(name=name, version=f"1.0.{version}", size_kb=8)
+        policy = models.RetentionPolicy(applied_to=pkg)
+        policy.keep_last(1)
+        policy.save()
+        callbacks = len(connection.run_on_commit)
+        with CaptureQueriesContext(connection) as queries:
+            assert policy.apply().files == count - 1
+        pkg.refresh_from_db()
+        assert pkg.version == f"1.0.{count - 1}"
+        return len(queries), len(connection.run_on_commit) - callbacks
+
+    assert remove("few", 2) == remove("many", 10)
+
+
+def test_retention_sweep(packages):
+    for name in ["ci-one", "CI-Two", "release"]:
+        for version in ["1.0.0", "1.0.1", "1.0.2"]:
+            packages.new_file(name=name, version=version)
+    policy = models.RetentionPolicy()
+    policy.keep_last(1)
+    with pytest.raises(exceptions.UserError):
+        policy.save()
+    policy.for_packages(glob="CI-*")
+    policy.save()
+    progress = []
+    run = policy.apply(
+        batch_size=3, progress=lambda x: progress.append((x.files, x.packages))
+    )
+    assert (run.files, run.packages) == (4, 2)
+    assert progress == [(3, 2), (4, 2)]
+    left = models.PackageFile.objects.values_list("package__name", "version")
+    assert sorted(left) == [
+        ("CI-Two", "1.0.2"),
+        ("ci-one", "1.0.2"),
+        ("release", "1.0.0"),
+        ("release", "1.0.1"),
+        ("release", "1.0.2"),
+    ]
+
+
+def test_versions(packages):
+    pkg = packages.new_package()
+    for version in ["1.10.0", "1.9.0", "2.0.0rc1", "1.10.0.post1", "2.0.0.dev1"]:
+        packages.new_file(version=version)
+    pkg.refresh_from_db()
+    assert pkg.versions(3) == ["2.0.0rc1", "2.0.0.dev1", "1.10.0.post1"]
+    assert pkg.versions(prerelease=False) == ["1.10.0.post1", "1.10.0", "1.9.0"]
+    assert pkg.version == "1.10.0.post1"
+    assert pkg.latest_stable.version == "1.10.0.post1"
+    assert pkg.latest_prerelease.version == "2.0.0rc1"
+    files = pkg.files.versions_between("1.10", "2.0.0rc1").by_version()
+    assert [x.version for x in files] == ["2.0.0.dev1", "1.10.0.post1", "1.10.0"]
+    pkg.latest_prerelease.delete()
+    pkg.refresh_from_db()
+    assert pkg.latest_prerelease.version == "2.0.0.dev1"
+
+
 def test_owner_upload(packages, users):
     packages.new_file()
     user = users.new("test2@localhost")
@@ -60,6 +242,91 @@ def test_upload_permissions(packages, users):
     packages.new_file(user=usr, version="0.2.0")
 
 
+def test_permissions_cached(packages, users, django_assert_num_queries):
+    pkg = packages.new_package()
+    usr = users.new("test2@localhost")
+    usr.give_access(pkg, role="developer")
+    assert pkg.has_permission(usr, "upload")
+    # another request: level is taken from the shared cache
+    usr = User.objects.get(pk=usr.pk)
+    with django_assert_num_queries(0):
+        assert pkg.has_permission(usr, "upload")
+        assert not pkg.has_permission(usr, "remove_files")
+    usr.give_access(pkg, role="maintainer")
+    assert pkg.has_permission(User.objects.get(pk=usr.pk), "remove_files")
+
+
+def test_permissions_memo(packages, users, settings, django_assert_num_queries):
+    settings.USERS_PERMISSIONS_TIMEOUT = 0
+    pkg = packages.new_package()
+    usr = users.new("test2@localhost")
+    usr.give_access(pkg, role="guest")
+    with django_assert_num_queries(2):
+        for _ in range(3):
+            assert pkg.effective_level(usr) == RoleType.guest
+
+
+def test_permissions_groups(packages, users):
+    pkg = packages.new_package()
+    usr = users.new("test2@localhost")
+    group = Group.objects.create(name="devs")
+    role = GroupRole.objects.create(group=group, level=RoleType.developer)
+    pkg.group_roles.add(role)
+    assert pkg.effective_level(usr) == RoleType.anonymous
+    group.user_set.add(usr)
+    usr = User.objects.get(pk=usr.pk)
+    assert pkg.effective_level(usr) == RoleType.developer
+    role.level = RoleType.maintainer
+    role.save()
+    usr = User.objects.get(pk=usr.pk)
+    assert pkg.effective_level(usr) == RoleType.maintainer
+
+
+def test_permissions_bulk(packages, users, django_assert_num_queries):
+    usr = users.new("test2@localhost")
+    owned = packages.new_package("owned")
+    shared = packages.new_package("shared")
+    by_group = packages.new_package("by-group")
+    private = packages.new_package("private")
+    owned.owner = usr
+    owned.save()
+    usr.give_access(shared, role="developer")
+    group = Group.objects.create(name="devs")
+    group.user_set.add(usr)
+    by_group.group_roles.add(GroupRole.objects.create(group=group, level=10))
+    usr = User.objects.get(pk=usr.pk)
+    objects = models.Package.objects.all()
+    with django_assert_num_queries(3):
+        levels = models.Package.effective_levels(usr, objects)
+    assert levels == {
+        owned.pk: RoleType.owner,
+        shared.pk: RoleType.developer,
+        by_group.pk: RoleType.maintainer,
+        private.pk: RoleType.anonymous,
+    }
+    with django_assert_num_queries(0):
+        assert all(x.effective_level(usr) == levels[x.pk] for x in objects)
+
+
+def test_index_roles(packages, users, client, django_assert_num_queries):
+    usr = users.new("test2@localhost")
+    for name in ["first", "second", "third"]:
+        usr.give_access(packages.new_package(name), role="developer")
+    packages.new_package("private")
+    client.force_login(usr)
+    client.get("/")
+    # the same number of queries, whatever the number of packages
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/")
+    usr.give_access(packages.new_package("fourth"), role="maintainer")
+    with django_assert_num_queries(len(queries)):
+        response = client.get("/")
+    items = response.soup.find_all("li", class_="list-group-item")
+    assert len(items) == 4
+    badges = sorted(x.find(class_="badge").text for x in items)
+    assert badges == ["developer"] * 3 + ["maintainer"]
+
+
 def test_views(packages, client):
     file = packages.new_file(version="0.1.0")
     pkg = file.package
@@ -71,3 +338,82 @@ def test_views(packages, client):
     assert len(sidebar.find_all("a")) == 4
 
     assert client.get(f"/packages/{pkg.id}/files") == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_blobs_dedup(packages, tmp_path):
+    """ Identical files share one blob, that is removed with the last file. """
+    first = packages.new_file(version="0.1.0")
+    copy = tmp_path / "anchor-0.1.1.tar.gz"
+    shutil.copy(first.path, copy)
+    with copy.open("rb") as fd:
+        metadata = packages.new_metadata(version="0.1.1")
+        second = services.upload_file(packages.user, metadata, fd)
+    blob = models.Blob.objects.get()
+    assert blob.refs == 2
+    assert first.blob == second.blob == blob
+    assert first.path == second.path == blob.path
+    assert blob.size == first.size
+
+    first.delete()
+    blob.refresh_from_db()
+    assert blob.refs == 1
+    assert blob.path.exists()
+    second.delete()
+    # removed after commit
+    assert not models.Blob.objects.exists()
+    assert not blob.path.exists()
+
+
+def test_upload_leftovers(db):
+    upload = HashedUploadedFile("anchor-0.1.0.tar.gz", "application/gzip", 0, None)
+    path = Path(upload.temporary_file_path())
+    upload.write(b"partial")
+    upload.flush()
+    # worker has crashed an hour ago
+    os.utime(path, (time.time() - 7200,) * 2)
+    assert models.Blob.objects.collect()["files"] == 1
+    assert not path.exists()
+    upload.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_blobs_remove_rollback(packages):
+    file = packages.new_file()
+    blob = file.blob
+    models.PackageFile.objects.filter(pk=file.pk).update(blob=None)
+    models.Blob.objects.filter(pk=blob.pk).update(refs=0)
+    with pytest.raises(RuntimeError), transaction.atomic():
+        assert models.Blob.objects.remove_unused(id=blob.id) == (1, blob.size)
+        raise RuntimeError("rollback")
+    # file is removed only after commit
+    assert models.Blob.objects.filter(pk=blob.pk).exists()
+    assert blob.path.exists()
+
+
+def test_blobs_unlink(db):
+    blob = models.Blob.objects.store(ContentFile(b"contents"))
+    # the same contents were stored again before the removal
+    models.Blob.objects._unlink(blob)
+    assert blob.path.read_bytes() == b"contents"
+    models.Blob.objects.filter(pk=blob.pk).delete()
+    models.Blob.objects._unlink(blob)
+    assert not blob.path.exists()
+    assert not list(blob.path.parent.iterdir())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_blobs_collect(packages):
+    file = packages.new_file(version="0.1.0")
+    blob = file.blob
+    models.Blob.objects.filter(pk=blob.pk).update(refs=0)
+    leftover = blob.path.parent.parent.parent / "upload.tmp"
+    leftover.write_bytes(b"garbage")
+    assert models.Blob.objects.collect() == dict(blobs=0, files=0, size=0)
+    blob.refresh_from_db()
+    assert blob.refs == 1, "Refs counter isn't recalculated"
+    models.PackageFile.objects.filter(pk=file.pk).update(blob=None)
+    result = models.Blob.objects.collect(grace=timedelta(0))
+    assert result == dict(blobs=1, files=1, size=blob.size + len(b"garbage"))
+    assert not blob.path.exists()
+    assert not leftover.exists()
@@ -1,15 +1,40 @@
+import collections
+import hashlib
+import http.server
+import io
+import json
 import subprocess
+import tarfile
+import threading
+import time
 import xmlrpc.client
+import zipfile
+from datetime import timedelta
 from pathlib import Path
 
 import pytest
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files import File
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from packaging.utils import canonicalize_version
 
 import anchor
-from anchor.pypi import models, services
+from anchor.packages import jobs
+from anchor.packages.models import Blob, DownloadStats, Job, Package
+from anchor.packages.uploads import HashingUploadHandler
+from anchor.pypi import models, search, services
+from anchor.pypi.index import simple_index, static_index
+from anchor.pypi.mirror import mirror
+from anchor.pypi.tasks import update_static_index
 from anchor.pypi.models import Metadata, PackageFile, Project
+from anchor.users import auth
+from anchor.users.models import ApiToken
 
-from . import PackageFactory, TestCase, basic_auth
+from . import Client, PackageFactory, TestCase, basic_auth
 from .conftest import UserFactory
 
 FORM = {
@@ -49,17 +74,37 @@ def sha256sum(pth: Path):
 
 
 class PyPackageFactory(PackageFactory):
-    def new_form(self, **kwargs) -> dict:
+    def new_form(self, dist: Path = None, **kwargs) -> dict:
         """ Creates new form with a file """
         form = FORM.copy()
         form.update(kwargs)
-        file = self.gen_file("{name}-{version}.tar.gz".format(**form))
+        file = dist or self.gen_file("{name}-{version}.tar.gz".format(**form))
         form["filename"] = file.name
         form["sha256_digest"] = sha256sum(file)
-        fd = file.open("rb")
+        fd = File(file.open("rb"), name=file.name)
+        self._fds.append(fd)
         form["content"] = fd
         return form
 
+    def gen_dist(
+        self, name="anchor", version="0.2.0", wheel=True, metadata_version="2.2"
+    ) -> Path:
+        """ Generates minimal wheel or sdist with the core metadata file. """
+        metadata = (
+            f"Metadata-Version: {metadata_version}\nName: {name}\nVersion: {version}\n"
+        )
+        if wheel:
+            path = self._tmppath / f"{name}-{version}-py3-none-any.whl"
+            with zipfile.ZipFile(path, "w") as whl:
+                whl.writestr(f"{name}-{version}.dist-info/METADATA", metadata)
+            return path
+        path = self._tmppath / f"{name}-{version}.tar.gz"
+        with tarfile.open(path, "w:gz") as sdist:
+            info = tarfile.TarInfo(f"{name}-{version}/PKG-INFO")
+            info.size = len(metadata)
+            sdist.addfile(info, io.BytesIO(metadata.encode()))
+        return path
+
     def new(self, user=None, **kwargs):
         """ Create new package. """
         user = user or self.user
@@ -107,8 +152,7 @@ def upload(pypackages, client, db):
 #########
 
 
-@pytest.mark.unit
-def test_readers(form):
+def test_readers(form, db):
     """Tests for package reading (wheel and tar.gz)"""
     file = form.pop("content")
     file = models.ShaReader(file, 5120, assert_hash=form["sha256_digest"])
@@ -117,12 +161,34 @@ def test_readers(form):
     pkg_file.update(src=file, metadata=metadata)
     origname = Path(file.name).name
     assert pkg_file.filename == origname
-    assert Path(pkg_file.fileobj.name).name == origname
+    assert pkg_file.fileobj.name == pkg_file.blob.name
+    assert pkg_file.path.stat().st_size == pkg_file.size
     # metadata accessing
     assert pkg_file.name == "anchor"
     assert pkg_file.version == canonicalize_version(anchor.__version__)
 
 
+def test_metadata_columns(upload, users, monkeypatch, django_assert_num_queries):
+    users.new(email="test2@localhost", login="test2")
+    assert upload(login="test2", password="123", description="Long text") == 200
+    with CaptureQueriesContext(connection) as queries:
+        file = PackageFile.objects.get()
+    assert "description" not in queries.captured_queries[0]["sql"]
+    assert file.requires_python == FORM["requires_python"]
+    assert file.dist_type == "sdist"
+    loads, original = [], json.loads
+    monkeypatch.setattr(models.json, "loads", lambda x: loads.append(x) or original(x))
+    assert (file.name, file.summary) == ("anchor", FORM["summary"])
+    assert len(loads) == 1
+    monkeypatch.undo()
+    file = PackageFile.objects.get()
+    with django_assert_num_queries(1):
+        metadata = file.metadata
+    assert metadata.description == "Long text"
+    assert metadata.sha256_digest == file.sha256
+    assert metadata.summary == FORM["summary"]
+
+
 def test_anonymous_upload(upload):
     assert upload() == 401
 
@@ -140,14 +206,37 @@ def test_upload(upload, users):
     assert upload(login="test2", password="123") == 200
 
 
-def test_download(file, client):
+def test_download(file, client, download_counter):
     response = client.get(f"/py/download/{file.filename}")
     print(response)
     assert response == 200
+    assert download_counter.flush() == 1
     file.package.refresh_from_db()
     assert file.package.downloads == 1
 
 
+def test_download_url(file, pypackages, client):
+    pypackages.new(user=file.package.owner, version="0.3.0rc1")
+    file.package.refresh_from_db()
+    assert file.package.download_url() == f"/py/download/{file.filename}"
+    assert f'href="/py/download/{file.filename}"' in client.get("/")
+
+
+def test_download_counters(file, client, download_counter):
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(3):
+            client.get(f"/py/download/{file.filename}")
+    assert all(x["sql"].startswith("SELECT") for x in queries)
+    assert download_counter.pending() == 3
+    download_counter.flush()
+    assert not download_counter.pending()
+    file.package.refresh_from_db()
+    assert file.package.downloads == 3
+    stats = DownloadStats.objects.get(file_id=file.id)
+    assert stats.count == 3
+    assert stats.day == timezone.localdate()
+
+
 def test_download_private(users, file, client):
     user = users.new(email="test2@localhost")
     file.package.public = False
@@ -156,6 +245,33 @@ def test_download_private(users, file, client):
     assert client.get(f"/py/download/{file.filename}") != 200
 
 
+def test_download_fast_path(file, client, django_assert_num_queries):
+    """ Anonymous requests to public packages touch neither sessions nor users. """
+    client.cookies["sessionid"] = "missing"
+    with django_assert_num_queries(1):
+        response = client.get(f"/py/download/{file.filename}")
+    assert response == 200
+    assert not hasattr(response.wsgi_request, "_messages")
+    assert "sessionid" not in response.cookies
+    simple_index.files(file.name)
+    with django_assert_num_queries(0):
+        assert client.get(f"/py/simple/{file.name}/") == 200
+
+
+def test_download_fast_path_private(users, file, client):
+    user = users.new(email="test2@localhost", login="test2")
+    user.give_access(file.package, "guest")
+    file.package.public = False
+    file.package.save()
+    url = f"/py/download/{file.filename}"
+    assert client.get(url) == 403
+    assert client.get(url, **basic_auth("test2", "123", {})) == 200
+    _, token = ApiToken.objects.generate(user, "pip", "read")
+    assert client.get(url, **basic_auth("__token__", token, {})) == 200
+    client.force_login(user)
+    assert client.get(url) == 200
+
+
 def test_search(file, client):
     name = file.name
     data = xmlrpc.client.dumps((dict(name=[name]), "and"), "search")
@@ -164,6 +280,91 @@ def test_search(file, client):
     assert name in response
 
 
+@pytest.fixture
+def projects(pypackages, user):
+    def new(name, summary):
+        return pypackages.new(user=user, name=name, summary=summary).package
+
+    return [
+        new("flask-login", "User session management for Flask"),
+        new("loginpass", "Social connections"),
+        new("requests", "HTTP for humans, with session support"),
+        new("session-store", "Key-value store for HTTP sessions"),
+    ]
+
+
+def call_search(client, *params):
+    data = xmlrpc.client.dumps(params, "search")
+    response = client.post("/py/", data=data, content_type="text/xml")
+    assert response == 200
+    (result,), _ = xmlrpc.client.loads(response.content)
+    return [x["name"] for x in result]
+
+
+def test_search_spec(projects, client):
+    assert set(call_search(client, dict(name=["login"]))) == {
+        "flask-login",
+        "loginpass",
+    }
+    # every value is used
+    assert call_search(client, dict(name=["flask", "login"])) == ["flask-login"]
+    assert set(call_search(client, dict(name=["flask", "loginp"]), "or")) == {
+        "flask-login",
+        "loginpass",
+    }
+    assert call_search(client, dict(name=["http"], summary=["http"]), "and") == []
+    # name matches go first
+    found = call_search(client, dict(name=["session"], summary=["session"]), "or")
+    assert found[0] == "session-store"
+    assert set(found) == {"session-store", "flask-login", "requests"}
+    # pagination
+    spec = dict(summary=["session"])
+    found = call_search(client, spec)
+    assert len(found) == 3
+    assert call_search(client, spec, "and", 0, 2) == found[:2]
+    assert call_search(client, spec, "and", 2, 2) == found[2:]
+
+
+def test_search_index_updates(projects, pypackages, user):
+    assert not search.search(dict(summary=["crawler"]))
+    pypackages.new(user=user, name="requests", version="0.3.0", summary="Crawler")
+    assert [x["name"] for x in search.search(dict(summary=["crawler"]))] == ["requests"]
+    projects[2].delete()
+    assert not search.search(dict(summary=["crawler"]))
+
+
+def test_single_table(file, user, client, django_assert_num_queries):
+    other = Package(pkg_type="rpm", name=file.package.name, version="1", owner=user)
+    other.update_time()
+    other.save()
+    assert list(Project.objects.all()) == [file.package]
+    assert PackageFile.objects.get().pkg_type == "python"
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get(f"/py/download/{file.filename}") == 200
+    # no joins with the child tables
+    assert not any("pypi_" in x["sql"] for x in queries.captured_queries)
+    # removal through the base model cleans up python data too
+    Package.objects.filter(pkg_type="python").get().delete()
+    assert Blob.objects.get().refs == 0
+    assert not search.search(dict(name=[file.package.name]))
+    assert Package.objects.get() == other
+
+
+def test_search_fallback(projects):
+    backend = search.SearchBackend()
+    terms = search.parse_spec(dict(name=["session"], summary=["session"]))
+    found = backend.search(terms, "or", 0, 10)
+    assert [x["name"] for x in found][0] == "session-store"
+    assert len(found) == 3
+
+
+def test_search_errors(client):
+    data = xmlrpc.client.dumps((dict(author=["x"]),), "search")
+    response = client.post("/py/", data=data, content_type="text/xml")
+    with pytest.raises(xmlrpc.client.Fault):
+        xmlrpc.client.loads(response.content)
+
+
 def test_lists(file, client):
     """ Tests of PyPI Simple API views. """
     name = file.name
@@ -173,3 +374,408 @@ def test_lists(file, client):
     resp = client.get(f"/py/simple/{name}/")
     assert resp == 200
     assert file.filename in resp
+
+
+def test_lists_cached(file, client, django_assert_num_queries):
+    """ Warm simple index requests should not touch the database. """
+    name = file.name
+    assert client.get(f"/py/simple/{name}/") == 200
+    assert client.get("/py/simple/") == 200
+    with django_assert_num_queries(0):
+        assert file.filename in client.get(f"/py/simple/{name}/")
+        assert name in client.get("/py/simple/")
+
+
+def test_lists_invalidation(file, pypackages, client):
+    name = file.name
+    assert client.get(f"/py/simple/{name}/") == 200
+    new_file = pypackages.new(user=file.package.owner, version="0.3.0")
+    assert new_file.filename in client.get(f"/py/simple/{name}/")
+    new_file.delete()
+    assert new_file.filename not in client.get(f"/py/simple/{name}/")
+    other = pypackages.new(user=file.package.owner, name="other")
+    assert other.name in client.get("/py/simple/")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lists_invalidation_async(pypackages, users, settings, client):
+    settings.PACKAGES_JOBS_ASYNC = True
+    user = users.new("test@localhost")
+    file = pypackages.new(user=user)
+    assert file.filename in client.get(f"/py/simple/{file.name}/")
+    new_file = pypackages.new(user=user, version="0.3.0")
+    # cached page is dropped on commit, without waiting for the workers
+    assert new_file.filename in client.get(f"/py/simple/{file.name}/")
+    assert not Job.objects.filter(task=update_static_index.job_name).exists()
+
+
+def test_lists_canonical_names(pypackages, user, client, django_assert_num_queries):
+    first = pypackages.new(user=user, name="Foo_Bar", version="0.1.0")
+    second = pypackages.new(user=user, name="foo.bar", version="0.2.0")
+    assert Project.objects.get().canonical_name == "foo-bar"
+    assert second.package_id == first.package_id
+    assert 'href="/py/simple/foo-bar/"' in client.get("/py/simple/")
+    for name in ["Foo_Bar", "foo.bar", "FOO--bar"]:
+        with django_assert_num_queries(0):
+            response = client.get(f"/py/simple/{name}/")
+        assert response == 301
+        assert response.get("Location") == "/py/simple/foo-bar/"
+    response = client.get("/py/simple/foo-bar/")
+    assert first.filename in response
+    assert second.filename in response
+
+
+def test_static_index(file, tmp_path):
+    root = tmp_path / "simple"
+    call_command("build_simple_index", output=str(root))
+    assert file.name in (root / "index.html").read_text()
+    page = (root / file.name / "index.html").read_text()
+    assert file.filename in page
+    assert not list(root.glob("**/*.tmp"))
+    # only directories of the index are removed
+    (root / "removed").mkdir()
+    (root / "removed" / static_index.marker).touch()
+    (root / "unrelated").mkdir()
+    call_command("build_simple_index", output=str(root))
+    assert not (root / "removed").exists()
+    assert (root / "unrelated").exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_static_index_hook(pypackages, users, settings, tmp_path):
+    settings.PYPI_STATIC_INDEX_ROOT = str(tmp_path / "simple")
+    user = users.new("test@localhost")
+    file = pypackages.new(user=user)
+    page = tmp_path / "simple" / file.name / "index.html"
+    assert file.filename in page.read_text()
+    file.package.delete()
+    assert not page.exists()
+
+
+@pytest.mark.parametrize("wheel", [True, False])
+def test_core_metadata(pypackages, user, client, wheel):
+    dist = pypackages.gen_dist(wheel=wheel)
+    file = pypackages.new(user=user, dist=dist)
+    assert file.core_metadata_sha256
+    link = client.get(f"/py/simple/{file.name}/").soup.find("a")
+    assert link["data-core-metadata"] == f"sha256={file.core_metadata_sha256}"
+    assert link["data-dist-info-metadata"] == link["data-core-metadata"]
+    response = client.get(f"/py/download/{file.filename}.metadata")
+    assert response == 200
+    assert "Name: anchor" in response
+
+
+@pytest.mark.parametrize("version", ["1.2", "2.1", "garbage"])
+def test_core_metadata_sdist_dynamic(pypackages, user, version):
+    """ Metadata of the older sdists isn't reliable, so it's not served. """
+    dist = pypackages.gen_dist(wheel=False, metadata_version=version)
+    file = pypackages.new(user=user, dist=dist)
+    assert file.core_metadata_sha256 is None
+
+
+def test_core_metadata_job(pypackages, user, settings):
+    settings.PACKAGES_JOBS_ASYNC = True
+    file = pypackages.new(user=user, dist=pypackages.gen_dist(wheel=True))
+    assert file.core_metadata_sha256 is None
+    assert jobs.Worker().run_pending()
+    file.refresh_from_db()
+    assert file.core_metadata_sha256
+
+
+def test_no_core_metadata(file, client):
+    assert file.core_metadata_sha256 is None
+    assert "data-core-metadata" not in client.get(f"/py/simple/{file.name}/")
+    assert client.get(f"/py/download/{file.filename}.metadata") == 404
+
+
+def test_download_streamed(file, client):
+    response = client.get(f"/py/download/{file.filename}")
+    assert response == 200
+    assert int(response.get("Content-Length")) == file.size
+    assert response.get("Content-Type") == "application/gzip"
+    assert b"".join(response.streaming_content) == file.path.read_bytes()
+
+
+@pytest.mark.parametrize(
+    "mode,header", [("nginx", "X-Accel-Redirect"), ("sendfile", "X-Sendfile")]
+)
+def test_download_offload(file, client, settings, mode, header):
+    settings.PACKAGES_DOWNLOAD_OFFLOAD = mode
+    response = client.get(f"/py/download/{file.filename}")
+    assert response == 200
+    assert not response.content
+    value = response.get(header)
+    assert value.endswith(file.fileobj.name)
+    if mode == "nginx":
+        assert value.startswith("/protected/")
+    else:
+        assert value == str(file.path)
+
+
+def test_download_conditional(file, client, download_counter):
+    response = client.get(f"/py/download/{file.filename}")
+    etag = response.get("ETag")
+    assert etag == f'"{file.sha256}"'
+    last_modified = response.get("Last-Modified")
+    url = f"/py/download/{file.filename}"
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag) == 304
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified) == 304
+    assert client.get(url, HTTP_IF_NONE_MATCH='"other"') == 200
+    assert download_counter.pending() == 2
+
+
+def test_download_range(file, client, download_counter):
+    url = f"/py/download/{file.filename}"
+    data = file.path.read_bytes()
+    response = client.get(url, HTTP_RANGE="bytes=10-19")
+    assert response == 206
+    assert response.get("Content-Range") == f"bytes 10-19/{len(data)}"
+    assert b"".join(response.streaming_content) == data[10:20]
+    response = client.get(url, HTTP_RANGE="bytes=-5")
+    assert b"".join(response.streaming_content) == data[-5:]
+    response = client.get(url, HTTP_RANGE="bytes=100-")
+    assert b"".join(response.streaming_content) == data[100:]
+    assert client.get(url, HTTP_RANGE=f"bytes={len(data)}-") == 416
+    # file has changed since the first part was downloaded
+    assert client.get(url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"old"') == 200
+    assert download_counter.pending() == 1
+
+
+def test_upload_single_pass(upload, users, monkeypatch, settings):
+    users.new(email="test2@localhost", login="test2")
+    read = models.ShaReader.read
+    monkeypatch.setattr(models.ShaReader, "read", lambda *args: pytest.fail())
+    assert upload(login="test2", password="123") == 200
+    monkeypatch.setattr(models.ShaReader, "read", read)
+    file = PackageFile.objects.get()
+    assert sha256sum(file.path) == file.sha256
+    assert oct(file.path.stat().st_mode & 0o777) == "0o644"
+    assert not list(Path(settings.MEDIA_ROOT, "blobs").glob("*.tmp"))
+
+
+def test_upload_limits(upload, users, monkeypatch, pypackages, client):
+    users.new(email="test2@localhost", login="test2")
+    monkeypatch.setattr(HashingUploadHandler, "max_size_kb", 1)
+    response = upload(login="test2", password="123")
+    assert response == 400
+    assert "exceeds" in response
+    monkeypatch.undo()
+    form = pypackages.new_form()
+    form["sha256_digest"] = "0" * 64
+    response = client.post("/py/upload/", form, **basic_auth("test2", "123", {}))
+    assert response == 400
+    assert "checksum" in response
+    assert not PackageFile.objects.exists()
+
+
+def test_upload_tokens(upload, users, client):
+    user = users.new(email="test2@localhost", login="test2")
+    _, read = ApiToken.objects.generate(user, "pip", "read")
+    _, raw = ApiToken.objects.generate(user, "CI", "upload")
+    assert upload(login="__token__", password=read) == 403
+    assert upload(login="__token__", password=raw + "x") == 401
+    assert upload(login="__token__", password="anchor-0000.secret") == 401
+    assert upload(login="__token__", password=raw) == 200
+    assert not Session.objects.exists()
+    user.is_active = False
+    user.save()
+    assert upload(login="__token__", password=raw, version="0.3.0") == 401
+    # passwords that look like tokens are still passwords
+    users.new(email="test3@localhost", login="test3", password="anchor-secret")
+    assert upload(login="test3", password="anchor-secret", name="other") == 200
+
+
+def test_upload_credentials_cache(upload, users, monkeypatch):
+    user = users.new(email="test2@localhost", login="test2")
+    calls = []
+    authenticate = auth.auth.authenticate
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs)
+        return authenticate(*args, **kwargs)
+
+    monkeypatch.setattr(auth.auth, "authenticate", counted)
+    assert upload(login="test2", password="123") == 200
+    assert upload(login="test2", password="123", version="0.3.0") == 200
+    assert len(calls) == 1
+    # password hash isn't exposed to the cache
+    cached = b"".join(cache._cache.values())
+    assert user.password.encode() not in cached
+    assert upload(login="test2", password="wrong", version="0.4.0") == 401
+    user.set_password("456")
+    user.save()
+    assert upload(login="test2", password="123", version="0.4.0") == 401
+    assert len(calls) == 3
+
+
+class Upstream(http.server.ThreadingHTTPServer):
+    """ Index with the single project, counts requests by path. """
+
+    contents = b"upstream wheel contents"
+    sha256 = hashlib.sha256(contents).hexdigest()
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.hits = collections.Counter()
+        # seconds between the parts of the file, to emulate slow transfers
+        self.delay = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/simple/"
+
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits[self.path] += 1
+        if self.path == "/simple/requests/":
+            body = (
+                '<a href="../../files/requests-2.0-py3-none-any.whl'
+                f'#sha256={self.server.sha256}" data-requires-python="&gt;=3.6">'
+                "requests-2.0-py3-none-any.whl</a>"
+            ).encode()
+        elif self.path == "/files/requests-2.0-py3-none-any.whl":
+            body = self.server.contents
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not self.server.delay:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), 4):
+            self.wfile.write(body[start : start + 4])
+            self.wfile.flush()
+            time.sleep(self.server.delay)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(settings, db):
+    server = Upstream()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.PYPI_UPSTREAM_URL = server.url
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_mirror_pages(upstream, client, django_assert_num_queries):
+    response = client.get("/py/simple/requests/")
+    assert response == 200
+    link = response.soup.find("a")
+    assert link["href"] == (
+        f"/py/download/requests-2.0-py3-none-any.whl#sha256={upstream.sha256}"
+    )
+    assert link["data-requires-python"] == ">=3.6"
+    with django_assert_num_queries(0):
+        assert client.get("/py/simple/requests/") == 200
+    assert upstream.hits["/simple/requests/"] == 1
+    # missing projects are remembered too
+    assert client.get("/py/simple/missing/") == 404
+    with django_assert_num_queries(0):
+        assert client.get("/py/simple/missing/") == 404
+    assert upstream.hits["/simple/missing/"] == 1
+
+
+def test_mirror_stale_pages(upstream, settings):
+    settings.PACKAGES_JOBS_ASYNC = True
+    settings.PYPI_UPSTREAM_TTL = 0
+    page = mirror.files("requests")
+    # stale page is served, fresh one is fetched by the worker
+    assert mirror.files("requests") == page
+    assert mirror.files("requests") == page
+    assert upstream.hits["/simple/requests/"] == 1
+    assert jobs.Worker().run_pending() == 1
+    assert upstream.hits["/simple/requests/"] == 2
+
+
+def test_mirror_local_projects(
+    upstream, file, pypackages, client, django_assert_num_queries
+):
+    assert file.filename in client.get(f"/py/simple/{file.name}/")
+    with django_assert_num_queries(0):
+        assert file.filename in client.get(f"/py/simple/{file.name}/")
+    assert client.get(f"/py/download/{file.filename}") == 200
+    assert not upstream.hits
+    # uploaded project replaces the mirrored one
+    assert "requests-2.0" in client.get("/py/simple/requests/")
+    local = pypackages.new(user=file.package.owner, name="requests")
+    page = client.get("/py/simple/requests/")
+    assert local.filename in page
+    assert "requests-2.0" not in page
+
+
+def test_mirror_download(upstream, client):
+    assert client.get("/py/simple/requests/") == 200
+    response = client.get("/py/download/requests-2.0-py3-none-any.whl")
+    assert response == 200
+    assert b"".join(response.streaming_content) == upstream.contents
+    pkg_file = models.UpstreamFile.objects.get()
+    assert pkg_file.blob.sha256 == upstream.sha256
+    assert pkg_file.path.read_bytes() == upstream.contents
+    assert pkg_file.fetching is None
+    # served from the storage
+    response = client.get("/py/download/requests-2.0-py3-none-any.whl")
+    assert response.get("ETag") == f'"{upstream.sha256}"'
+    assert b"".join(response.streaming_content) == upstream.contents
+    assert upstream.hits["/files/requests-2.0-py3-none-any.whl"] == 1
+    # mirrored blobs survive the garbage collection
+    Blob.objects.collect(grace=timedelta(0))
+    assert Blob.objects.get().refs == 1
+    assert pkg_file.path.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_mirror_concurrent_downloads(upstream, settings):
+    settings.PYPI_UPSTREAM_LEASE = 1
+    mirror.files("requests")
+    # the transfer takes longer than the lease
+    upstream.delay = 0.3
+    url = "/py/download/requests-2.0-py3-none-any.whl"
+    first = Client().get(url)
+    received = []
+
+    def download():
+        try:
+            received.append(b"".join(Client().get(url).streaming_content))
+        finally:
+            connections.close_all()
+
+    waiting = threading.Thread(target=download)
+    waiting.start()
+    assert b"".join(first.streaming_content) == upstream.contents
+    waiting.join()
+    assert received == [upstream.contents]
+    assert upstream.hits["/files/requests-2.0-py3-none-any.whl"] == 1
+
+
+def test_mirror_lost_claim(upstream, client, settings):
+    # claim is renewed with every chunk
+    settings.PYPI_UPSTREAM_LEASE = 0
+    mirror.files("requests")
+    response = client.get("/py/download/requests-2.0-py3-none-any.whl")
+    # another request has taken over the fetch
+    takeover = timezone.now() + timedelta(minutes=1)
+    models.UpstreamFile.objects.update(fetching=takeover)
+    assert b"".join(response.streaming_content) == upstream.contents
+    pkg_file = models.UpstreamFile.objects.get()
+    assert pkg_file.blob is None
+    assert pkg_file.fetching == takeover
+    assert not Blob.objects.exists()
+
+
+def test_mirror_single_fetch(upstream):
+    mirror.files("requests")
+    pkg_file = models.UpstreamFile.objects.get()
+    timeout = timedelta(minutes=1)
+    assert models.UpstreamFile.objects.claim(pkg_file.pk, timeout)
+    assert not models.UpstreamFile.objects.claim(pkg_file.pk, timeout)
+    # the request that was fetching the file has gone
+    later = timezone.now() + timeout * 2
+    assert models.UpstreamFile.objects.claim(pkg_file.pk, timeout, now=later)